@@ -0,0 +1,342 @@
+import os
+import math
+import time
+import bisect
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+import deadlines
+
+# --- ADMISSION CONTROL SETTINGS ---
+# Limits on calls to the upstream, per worker process (divide the account's limits by the
+# number of workers). 0 means unlimited; with every limit at 0 nothing ever waits.
+UPSTREAM_RPS = float(os.getenv("UPSTREAM_RPS", "0"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "0")) or max(1.0, UPSTREAM_RPS)
+UPSTREAM_TOKENS_PER_MIN = float(os.getenv("UPSTREAM_TOKENS_PER_MIN", "0"))
+UPSTREAM_MAX_CONCURRENT = int(os.getenv("UPSTREAM_MAX_CONCURRENT", "0"))
+# Tokens reserved for a call before its usage block says what it really cost
+ADMISSION_EST_TOKENS = int(os.getenv("ADMISSION_EST_TOKENS", "1500"))
+
+# Callers that can't be admitted straight away queue here, best lane first. Once the queue
+# is full, or the rate limits alone would keep a caller waiting past its lane's longest wait,
+# it is turned away with a 503; if the request's own deadline (deadlines.py) is what runs out
+# first, with a 504. Callers held back only by UPSTREAM_MAX_CONCURRENT queue until a call
+# finishes (or their wait runs out): how long calls take can't be known in advance.
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "20"))
+ADMISSION_BACKGROUND_WAIT = float(os.getenv("ADMISSION_BACKGROUND_WAIT", "240"))
+
+# lane -> (priority, longest wait). Lower priority numbers are admitted first.
+LANES = {
+    "api": (0, ADMISSION_MAX_WAIT),
+    "web": (1, ADMISSION_MAX_WAIT),
+    "background": (2, ADMISSION_BACKGROUND_WAIT),
+}
+DEFAULT_LANE = "background"
+
+_lane = contextvars.ContextVar("admission_lane", default=DEFAULT_LANE)
+
+
+def set_lane(lane):
+    """Sets the priority lane for upstream calls made by the current request."""
+    _lane.set(lane)
+
+
+class Overloaded(Exception):
+    """The upstream can't take this call in time. Routes answer 503 with Retry-After."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _Waiter:
+    def __init__(self, priority, deadline, notify, request_deadline=False):
+        self.priority = priority
+        self.deadline = deadline
+        # The deadline is the request's own rather than the lane's longest wait
+        self.request_deadline = request_deadline
+        self.notify = notify
+        self.granted = False
+        self.displaced = False
+
+
+class Ticket:
+    """An admitted upstream call. Its slot is freed when the admit() block ends, unless kept."""
+
+    def __init__(self, waited, release):
+        # Seconds spent queued before admission
+        self.waited = waited
+        self.kept = False
+        self._release = release
+        self._lock = threading.Lock()
+
+    def keep(self):
+        """Holds the slot past the admit() block, until release() is called."""
+        self.kept = True
+
+    def release(self):
+        """Frees the slot. Only the first call does anything."""
+        with self._lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class AdmissionController:
+    """Token buckets (requests/s and tokens/min) plus a concurrency cap, with a prioritized, bounded wait queue."""
+
+    def __init__(self, rps=UPSTREAM_RPS, burst=UPSTREAM_BURST, tokens_per_min=UPSTREAM_TOKENS_PER_MIN,
+                 max_concurrent=UPSTREAM_MAX_CONCURRENT, est_tokens=ADMISSION_EST_TOKENS,
+                 queue_size=ADMISSION_QUEUE_SIZE):
+        self.rps = rps
+        self.burst = burst
+        self.tokens_per_min = tokens_per_min
+        self.max_concurrent = max_concurrent
+        self.est_tokens = min(est_tokens, tokens_per_min) if tokens_per_min else est_tokens
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+        self._requests = burst
+        self._tokens = tokens_per_min
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        # Moving average of how long an admitted call holds its slot, for Retry-After
+        self._mean_hold = 0.0
+        self._queue = []  # sorted by (priority, seq)
+        self._seq = itertools.count()
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_deadline": 0,
+                         "displaced": 0, "upstream_throttled": 0}
+
+    # --- bucket arithmetic (callers hold self._lock) ---
+    def _refill(self, now):
+        elapsed = now - self._stamp
+        self._stamp = now
+        if self.rps:
+            self._requests = min(self.burst, self._requests + elapsed * self.rps)
+        if self.tokens_per_min:
+            self._tokens = min(self.tokens_per_min, self._tokens + elapsed * self.tokens_per_min / 60)
+
+    def _wait_time(self, now):
+        """Seconds until one more call fits the limits (inf while the concurrency cap is reached)."""
+        if self.max_concurrent and self._in_flight >= self.max_concurrent:
+            return math.inf
+        return self._bucket_wait(now)
+
+    def _bucket_wait(self, now):
+        """Seconds until the rate limits (and any upstream 429 pause) allow one more call."""
+        wait = max(0.0, self._paused_until - now)
+        if self.rps and self._requests < 1:
+            wait = max(wait, (1 - self._requests) / self.rps)
+        if self.tokens_per_min and self._tokens < self.est_tokens:
+            wait = max(wait, (self.est_tokens - self._tokens) * 60 / self.tokens_per_min)
+        return wait
+
+    def _take(self):
+        if self.rps:
+            self._requests -= 1
+        if self.tokens_per_min:
+            self._tokens -= self.est_tokens
+        self._in_flight += 1
+        self.counters["admitted"] += 1
+
+    def _expected_wait(self, now, ahead):
+        """Rough wait the rate limits impose on a caller with `ahead` callers before it."""
+        wait = self._bucket_wait(now)
+        if self.rps:
+            wait = max(wait, (ahead + 1 - self._requests) / self.rps)
+        if self.tokens_per_min:
+            wait = max(wait, ((ahead + 1) * self.est_tokens - self._tokens) * 60 / self.tokens_per_min)
+        return wait
+
+    def _grant_waiting(self, now):
+        self._refill(now)
+        while self._queue and self._wait_time(now) == 0:
+            _, _, waiter = self._queue.pop(0)
+            self._take()
+            waiter.granted = True
+            waiter.notify()
+
+    def _concurrency_wait(self, ahead):
+        """Rough wait for a free slot under the concurrency cap: calls to finish first x mean hold time."""
+        if not self.max_concurrent:
+            return 0.0
+        behind = ahead + 1 - (self.max_concurrent - self._in_flight)
+        return max(0, math.ceil(behind / self.max_concurrent)) * self._mean_hold
+
+    def _retry_after(self, now):
+        ahead = len(self._queue)
+        return max(self._expected_wait(now, ahead), self._concurrency_wait(ahead))
+
+    # --- admission ---
+    def _enqueue(self, lane, deadline, notify):
+        """Admits straight away (returns None), queues (returns a waiter) or sheds (raises Overloaded)."""
+        priority, max_wait = LANES.get(lane, LANES[DEFAULT_LANE])
+        now = time.monotonic()
+        request_deadline = deadline is not None and deadline < now + max_wait
+        deadline = deadline if request_deadline else now + max_wait
+        with self._lock:
+            self._grant_waiting(now)
+            if not self._queue and self._wait_time(now) == 0:
+                self._take()
+                return None
+
+            if len(self._queue) >= self.queue_size:
+                # A full queue still makes room for a better lane by turning away its newest worst entry
+                worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+                if worst[0] <= priority:
+                    self.counters["shed_queue_full"] += 1
+                    raise Overloaded("Server busy, upstream queue is full", self._retry_after(now))
+                self._queue.remove(worst)
+                worst[2].displaced = True
+                worst[2].notify()
+                self.counters["displaced"] += 1
+
+            ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+            if now + self._expected_wait(now, ahead) > deadline:
+                self.counters["shed_deadline"] += 1
+                if request_deadline:
+                    raise deadlines.exceeded("queue")
+                raise Overloaded("Server busy, upstream capacity is exhausted", self._retry_after(now))
+
+            waiter = _Waiter(priority, deadline, notify, request_deadline)
+            bisect.insort(self._queue, (priority, next(self._seq), waiter))
+            self.counters["queued"] += 1
+            return waiter
+
+    def _check(self, waiter):
+        """After a wakeup: True once admitted; raises Overloaded if displaced or out of time."""
+        now = time.monotonic()
+        with self._lock:
+            if not waiter.granted and not waiter.displaced:
+                self._grant_waiting(now)
+            if waiter.granted:
+                return True
+            if waiter.displaced:
+                raise Overloaded("Server busy, displaced by higher-priority requests", self._retry_after(now))
+            if now >= waiter.deadline:
+                self._drop(waiter)
+                self.counters["shed_deadline"] += 1
+                if waiter.request_deadline:
+                    raise deadlines.exceeded("queue")
+                raise Overloaded("Server busy, timed out waiting for upstream capacity", self._retry_after(now))
+            return False
+
+    def _next_wakeup(self, waiter):
+        """How long a waiter sleeps before re-checking: until the bucket refills or its deadline."""
+        now = time.monotonic()
+        with self._lock:
+            return max(0.001, min(waiter.deadline - now, self._wait_time(now)))
+
+    def _drop(self, waiter):
+        self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+
+    def _abandon(self, waiter):
+        """The caller went away while queued (or just after being admitted)."""
+        with self._lock:
+            if waiter.granted:
+                self._in_flight -= 1
+                self._grant_waiting(time.monotonic())
+            else:
+                self._drop(waiter)
+
+    def release(self, held=None):
+        """Frees an admitted call's slot. held is how long it was held, when known."""
+        with self._lock:
+            self._in_flight -= 1
+            if held is not None:
+                self._mean_hold = held if not self._mean_hold else 0.8 * self._mean_hold + 0.2 * held
+            self._grant_waiting(time.monotonic())
+
+    def try_admit(self):
+        """Admits an optional extra call (a hedge) only if it fits right now and nobody is queued.
+
+        Returns True if admitted; the caller must release() afterwards.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._grant_waiting(now)
+            if self._queue or self._wait_time(now) > 0:
+                return False
+            self._take()
+            return True
+
+    def settle(self, total_tokens):
+        """Corrects a call's token reservation once its usage block says what it really cost."""
+        if not total_tokens or not self.tokens_per_min:
+            return
+        with self._lock:
+            # Can go negative: an expensive call delays the next ones
+            self._tokens -= total_tokens - self.est_tokens
+
+    def throttled(self, retry_after):
+        """The upstream said 429: hold every admission in this worker for retry_after seconds."""
+        with self._lock:
+            self.counters["upstream_throttled"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    @contextmanager
+    def admit(self, lane=None, deadline=None):
+        """Blocks until this thread may call the upstream.
+
+        deadline is a time.monotonic() value, by default the current request's (deadlines.current()).
+        """
+        start = time.monotonic()
+        event = threading.Event()
+        waiter = self._enqueue(lane or _lane.get(), deadline or deadlines.current(), event.set)
+        if waiter is not None:
+            try:
+                while not self._check(waiter):
+                    event.wait(self._next_wakeup(waiter))
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        admitted = time.monotonic()
+        ticket = Ticket(admitted - start, lambda: self.release(time.monotonic() - admitted))
+        try:
+            yield ticket
+        finally:
+            if not ticket.kept:
+                ticket.release()
+
+    @asynccontextmanager
+    async def admit_async(self, lane=None, deadline=None):
+        """admit() for the event loop: queued tasks wait without blocking it."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enqueue(lane or _lane.get(), deadline or deadlines.current(),
+                               lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is not None:
+            try:
+                while not self._check(waiter):
+                    try:
+                        await asyncio.wait_for(event.wait(), self._next_wakeup(waiter))
+                    except asyncio.TimeoutError:
+                        pass
+                    event.clear()
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        admitted = time.monotonic()
+        ticket = Ticket(admitted - start, lambda: self.release(time.monotonic() - admitted))
+        try:
+            yield ticket
+        finally:
+            if not ticket.kept:
+                ticket.release()
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            stats = dict(self.counters)
+            stats.update(in_flight=self._in_flight, queued_now=len(self._queue), mean_hold_s=round(self._mean_hold, 3),
+                         request_tokens=round(self._requests, 2), llm_tokens=round(self._tokens))
+        return stats
+
+
+admission = AdmissionController()
@@ -1,19 +1,78 @@
+import io
 import os
+import hmac
 import json
+import mmap
+import queue
 import base64
+import binascii
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from flask import Flask, request, render_template_string, jsonify
+from flask import Flask, request, render_template_string, jsonify, Response, g
 from dotenv import load_dotenv
-import fitz  # PyMuPDF for handling PDFs
+from upstream import (get_upstream_client, build_chat_body, iter_stream_content, retry_after_seconds, IMAGE_PLACEHOLDER,
+                      CONNECT_TIMEOUT, READ_TIMEOUT)
+from jsonstream import ObjectStreamParser
+from cache import result_cache, cache_key
+from singleflight import in_flight
+from admission import admission, set_lane, Overloaded
+import deadlines
+from deadlines import DeadlineExceeded, DEADLINE_HEADER
+from hedging import ModelRouter, AttemptCancelled, race
+from jobs import job_queue, check_webhook_url, UnsafeWebhook, JOBS_DRAINER
+from imaging import normalize_image, pipeline_signature, IMAGE_NORMALIZE, IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY, OUTPUT_FORMATS
+from quality import check_image, check_raster, UnusableImage, QUALITY_GATE, QUALITY_ANALYSIS_EDGE
+from mrz import find_mrz, parse_mrz, mrz_to_schema, apply_mrz
+from pdf_tools import read_text_layer, render_upstream_image, render_passport_pages, EMPTY_RESULT
+from validation import find_problems, followup_prompt, crop_for_fields, merge_fields, REEXTRACT_ENABLED
+from tiling import compose_tiles, parse_tiles, TILE_COUNT, TILE_MAX_COUNT
+from structured import structured_request, field_name, expand_keys, STRUCTURED_OUTPUT, EXTRACTION_MODE
+from assets import PrecompressedAsset
+from profiling import (profiler, request_started, request_finished, requests_in_flight, sample_stacks,
+                       memory_report, start_tracing, PROFILE_MAX_REQUESTS, PROFILE_MAX_SECONDS)
+import metrics
 
 # Load environment variables
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Overridable so benchmarks can point at a local stand-in (bench/fake_openrouter.py)
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 # Create a secret key for YOUR newly built API
 MY_APP_API_KEY = os.getenv("MY_APP_API_KEY") 
 
+# Models, prompt revision and EXTRACTION_MODE are part of the result cache key:
+# bump PROMPT_VERSION whenever the prompt or schema changes.
+MODEL = "google/gemini-3-flash-preview:online"
+PROMPT_VERSION = "1"
+
+# Comma-separated models to race, best first. With more than one, a call the first model is
+# slow to answer (past its own p90) is hedged on the next; see hedging.py for the knobs.
+MODELS = [model.strip() for model in os.getenv("OPENROUTER_MODELS", MODEL).split(",") if model.strip()]
+MODEL_PLACEHOLDER = "__MODEL__"
+
+# What to do with a machine readable zone we can read locally:
+# "fast" answers from a valid MRZ without calling the LLM, "verify" always calls the LLM
+# and cross-checks it against the MRZ, "off" ignores the MRZ.
+MRZ_MODE = os.getenv("MRZ_MODE", "fast")
+
+# Answer digitally generated PDFs from their text layer when it holds the data we need
+PDF_TEXT_FAST_PATH = os.getenv("PDF_TEXT_FAST_PATH", "1") != "0"
+
+# Batch endpoint limits: items per request and how many go upstream at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
 app = Flask(__name__)
+# Latency statistics per model, used to order the candidates and time the hedges
+model_router = ModelRouter(MODELS)
+# Reject oversized uploads before they are spooled
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# The frontend is rendered once per process; browsers may reuse it this long, then revalidate by ETag
+FRONTEND_MAX_AGE = int(os.getenv("FRONTEND_MAX_AGE", "86400"))
 
 # --- HTML FRONTEND TEMPLATE (SCI-FI UI UPGRADE) ---
 HTML_TEMPLATE = """
@@ -218,6 +277,15 @@ HTML_TEMPLATE = """
             animation: glitch 1.5s infinite;
         }
 
+        #uploadStats {
+            display: none;
+            text-align: center;
+            margin-top: 0.75rem;
+            font-family: 'Inter', sans-serif;
+            font-size: 0.8rem;
+            color: #8b9bb4;
+        }
+
         @keyframes glitch {
             0%, 100% { opacity: 1; transform: translateX(0); }
             33% { opacity: 0.8; transform: translateX(-1px); }
@@ -328,6 +396,7 @@ HTML_TEMPLATE = """
 
             <button type="submit" class="btn" id="submitBtn">Execute Scan</button>
             <div id="loadingText">DECRYPTING VISUAL DATA...</div>
+            <div id="uploadStats"></div>
         </form>
 
         <div id="results">
@@ -336,7 +405,40 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <!-- Runs in a Web Worker: decodes (applying EXIF orientation), downscales and re-encodes an image off the UI thread -->
+    <script type="text/js-worker" id="prepWorkerSource">
+        async function encode(canvas, type, quality) {
+            const blob = await canvas.convertToBlob({ type, quality });
+            // Browsers without a WebP encoder quietly hand back PNG
+            return blob.type === type ? blob : canvas.convertToBlob({ type: 'image/jpeg', quality });
+        }
+
+        self.onmessage = async (e) => {
+            const { file, limits } = e.data;
+            try {
+                const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+                const scale = Math.min(1, limits.max_edge / Math.max(bitmap.width, bitmap.height));
+                const width = Math.round(bitmap.width * scale);
+                const height = Math.round(bitmap.height * scale);
+                const canvas = new OffscreenCanvas(width, height);
+                const ctx = canvas.getContext('2d');
+                // JPEG has no alpha: flatten onto white like the server does
+                ctx.fillStyle = '#fff';
+                ctx.fillRect(0, 0, width, height);
+                ctx.imageSmoothingQuality = 'high';
+                ctx.drawImage(bitmap, 0, 0, width, height);
+                bitmap.close();
+                self.postMessage({ blob: await encode(canvas, limits.mime_type, limits.quality / 100) });
+            } catch (err) {
+                self.postMessage({ error: String(err) });
+            }
+        };
+    </script>
+
     <script>
+        // Upload limits advertised by the server (also at /api/v1/limits): images are shrunk in the
+        // browser to what the server would send upstream anyway, so phone photos upload much faster
+        const LIMITS = {{ limits|tojson }};
         const imageInput = document.getElementById('imageInput');
         const previewContainer = document.getElementById('previewContainer');
         const imagePreview = document.getElementById('imagePreview');
@@ -346,6 +448,7 @@ HTML_TEMPLATE = """
         const loadingText = document.getElementById('loadingText');
         const scannerLine = document.getElementById('scannerLine');
         const resultsDiv = document.getElementById('results');
+        const uploadStats = document.getElementById('uploadStats');
 
         // Handle Image & PDF Preview
         imageInput.addEventListener('change', function() {
@@ -375,63 +478,195 @@ HTML_TEMPLATE = """
             }
         });
 
+        // Client-side preprocessing; anything unsupported (PDFs, old browsers, formats the browser
+        // can't decode) uploads the original file, which the server still accepts
+        let prepWorker = null;
+
+        function canPreprocess(file) {
+            return LIMITS.preprocess && file.type.startsWith('image/') && typeof Worker !== 'undefined'
+                && typeof OffscreenCanvas !== 'undefined' && typeof createImageBitmap !== 'undefined';
+        }
+
+        // Resolves to the shrunk image, or null to upload the original
+        function preprocessImage(file) {
+            if (!canPreprocess(file)) return Promise.resolve(null);
+            return new Promise((resolve) => {
+                try {
+                    if (!prepWorker) {
+                        const source = document.getElementById('prepWorkerSource').textContent;
+                        prepWorker = new Worker(URL.createObjectURL(new Blob([source], { type: 'text/javascript' })));
+                    }
+                } catch (err) {
+                    resolve(null);
+                    return;
+                }
+                prepWorker.onmessage = (e) => resolve(e.data.blob && e.data.blob.size < file.size ? e.data.blob : null);
+                prepWorker.onerror = () => resolve(null);
+                prepWorker.postMessage({ file, limits: LIMITS });
+            });
+        }
+
+        function formatBytes(bytes) {
+            if (bytes < 1024 * 1024) return (bytes / 1024).toFixed(0) + ' KB';
+            return (bytes / 1024 / 1024).toFixed(1) + ' MB';
+        }
+
+        function showUploadStats(originalBytes, sentBytes, prepMs, uploadMs) {
+            let text = `SENT ${formatBytes(sentBytes)}`;
+            if (prepMs !== null) {
+                const saved = Math.round(100 * (1 - sentBytes / originalBytes));
+                text = `SHRUNK ${formatBytes(originalBytes)} &rarr; ${formatBytes(sentBytes)} (-${saved}%) IN ${Math.round(prepMs)} MS // ` + text;
+            }
+            uploadStats.innerHTML = text + ` IN ${(uploadMs / 1000).toFixed(2)} S`;
+            uploadStats.style.display = 'block';
+        }
+
+        // Results table helpers: rows can arrive one at a time while streaming
+        const contentDiv = document.getElementById('resultContent');
+
+        function formatKey(key) {
+            return key.replace(/_/g, ' ').replace(/\\b\\w/g, l => l.toUpperCase());
+        }
+
+        function startTable() {
+            contentDiv.innerHTML = '<table><tbody id="resultRows"></tbody></table>';
+            resultsDiv.style.display = 'block';
+        }
+
+        function setRow(key, value) {
+            const rows = document.getElementById('resultRows');
+            let row = Array.from(rows.children).find(r => r.dataset.key === key);
+            if (!row) {
+                row = document.createElement('tr');
+                row.dataset.key = key;
+                row.innerHTML = `<th>${formatKey(key)}</th><td></td>`;
+                rows.appendChild(row);
+            }
+            row.querySelector('td').innerHTML = value ? value : `<span class="empty-field">NULL_VALUE</span>`;
+        }
+
+        function renderTable(extractedData) {
+            startTable();
+            for (const [key, value] of Object.entries(extractedData)) {
+                setRow(key, value);
+            }
+        }
+
+        function showRawOutput(raw) {
+            contentDiv.innerHTML = `<div style="color:#ff00ea; padding: 1rem; border: 1px solid #ff00ea;"><strong>PARSE ERROR. Raw output:</strong><br><code>${raw}</code></div>`;
+            resultsDiv.style.display = 'block';
+        }
+
+        // Reads a Server-Sent Events stream: 'field' events fill rows as the model writes them,
+        // 'done' carries the final validated object, 'error' ends the scan
+        async function readEventStream(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let first = true;
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) return;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let eventName = 'message';
+                    let payload = '';
+                    for (const line of rawEvent.split('\\n')) {
+                        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                        if (line.startsWith('data:')) payload += line.slice(5).trim();
+                    }
+                    if (!payload) continue;
+                    const data = JSON.parse(payload);
+
+                    if (eventName === 'field') {
+                        if (first) {
+                            startTable();
+                            first = false;
+                        }
+                        setRow(data.key, data.value);
+                    } else if (eventName === 'done') {
+                        renderTable(data.data);
+                        return;
+                    } else if (eventName === 'error') {
+                        if (data.raw_output) {
+                            showRawOutput(data.raw_output);
+                        } else {
+                            alert('SYSTEM ERROR: ' + data.error);
+                        }
+                        return;
+                    }
+                }
+            }
+        }
+
         // Handle Form Submission
         document.getElementById('uploadForm').addEventListener('submit', async (e) => {
             e.preventDefault();
             const file = imageInput.files[0];
             if (!file) return;
 
-            const formData = new FormData();
-            formData.append('image', file);
-
             // UI Loading State
             submitBtn.disabled = true;
             submitBtn.innerText = 'PROCESSING...';
             loadingText.style.display = 'block';
             scannerLine.style.display = 'block'; 
             resultsDiv.style.display = 'none';
+            uploadStats.style.display = 'none';
 
             try {
-                const response = await fetch('/web-extract', {
+                const prepStart = performance.now();
+                const shrunk = await preprocessImage(file);
+                const prepMs = performance.now() - prepStart;
+
+                const formData = new FormData();
+                if (shrunk) {
+                    const extension = shrunk.type === 'image/webp' ? '.webp' : '.jpg';
+                    formData.append('image', shrunk, file.name.replace(/[.][^.]*$/, '') + extension);
+                    // Lets the server count the bytes saved
+                    formData.append('original_bytes', file.size);
+                } else {
+                    formData.append('image', file);
+                }
+
+                // Streamed responses start once the upload has been read, so this is close to the upload time
+                const uploadStart = performance.now();
+                const response = await fetch('/web-extract?stream=1', {
                     method: 'POST',
+                    headers: { 'Accept': 'text/event-stream' },
                     body: formData
                 });
-                
-                const data = await response.json();
-                
-                if (data.error) {
-                    alert('SYSTEM ERROR: ' + data.error);
+                showUploadStats(file.size, shrunk ? shrunk.size : file.size, shrunk ? prepMs : null,
+                                performance.now() - uploadStart);
+
+                if ((response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                    await readEventStream(response);
                 } else {
-                    const contentDiv = document.getElementById('resultContent');
-                    contentDiv.innerHTML = '';
-                    
-                    let extractedData;
-                    try {
-                        extractedData = typeof data.extracted_data === 'string' 
-                            ? JSON.parse(data.extracted_data) 
-                            : data.extracted_data;
-                    } catch (parseErr) {
-                        contentDiv.innerHTML = `<div style="color:#ff00ea; padding: 1rem; border: 1px solid #ff00ea;"><strong>PARSE ERROR. Raw output:</strong><br><code>${data.extracted_data}</code></div>`;
-                        resultsDiv.style.display = 'block';
-                        return;
-                    }
+                    // Errors raised before streaming starts still come back as plain JSON
+                    const data = await response.json();
 
-                    // Build Cyberpunk Table
-                    let tableHTML = '<table><tbody>';
-                    for (const [key, value] of Object.entries(extractedData)) {
-                        const formattedKey = key.replace(/_/g, ' ').replace(/\\b\\w/g, l => l.toUpperCase());
-                        let displayValue = value ? value : `<span class="empty-field">NULL_VALUE</span>`;
-                        
-                        tableHTML += `<tr>
-                            <th>${formattedKey}</th>
-                            <td>${displayValue}</td>
-                        </tr>`;
+                    if (data.error) {
+                        alert('SYSTEM ERROR: ' + data.error);
+                    } else {
+                        let extractedData;
+                        try {
+                            extractedData = typeof data.extracted_data === 'string' 
+                                ? JSON.parse(data.extracted_data) 
+                                : data.extracted_data;
+                        } catch (parseErr) {
+                            showRawOutput(data.extracted_data);
+                            return;
+                        }
+                        renderTable(extractedData);
                     }
-                    tableHTML += '</tbody></table>';
-                    contentDiv.innerHTML = tableHTML;
-                    
-                    resultsDiv.style.display = 'block';
-                    
+                }
+
+                if (resultsDiv.style.display === 'block') {
                     setTimeout(() => {
                         resultsDiv.scrollIntoView({ behavior: 'smooth', block: 'start' });
                     }, 100);
@@ -453,42 +688,67 @@ HTML_TEMPLATE = """
 """
 
 # --- HELPER: PDF TO IMAGE CONVERTER ---
+def render_pdf_page(pdf_data, analysis_edge=0):
+    """Takes raw PDF bytes, finds the passport data page and renders it. Returns (png_bytes, raster).
+
+    With analysis_edge, raster is a small grayscale render of the page for the quality gate
+    (see pdf_tools.render_upstream_image); otherwise None.
+    """
+    try:
+        # PyMuPDF only takes bytes, so a memory-mapped upload is copied once here
+        if not isinstance(pdf_data, (bytes, bytearray)):
+            pdf_data = bytes(pdf_data)
+
+        # Scanned passports often lead with the cover or visa pages, so rank the pages
+        # cheaply (MRZ text/texture, keywords, photo region) and render only the best one
+        # at full resolution (PDF_DPI)
+        with metrics.stage("pdf_render"):
+            return render_upstream_image(pdf_data, analysis_edge)
+    except Exception as e:
+        raise ValueError(f"Failed to process PDF file: {str(e)}")
+
+
+def convert_pdf_to_image_bytes(pdf_data):
+    """Takes raw PDF bytes, finds the passport data page, and returns it as PNG bytes."""
+    return render_pdf_page(pdf_data)[0]
+
+
 def convert_pdf_to_base64_image(base64_data):
-    """Takes a base64 encoded PDF, extracts the first page, and returns a base64 PNG."""
+    """Takes a base64 encoded PDF and returns its passport data page as a base64 PNG.
+
+    That is the highest-ranked page, or the top PDF_UPSTREAM_PAGES pages stacked into one
+    image (see convert_pdf_to_image_bytes).
+    """
+    img_bytes = convert_pdf_to_image_bytes(base64.b64decode(base64_data))
+    return base64.b64encode(img_bytes).decode('utf-8')
+
+
+def passport_pages(data):
+    """Renders every passport data page of a PDF (raw or base64). Returns [(page_number, png_bytes)]."""
+    pdf_data = base64.b64decode(data) if isinstance(data, str) else bytes(data)
     try:
-        # Decode the base64 PDF back to raw bytes
-        pdf_bytes = base64.b64decode(base64_data)
-        
-        # Open PDF from memory using PyMuPDF
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Grab the first page (index 0)
-        page = doc.load_page(0)
-        
-        # Render the page to a pixmap (image) at a good resolution for AI to read
-        pix = page.get_pixmap(dpi=150)
-        
-        # Convert pixmap to PNG bytes
-        img_bytes = pix.tobytes("png")
-        
-        # Encode back to base64
-        return base64.b64encode(img_bytes).decode('utf-8')
+        with metrics.stage("pdf_render"):
+            return render_passport_pages(pdf_data)
     except Exception as e:
         raise ValueError(f"Failed to process PDF file: {str(e)}")
 
 
-# --- CORE EXTRACTION LOGIC ---
-def process_passport_image(base64_image, mime_type):
-    """Handles the communication with OpenRouter."""
-    if not OPENROUTER_API_KEY:
-        raise ValueError("OpenRouter API key is missing.")
+def extract_all_pages(data, cache_mode="use"):
+    """Extracts every passport data page of a (multi-applicant) PDF. Returns a list of per-page results."""
+    pages = passport_pages(data)
 
-    # Check if the incoming data is a PDF. If it is, convert it to an image first!
-    if mime_type == 'application/pdf':
-        base64_image = convert_pdf_to_base64_image(base64_image)
-        mime_type = 'image/png'
+    def extract_page(page):
+        page_number, png = page
+        item = extract_item(page_number, png, 'image/png', cache_mode)
+        item["page"] = item.pop("index")
+        return item
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(pages)))) as executor:
+        return list(executor.map(metrics.bind_request(extract_page), pages))
 
-    prompt = """
+
+# --- CORE EXTRACTION LOGIC ---
+EXTRACTION_PROMPT = """
     You are a strict data extraction API. Your ONLY purpose is to extract information from the provided passport image and return a raw JSON object. And PLEASE DON'T THINK MUCH
 
     Extract the following information:
@@ -532,19 +792,63 @@ def process_passport_image(base64_image, mime_type):
     }
     """
 
-    headers = {
+
+# Bulk tiling mode: several passports in one image, answered as an array
+TILED_EXTRACTION_PROMPT = """
+    You are a strict data extraction API. The image is a grid of {count} passport images, each under a black bar
+    showing its tile number, numbered 1 to {count} from left to right and top to bottom. Extract each passport
+    separately and return a raw JSON array. And PLEASE DON'T THINK MUCH
+
+    CRITICAL INSTRUCTIONS:
+    1. DO NOT describe the image.
+    2. DO NOT include any conversational text, preamble, or explanations.
+    3. DO NOT use markdown formatting (no ```json).
+    4. Your entire response MUST start with '[' and end with ']'.
+    5. Return exactly one object per tile, in tile order. Never mix up data between tiles.
+
+    Use exactly this JSON schema for each object:
+    {{
+        "tile": 1,
+        "first_name": "",
+        "last_name": "",
+        "Date of Birth": "",
+        "Date of Issue": "",
+        "Nationality": "",
+        "place of passport issuance": "",
+        "middle name": "",
+        "gender": "male/female",
+        "place of birth": "",
+        "issuing authority": "",
+        "Date of Expiry": "",
+        "passport_number": "",
+        "personal_number": "",
+        "document_number": ""
+    }}
+    """
+
+
+def upstream_headers():
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OpenRouter API key is missing.")
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json"
     }
-    
+
+
+def extraction_payload(stream=False, structured=False):
+    """The chat-completions request, with placeholders where the image and the model go.
+
+    structured asks for the compact JSON-schema answer (see structured.py) instead of the free-text prompt's.
+    """
     payload = {
-        "model": "google/gemini-3-flash-preview:online", 
+        "model": MODEL_PLACEHOLDER,
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
+                    {"type": "text", "text": EXTRACTION_PROMPT},
+                    {"type": "image_url", "image_url": {"url": IMAGE_PLACEHOLDER}}
                 ]
             }
         ],
@@ -553,25 +857,830 @@ def process_passport_image(base64_image, mime_type):
             "sort": "throughput"
         }
     }
+    if stream:
+        payload["stream"] = True
+    if structured:
+        structured_request(payload)
+    return payload
 
-    response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
-    response.raise_for_status()
-    
-    llm_output = response.json()["choices"][0]["message"]["content"].strip()
-    
-    # Clean up any rogue markdown
+
+def prepare_image(image_data, mime_type):
+    """Renders a PDF's passport page and runs the quality gate. Returns (image_data, mime_type)."""
+    raster = None
+    # Check if the incoming data is a PDF. If it is, convert it to an image first!
+    if mime_type == 'application/pdf':
+        deadlines.check("pdf_render")
+        pdf_data = base64.b64decode(image_data) if isinstance(image_data, str) else image_data
+        # The gate measures PyMuPDF's own grayscale render instead of decoding the PNG again
+        image_data, raster = render_pdf_page(pdf_data, QUALITY_ANALYSIS_EDGE if QUALITY_GATE else 0)
+        mime_type = 'image/png'
+
+    # Blank, blurry, tiny or badly exposed images are rejected here rather than paid for upstream
+    deadlines.check("decode")
+    try:
+        with metrics.stage("quality"):
+            if raster is not None:
+                check_raster(*raster)
+            else:
+                check_image(image_data)
+    except UnusableImage as e:
+        metrics.QUALITY_REJECTED.labels(e.reason).inc()
+        raise
+    return image_data, mime_type
+
+
+def prepare_upstream_image(image_data, mime_type):
+    """prepare_image() plus normalization: the image as it is sent upstream. Returns (image_data, mime_type)."""
+    image_data, mime_type = prepare_image(image_data, mime_type)
+
+    # Rotate, shrink and re-encode so we upload (and pay for) as few bytes as possible
+    with metrics.stage("normalize"):
+        return normalize_image(image_data, mime_type)
+
+
+def encode_upstream_body(image_data, mime_type, stream=False):
+    # The image is spliced into the serialized body rather than copied through json.dumps
+    with metrics.stage("encode"):
+        return build_chat_body(extraction_payload(stream, STRUCTURED_OUTPUT), image_data, mime_type)
+
+
+def prepare_upstream_body(image_data, mime_type, stream=False):
+    """CPU-bound half of an extraction: PDF rendering, quality gate, image normalization and body serialization.
+
+    image_data is raw bytes (or any buffer) or a base64 str; it is only base64-encoded once,
+    when the upstream request body is built. Returns the body as bytes.
+    """
+    return encode_upstream_body(*prepare_upstream_image(image_data, mime_type), stream)
+
+
+def tiled_payload(count):
+    """extraction_payload() for a sheet of count tiles."""
+    payload = extraction_payload()
+    payload["messages"][0]["content"][0]["text"] = TILED_EXTRACTION_PROMPT.format(count=count)
+    return payload
+
+
+def followup_body(image_data, mime_type, fields):
+    """Request body asking again for just fields, over a crop of the (normalized) image."""
+    with metrics.stage("encode"):
+        crop, crop_mime = crop_for_fields(image_data, mime_type, fields)
+        payload = extraction_payload()
+        payload["messages"][0]["content"][0]["text"] = followup_prompt(fields)
+        return build_chat_body(payload, crop, crop_mime)
+
+
+def body_for_model(body, model):
+    """Fills the model into a prepared body. "model" leads the payload, so only the start is searched."""
+    head = body[:256]
+    return head.replace(json.dumps(MODEL_PLACEHOLDER).encode(), json.dumps(model).encode(), 1) + body[256:]
+
+
+def answer_is_valid(answer):
+    """Only a well-formed JSON answer wins a race between models."""
+    try:
+        json.loads(clean_llm_output(answer[0]))
+        return True
+    except ValueError:
+        return False
+
+
+def clean_llm_output(llm_output):
+    """Strips the markdown fences models add despite being told not to."""
+    llm_output = llm_output.strip()
     if llm_output.startswith("```json"): llm_output = llm_output[7:]
     if llm_output.startswith("```"): llm_output = llm_output[3:]
     if llm_output.endswith("```"): llm_output = llm_output[:-3]
-
     return llm_output.strip()
 
+
+def answer_result(llm_output):
+    """The winning answer as a result string: fences stripped, structured mode's short keys renamed."""
+    result = clean_llm_output(llm_output)
+    return expand_keys(result) if STRUCTURED_OUTPUT else result
+
+
+def raise_for_throttling(response):
+    """A 429 that outlasted the client's retries becomes Overloaded (a 503 for our caller), not a 500.
+
+    Admissions in this worker are paused for the upstream's Retry-After as well.
+    """
+    if response.status_code == 429:
+        retry_after = retry_after_seconds(response) or 1
+        admission.throttled(retry_after)
+        raise Overloaded("Upstream rate limit reached, retry later", retry_after)
+
+
+def call_upstream(headers, body, on_field=None, cancelled=None):
+    """POSTs a prepared request body to OpenRouter. Returns (answer_text, usage).
+
+    With on_field or cancelled the answer is streamed: on_field(key, value) gets each field as
+    it completes, and the call stops with AttemptCancelled once cancelled (an Event) is set.
+    """
+    # Shared pooled client: keep-alive connections, connect/read timeouts and retries on 429/5xx
+    usage = {}
+    stream = on_field is not None or cancelled is not None
+    # Waiting longer than the request's deadline would only pay for an answer nobody reads
+    timeout = (CONNECT_TIMEOUT, deadlines.read_timeout(READ_TIMEOUT))
+    metrics.UPSTREAM_BYTES.inc(len(body))
+    with metrics.stage("upstream"):
+        try:
+            response = get_upstream_client().post(OPENROUTER_URL, headers=headers, data=body, timeout=timeout,
+                                                  stream=stream)
+        except requests.Timeout:
+            deadlines.check("upstream")
+            raise
+        try:
+            raise_for_throttling(response)
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+
+    if not stream:
+        with metrics.stage("parse"):
+            answer = response.json()
+        return answer["choices"][0]["message"]["content"], answer.get("usage") or {}
+
+    # Feed the tokens through an incremental parser and hand out each field as it completes
+    parser = ObjectStreamParser() if on_field is not None else None
+    chunks = []
+    try:
+        with metrics.stage("upstream_stream"):
+            for text in iter_stream_content(response, usage):
+                if cancelled is not None and cancelled.is_set():
+                    raise AttemptCancelled("Another model answered first")
+                deadlines.check("upstream")
+                chunks.append(text)
+                if parser is not None:
+                    for key, value in parser.feed(text):
+                        on_field(key, value)
+    except requests.RequestException:
+        # A read timed out: report it as the deadline if that is what capped it
+        deadlines.check("upstream")
+        raise
+    finally:
+        # Also reached when on_field gives up (client gone), the race is lost or the deadline
+        # passes: closing stops the upstream generation
+        response.close()
+    return "".join(chunks), usage
+
+
+def process_passport_image(image_data, mime_type, on_field=None):
+    """Handles the communication with OpenRouter.
+
+    image_data is raw bytes (or any buffer) or a base64 str. With on_field, the model's answer
+    is streamed and on_field(key, value) is called as soon as each field is complete.
+    Raises Overloaded when the upstream rate limits leave no room for the call in time, and
+    UnusableImage (before any call) for uploads that fail the quality gate.
+    With several MODELS, a slow or failed call is hedged on the next model (see race()).
+    """
+    headers = upstream_headers()
+    # Raced calls are streamed so the loser can be cancelled mid-answer. The body is ready
+    # before admission: unusable images never queue for the upstream.
+    image_data, mime_type = prepare_upstream_image(image_data, mime_type)
+    body = encode_upstream_body(image_data, mime_type, stream=on_field is not None or model_router.hedging)
+
+    def attempt(model, state, cancelled):
+        emit = on_field
+        if on_field is not None:
+            def emit(key, value):
+                # A streamed answer can't be taken back: the first model to produce a field wins
+                if not state.claim(model):
+                    raise AttemptCancelled("Another model answered first")
+                on_field(field_name(key), value)
+        if state.is_hedge(model):
+            metrics.HEDGES.labels(model).inc()
+        try:
+            text, usage = call_upstream(headers, body_for_model(body, model), emit, cancelled)
+        finally:
+            # Every attempt frees its own slot once its call has stopped. A primary that lost
+            # to a hedge may still be closing its stream after race() has returned.
+            if state.is_hedge(model):
+                admission.release()
+            else:
+                primary_slot.release()
+        admission.settle(usage.get("total_tokens"))
+        metrics.record_usage(usage)
+        return text, usage
+
+    # Wait our turn under the upstream rate limits (api callers ahead of the web UI), or shed.
+    # Hedges only go out when they fit the limits without waiting.
+    with admission.admit() as primary_slot:
+        metrics.observe_stage("admission", primary_slot.waited)
+        primary_slot.keep()
+        model, (llm_output, _) = race(model_router, metrics.bind_request(attempt), answer_is_valid,
+                                      admission.try_admit)
+    metrics.MODEL_WINS.labels(model).inc()
+    result = answer_result(llm_output)
+
+    # Missing or implausible key fields: one cheap follow-up for just those, not a full retry
+    data, problems = fields_to_reextract(result)
+    if problems:
+        body = followup_body(image_data, mime_type, list(problems))
+        text = None
+        try:
+            with admission.admit() as ticket:
+                metrics.observe_stage("admission", ticket.waited)
+                text, usage = call_upstream(headers, body_for_model(body, model))
+            admission.settle(usage.get("total_tokens"))
+            metrics.record_usage(usage)
+        except Exception as e:
+            # The first answer still stands
+            metrics.record_error(e)
+        result = merge_followup(result, data, problems, text, on_field)
+    return result
+
+
+def fields_to_reextract(result):
+    """(parsed_result, {field: problem}) when result has fields worth asking for again, else (None, None)."""
+    if not REEXTRACT_ENABLED:
+        return None, None
+    try:
+        data = json.loads(result)
+    except ValueError:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    return data, find_problems(data) or None
+
+
+def merge_followup(result, data, problems, text, on_field=None):
+    """Merges a follow-up answer (text, or None if the call failed) into result. Returns the result string."""
+    try:
+        answer = json.loads(clean_llm_output(text)) if text is not None else None
+    except ValueError:
+        answer = None
+    merged, fixed = merge_fields(data, answer, problems)
+    for field in problems:
+        metrics.REEXTRACTED_FIELDS.labels(field, "fixed" if field in fixed else "unfixed").inc()
+    if not fixed:
+        return result
+    if on_field is not None:
+        for field in fixed:
+            on_field(field, merged[field])
+    return json.dumps(merged)
+
+# --- CACHED EXTRACTION ---
+def get_cache_mode(cache_control=None):
+    """Reads the client's Cache-Control header: 'use', 'refresh' (no-cache) or 'off' (no-store)."""
+    if cache_control is None:
+        cache_control = request.headers.get("Cache-Control", "")
+    cache_control = cache_control.lower()
+    if "no-store" in cache_control:
+        return "off"
+    if "no-cache" in cache_control:
+        return "refresh"
+    return "use"
+
+
+def extraction_cache_key(data, mime_type):
+    return cache_key(data, mime_type, model_router.signature(), PROMPT_VERSION, EXTRACTION_MODE,
+                     pipeline_signature())
+
+
+def cached_extraction(data, mime_type, cache_mode="use"):
+    """Looks an upload up in the result cache. Returns (key, cached_result); key is None when bypassed."""
+    if not result_cache.enabled or cache_mode == "off":
+        return None, None
+    with metrics.stage("cache"):
+        key = extraction_cache_key(data, mime_type)
+        cached = result_cache.get(key) if cache_mode == "use" else None
+    if cached is not None:
+        metrics.CACHE_RESULTS.labels("HIT").inc()
+    return key, cached
+
+
+def store_extraction(key, result, cache_mode="use"):
+    """Caches a fresh LLM result under key from cached_extraction(). Returns the cache status."""
+    if key is None:
+        status = "BYPASS"
+    else:
+        # Only remember well-formed answers, a bad one should get a fresh attempt next time
+        try:
+            json.loads(result)
+            result_cache.set(key, result)
+        except ValueError:
+            pass
+        status = "MISS" if cache_mode == "use" else "REFRESH"
+    metrics.CACHE_RESULTS.labels(status).inc()
+    return status
+
+
+def cache_recheck(key):
+    """For callers that waited on another worker's identical call: its answer, once cached."""
+    if key is None:
+        return None
+
+    def recheck():
+        cached = result_cache.get(key)
+        return (cached, "HIT") if cached is not None else None
+    return recheck
+
+
+def extract_with_cache(data, mime_type, cache_mode="use", on_field=None):
+    """Runs process_passport_image behind the result cache. Returns (result_string, cache_status).
+
+    Identical uploads already being extracted join that upstream call instead of making their
+    own; their status is COALESCED.
+    """
+    key, cached = cached_extraction(data, mime_type, cache_mode)
+    if cached is not None:
+        return cached, "HIT"
+
+    def call():
+        result = process_passport_image(data, mime_type, on_field)
+        return result, store_extraction(key, result, cache_mode)
+
+    (result, status), shared = in_flight.do(key or extraction_cache_key(data, mime_type), call,
+                                            cache_recheck(key), abandoned=(ExtractionCancelled, DeadlineExceeded))
+    if shared:
+        metrics.COALESCED.labels(shared).inc()
+        status = "COALESCED"
+    return result, status
+
+
+# 400 body for an image_base64 that doesn't decode (raised lazily, where a PDF is first decoded)
+INVALID_BASE64 = "image_base64 is not valid base64"
+
+
+class MrzNotValidated(ValueError):
+    """An MRZ-only request the MRZ can't answer by itself. Routes answer 400."""
+
+
+def answer_locally(data, mime_type, mrz_text=None, trace=None):
+    """The steps of extract_document that need no LLM call. Returns (result, data, parsed_mrz).
+
+    result is set when a PDF text layer or a valid MRZ (MRZ_MODE=fast) answered. Otherwise
+    data is what to send upstream (a base64 PDF comes back decoded) and parsed_mrz is any
+    MRZ the LLM answer should be checked against.
+    """
+    trace = trace if trace is not None else {}
+
+    if mime_type == 'application/pdf' and data is not None:
+        # Decode client base64 once here: the text layer check and the renderer both need raw bytes
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        if PDF_TEXT_FAST_PATH:
+            try:
+                with metrics.stage("pdf_text"):
+                    fields, source, pdf_mrz = read_text_layer(data)
+            except Exception:
+                # Unreadable PDFs are reported by the renderer with a proper error
+                fields, source, pdf_mrz = None, None, None
+            if fields:
+                trace["path"] = source
+                return json.dumps(fields), data, None
+            if pdf_mrz and not mrz_text:
+                mrz_text = "\n".join(pdf_mrz)
+
+    parsed_mrz = None
+    if isinstance(mrz_text, list):
+        mrz_text = "\n".join(mrz_text)
+    if mrz_text and MRZ_MODE != "off":
+        with metrics.stage("mrz"):
+            lines = find_mrz(mrz_text)
+            parsed_mrz = parse_mrz(lines) if lines else None
+        if parsed_mrz and parsed_mrz["valid"] and MRZ_MODE == "fast":
+            trace["path"] = "mrz"
+            return json.dumps(mrz_to_schema(parsed_mrz)), data, parsed_mrz
+
+    if data is None:
+        raise MrzNotValidated("MRZ could not be validated and no image was provided")
+    return None, data, parsed_mrz
+
+
+def verify_with_mrz(result, parsed_mrz, trace):
+    """Cross-checks an LLM result against the MRZ and corrects check-digit-protected fields."""
+    if not parsed_mrz:
+        return result
+    try:
+        corrected, mismatches = apply_mrz(json.loads(result), parsed_mrz)
+    except ValueError:
+        return result
+    trace["mrz_check"] = {"valid": parsed_mrz["valid"], "mismatches": mismatches}
+    return json.dumps(corrected)
+
+
+def extract_document(data, mime_type, cache_mode="use", mrz_text=None, trace=None, on_field=None):
+    """Full extraction pipeline, returns the result string.
+
+    A PDF whose text layer holds a valid MRZ or confidently labelled fields is answered
+    without rendering. A valid MRZ answers locally (MRZ_MODE=fast); otherwise the LLM result
+    is cross-checked against it and check-digit-protected fields are corrected. If given,
+    trace collects how the request was served: path, cache status and MRZ findings.
+    on_field streams fields from the LLM as they are generated (see process_passport_image).
+    """
+    trace = trace if trace is not None else {}
+    deadlines.check("upload")
+    result, data, parsed_mrz = answer_locally(data, mime_type, mrz_text, trace)
+    if result is not None:
+        return result
+
+    result, trace["cache"] = extract_with_cache(data, mime_type, cache_mode, on_field)
+    trace["path"] = "cache" if trace["cache"] == "HIT" else "llm"
+    return verify_with_mrz(result, parsed_mrz, trace)
+
+
+def error_body(e):
+    """JSON error body for an exception. Overloaded also tells the client when to retry."""
+    body = {"error": str(e)}
+    if isinstance(e, Overloaded):
+        body["retry_after"] = e.retry_after
+    elif isinstance(e, UnusableImage):
+        body["reason"] = e.reason
+        body["quality"] = e.measurements
+    elif isinstance(e, DeadlineExceeded):
+        body["stage"] = e.stage
+    return body
+
+
+def overloaded_response(e):
+    """503 + Retry-After: shed load instead of letting every queued request time out."""
+    response = jsonify(error_body(e))
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+class ExtractionCancelled(Exception):
+    """Raised from a streaming callback once the client has stopped listening."""
+
+
+def wants_event_stream():
+    """True if the client asked for a Server-Sent Events response."""
+    return request.args.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def finished_event(result, trace):
+    """The final SSE event for an extraction result: ('done', payload) or ('error', payload)."""
+    try:
+        done = {"data": json.loads(result), "path": trace.get("path")}
+    except ValueError:
+        metrics.ERRORS.labels("invalid_llm_json").inc()
+        return "error", {"error": "LLM returned invalid JSON format", "raw_output": result}
+    if "mrz_check" in trace:
+        done["mrz_check"] = trace["mrz_check"]
+    return "done", done
+
+
+def sse_frames(event, payload, sent):
+    """SSE text for one extraction event. sent collects the field keys streamed so far."""
+    frames = []
+    if event == "field":
+        sent.add(payload["key"])
+    elif event == "done" and isinstance(payload["data"], dict):
+        # Cache hits and local fast paths arrive all at once: replay them as fields too
+        frames = [sse_event("field", {"key": key, "value": value})
+                  for key, value in payload["data"].items() if key not in sent]
+    frames.append(sse_event(event, payload))
+    return frames
+
+
+def stream_extraction(data, mime_type, cache_mode="use", mrz_text=None):
+    """Runs extract_document in the background and streams its fields as Server-Sent Events.
+
+    Emits a 'field' event per key/value, then 'done' with the full validated object (or 'error').
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def on_field(key, value):
+        if cancelled.is_set():
+            raise ExtractionCancelled()
+        events.put(("field", {"key": key, "value": value}))
+
+    def work():
+        trace = {}
+        try:
+            result = extract_document(data, mime_type, cache_mode, mrz_text, trace, on_field)
+            events.put(finished_event(result, trace))
+        except ExtractionCancelled:
+            metrics.ERRORS.labels("cancelled").inc()
+        except Exception as e:
+            metrics.record_error(e)
+            events.put(("error", error_body(e)))
+
+    # Bound now, while the request context (its deadline, lane, timings) is still current
+    run = metrics.bind_request(work)
+
+    def generate():
+        threading.Thread(target=run, daemon=True).start()
+        sent = set()
+        try:
+            while True:
+                event, payload = events.get()
+                yield from sse_frames(event, payload, sent)
+                if event != "field":
+                    return
+        finally:
+            # Client disconnected or stream finished: stop feeding an abandoned upstream call
+            cancelled.set()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def set_trace_headers(response, trace):
+    """Reports how a request was served in response headers."""
+    if "cache" in trace:
+        response.headers["X-Cache"] = trace["cache"]
+    if "path" in trace:
+        response.headers["X-Extraction-Path"] = trace["path"]
+    return response
+
+
+def upload_buffer(stream):
+    """Exposes an uploaded file's contents as a buffer without reading it into a new bytes object."""
+    # Werkzeug spools uploads into a SpooledTemporaryFile: a BytesIO while small, a temp file once large.
+    # Small ones are simply copied; a live getbuffer() export would break werkzeug closing the file.
+    inner = getattr(stream, '_file', stream)
+    if isinstance(inner, io.BytesIO):
+        return inner.getvalue()
+    try:
+        inner.flush()
+        if os.fstat(inner.fileno()).st_size == 0:
+            return b""
+        # Spooled to disk: map it, so the page cache holds the bytes instead of the heap
+        return mmap.mmap(inner.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        stream.seek(0)
+        return stream.read()
+
+
+def upload_limits():
+    """What the web UI shrinks images to before uploading: the server's own normalization settings."""
+    _, mime_type = OUTPUT_FORMATS.get(IMAGE_FORMAT, OUTPUT_FORMATS["jpeg"])
+    return {
+        "preprocess": IMAGE_NORMALIZE,
+        "max_edge": IMAGE_MAX_EDGE,
+        "mime_type": mime_type,
+        "quality": IMAGE_QUALITY,
+        "max_upload_bytes": app.config['MAX_CONTENT_LENGTH'],
+    }
+
+
+def record_client_upload(form, size):
+    """Counts web UI uploads by whether the browser shrank them (it then sends original_bytes), and the bytes saved."""
+    original = str(form.get('original_bytes') or "")
+    if not original.isdigit():
+        metrics.CLIENT_UPLOADS.labels("raw").inc()
+        return
+    metrics.CLIENT_UPLOADS.labels("preprocessed").inc()
+    metrics.UPLOAD_BYTES_SAVED.inc(max(0, int(original) - size))
+
+
+def read_upload(file):
+    """Reads an uploaded file. Returns (buffer, mime_type)."""
+    with metrics.stage("upload"):
+        data = upload_buffer(file.stream)
+    metrics.UPLOAD_BYTES.inc(len(data))
+    mime_type = file.mimetype
+
+    # If the browser didn't assign a mime type but it has a pdf extension, force it.
+    if file.filename.lower().endswith('.pdf'):
+        mime_type = 'application/pdf'
+    return data, mime_type
+
+
+def success_item(index, result_string, trace):
+    item = {"index": index, "status": "success", "path": trace["path"], "data": json.loads(result_string)}
+    if "mrz_check" in trace:
+        item["mrz_check"] = trace["mrz_check"]
+    return item
+
+
+def extract_item(index, data, mime_type, cache_mode="use", mrz_text=None):
+    """Extracts one batch item, returning its result or error as a dict instead of raising."""
+    result_string = None
+    trace = {}
+    try:
+        result_string = extract_document(data, mime_type, cache_mode, mrz_text, trace)
+        return success_item(index, result_string, trace)
+    except json.JSONDecodeError:
+        metrics.ERRORS.labels("invalid_llm_json").inc()
+        return {"index": index, "status": "error", "error": "LLM returned invalid JSON format", "raw_output": result_string}
+    except Exception as e:
+        metrics.record_error(e)
+        return {"index": index, "status": "error", **error_body(e)}
+
+
+# --- BULK TILING MODE ---
+def prepare_tile(index, data, mime_type, cache_mode="use", mrz_text=None):
+    """Bulk mode, per document: the local fast paths and the cache, else its image for a tile.
+
+    Returns (batch_item, None) when the document is already answered (or failed), else (None, tile).
+    """
+    trace = {}
+    try:
+        result, data, parsed_mrz = answer_locally(data, mime_type, mrz_text, trace)
+        if result is None:
+            key, result = cached_extraction(data, mime_type, cache_mode)
+            if result is None and key is not None and cache_mode == "use":
+                # An answer from an earlier tiled batch does for this one, though not for single requests
+                result = result_cache.get(tiled_cache_key(key))
+                if result is not None:
+                    metrics.CACHE_RESULTS.labels("HIT").inc()
+            if result is None:
+                image, _ = prepare_image(data, mime_type)
+                return None, {"index": index, "data": data, "mime_type": mime_type, "mrz_text": mrz_text,
+                              "key": key, "parsed_mrz": parsed_mrz, "image": image}
+            trace["cache"], trace["path"] = "HIT", "cache"
+            result = verify_with_mrz(result, parsed_mrz, trace)
+        return success_item(index, result, trace), None
+    except Exception as e:
+        metrics.record_error(e)
+        return {"index": index, "status": "error", **error_body(e)}, None
+
+
+def tiled_cache_key(key):
+    """Cache key for a document's answer from a tiled sheet, kept apart from single extractions."""
+    return f"{key}/tiled" if key is not None else None
+
+
+def extract_sheet(tiles, cache_mode="use"):
+    """One upstream call for a sheet of tiles. Returns {index: batch_item} for the tiles it answered.
+
+    A tile whose answer fails validation (find_problems) is left out, to get a call of its own.
+    """
+    with metrics.stage("tile"):
+        sheet, sheet_mime = compose_tiles([tile["image"] for tile in tiles])
+        body = build_chat_body(tiled_payload(len(tiles)), sheet, sheet_mime)
+    headers = upstream_headers()
+    with admission.admit() as ticket:
+        metrics.observe_stage("admission", ticket.waited)
+        text, usage = call_upstream(headers, body_for_model(body, model_router.candidates()[0]))
+    admission.settle(usage.get("total_tokens"))
+    metrics.record_usage(usage)
+
+    answers = parse_tiles(clean_llm_output(text), len(tiles), list(EMPTY_RESULT))
+    items = {}
+    for number, tile in enumerate(tiles, 1):
+        if number in answers and not find_problems(answers[number]):
+            result = json.dumps(answers[number])
+            trace = {"cache": store_extraction(tiled_cache_key(tile["key"]), result, cache_mode), "path": "llm_tiled"}
+            items[tile["index"]] = success_item(tile["index"], verify_with_mrz(result, tile["parsed_mrz"], trace),
+                                                trace)
+    return items
+
+
+def extract_tiled(documents, cache_mode="use", tile_count=TILE_COUNT, concurrency=BATCH_CONCURRENCY):
+    """Bulk mode: extract_item over documents, but the ones that need the LLM go upstream tile_count
+    at a time, tiled into one image and answered as an array.
+
+    documents are (index, data, mime_type, mrz_text). Tiles the answer leaves out, gets in a shape
+    we can't use or gets wrong by find_problems, are retried with a call of their own. Returns batch
+    items in index order.
+    """
+    prepare = metrics.bind_request(prepare_tile)
+    sheet_call = metrics.bind_request(extract_sheet)
+    single = metrics.bind_request(extract_item)
+    items = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        tiles = []
+        for item, tile in executor.map(lambda document: prepare(*document[:3], cache_mode, document[3]), documents):
+            if item is not None:
+                items[item["index"]] = item
+            else:
+                tiles.append(tile)
+
+        sheets = [tiles[start:start + tile_count] for start in range(0, len(tiles), tile_count)]
+        retry = []
+        for sheet, future in [(sheet, executor.submit(sheet_call, sheet, cache_mode)) for sheet in sheets]:
+            try:
+                answered = future.result()
+            except Exception as e:
+                # The whole sheet failed: every document in it gets its own call
+                metrics.record_error(e)
+                answered = {}
+            items.update(answered)
+            retry.extend(tile for tile in sheet if tile["index"] not in answered)
+        metrics.TILED_DOCUMENTS.labels("tiled").inc(len(tiles) - len(retry))
+        metrics.TILED_DOCUMENTS.labels("fallback").inc(len(retry))
+
+        for item in executor.map(lambda tile: single(tile["index"], tile["data"], tile["mime_type"], cache_mode,
+                                                     tile["mrz_text"]), retry):
+            items[item["index"]] = item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [items[index] for index in sorted(items)]
+
+
+# Job failures worth another attempt later: upstream throttling, timeouts and 5xx
+TRANSIENT_JOB_ERRORS = (Overloaded, requests.RequestException)
+
+
+def run_job(payload, mime_type):
+    """Job queue handler: extracts a stored upload and returns the result string."""
+    # Queued work can wait longest for upstream capacity
+    set_lane("background")
+    return extract_document(payload, mime_type)
+
+
+def start_job_drainer():
+    """Starts this web worker's job threads when JOBS_DRAINER=app (once per process)."""
+    if JOBS_DRAINER == "app":
+        job_queue.start(run_job, retry_on=TRANSIENT_JOB_ERRORS)
+
+
+def api_key_matches(auth_header):
+    """True if an Authorization header carries our API key as a Bearer token. Never without a configured key."""
+    if not MY_APP_API_KEY or not auth_header:
+        return False
+    return hmac.compare_digest(auth_header.encode(), f"Bearer {MY_APP_API_KEY}".encode())
+
+
+def check_api_key():
+    """Returns True if the request carries our API key as a Bearer token."""
+    return api_key_matches(request.headers.get("Authorization"))
+
+
+def admin_denied():
+    """The error response for a request to an admin route, or None if it may proceed."""
+    if not MY_APP_API_KEY:
+        # Worker introspection is off unless a key protects it
+        return jsonify({"error": "Not found"}), 404
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    return None
+
 # --- ROUTES ---
 
+ADMIN_PREFIX = "/api/v1/admin/"
+
+
+@app.before_request
+def start_request_timing():
+    metrics.begin_request()
+    deadlines.begin(request.headers.get(DEADLINE_HEADER))
+    # Profiling the admin endpoints would only profile the profiler
+    g.profiled = request_started(not request.path.startswith(ADMIN_PREFIX))
+
+
+@app.teardown_request
+def finish_request_hooks(error=None):
+    deadlines.clear()
+    request_finished(g.pop("profiled", False))
+
+@app.after_request
+def add_server_timing(response):
+    """Reports the request's stage timings in a Server-Timing header and records its duration."""
+    # Streamed responses are timed up to their headers; their later stages still reach /metrics
+    server_timing = metrics.finish_request(request.endpoint or "unknown", response.status_code)
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+
+_frontend = None
+_frontend_lock = threading.Lock()
+
+
+def frontend():
+    """The HTML frontend, rendered and compressed on first use."""
+    global _frontend
+    with _frontend_lock:
+        if _frontend is None:
+            with app.app_context():
+                html = render_template_string(HTML_TEMPLATE, limits=upload_limits())
+            _frontend = PrecompressedAsset(html.encode(), "text/html", FRONTEND_MAX_AGE)
+        return _frontend
+
+
+def warmup():
+    """Does ahead of time what the first requests would otherwise wait for.
+
+    Heavy modules are imported lazily so a serverless cold start only pays for what a request
+    uses; long-lived workers call this once instead (gunicorn.conf.py, unless WARMUP=0).
+    """
+    import fitz  # noqa: F401
+    from PIL import Image
+    from quality import measure
+    import numpy as np
+
+    Image.init()
+    measure(np.zeros((8, 8), dtype=np.uint8), (8, 8))
+    get_upstream_client()
+    frontend()
+
+
 @app.route('/', methods=['GET'])
 def index():
     """Serves the HTML frontend."""
-    return render_template_string(HTML_TEMPLATE)
+    return frontend().response(request)
+
+
+@app.route('/api/v1/limits', methods=['GET'])
+def limits():
+    """Upload limits, so clients can downscale and re-encode images before sending them."""
+    return jsonify(upload_limits())
+
 
 @app.route('/web-extract', methods=['POST'])
 def web_extract():
@@ -579,50 +1688,313 @@ def web_extract():
     if 'image' not in request.files or request.files['image'].filename == '':
         return jsonify({"error": "No file uploaded"}), 400
 
+    set_lane("web")
     try:
-        file = request.files['image']
-        base64_file = base64.b64encode(file.read()).decode('utf-8')
-        mime_type = file.mimetype
-        
-        # If the browser didn't assign a mime type but it has a pdf extension, force it.
-        if file.filename.lower().endswith('.pdf'):
-            mime_type = 'application/pdf'
-            
-        result = process_passport_image(base64_file, mime_type)
-        return jsonify({"extracted_data": result})
+        data, mime_type = read_upload(request.files['image'])
+        record_client_upload(request.form, len(data))
+        if wants_event_stream():
+            return stream_extraction(data, mime_type, get_cache_mode(), request.form.get('mrz'))
+
+        trace = {}
+        result = extract_document(data, mime_type, get_cache_mode(), request.form.get('mrz'), trace)
+        return set_trace_headers(jsonify({"extracted_data": result}), trace)
+    except UnusableImage as e:
+        return jsonify(error_body(e)), 422
+    except DeadlineExceeded as e:
+        return jsonify(error_body(e)), 504
+    except Overloaded as e:
+        metrics.record_error(e)
+        return overloaded_response(e)
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/v1/extract', methods=['POST'])
 def api_extract():
     """Dedicated API Endpoint for external applications."""
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or auth_header != f"Bearer {MY_APP_API_KEY}":
+    if not check_api_key():
         return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    set_lane("api")
 
     try:
+        mrz_text = None
         if 'image' in request.files:
-            file = request.files['image']
-            base64_data = base64.b64encode(file.read()).decode('utf-8')
-            mime_type = file.mimetype
-            if file.filename.lower().endswith('.pdf'):
-                mime_type = 'application/pdf'
-        elif request.is_json and 'image_base64' in request.json:
-            base64_data = request.json['image_base64']
+            data, mime_type = read_upload(request.files['image'])
+            mrz_text = request.form.get('mrz')
+        elif request.is_json and ('image_base64' in request.json or 'mrz' in request.json):
+            # Kept as base64 text: decoded for the quality gate and normalization, and sent upstream
+            # as-is only when normalization leaves the image unchanged
+            data = request.json.get('image_base64')
             mime_type = request.json.get('mime_type', 'image/jpeg')
+            mrz_text = request.json.get('mrz')
         else:
-            return jsonify({"error": "Must provide 'image' file or JSON with 'image_base64'"}), 400
+            return jsonify({"error": "Must provide 'image' file or JSON with 'image_base64' (or 'mrz')"}), 400
 
-        result_string = process_passport_image(base64_data, mime_type)
-        return jsonify({
+        # Multi-applicant PDFs: one result per passport page
+        if request.args.get('all_pages') == '1' and mime_type == 'application/pdf' and data is not None:
+            results = extract_all_pages(data, get_cache_mode())
+            response = jsonify({"status": "success", "data": results})
+            response.headers["X-Extraction-Path"] = "llm_pages"
+            return response
+
+        if wants_event_stream():
+            return stream_extraction(data, mime_type, get_cache_mode(), mrz_text)
+
+        trace = {}
+        result_string = extract_document(data, mime_type, get_cache_mode(), mrz_text, trace)
+        body = {
             "status": "success",
             "data": json.loads(result_string) 
-        })
+        }
+        if "mrz_check" in trace:
+            body["mrz_check"] = trace["mrz_check"]
+        return set_trace_headers(jsonify(body), trace)
 
     except json.JSONDecodeError:
+        metrics.ERRORS.labels("invalid_llm_json").inc()
         return jsonify({"error": "LLM returned invalid JSON format", "raw_output": result_string}), 502
+    except binascii.Error:
+        return jsonify({"error": INVALID_BASE64}), 400
+    except MrzNotValidated as e:
+        return jsonify(error_body(e)), 400
+    except UnusableImage as e:
+        return jsonify(error_body(e)), 422
+    except DeadlineExceeded as e:
+        return jsonify(error_body(e)), 504
+    except Overloaded as e:
+        metrics.record_error(e)
+        return overloaded_response(e)
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/v1/extract/batch', methods=['POST'])
+def api_extract_batch():
+    """Extracts many documents in one call, fanning out to the upstream with bounded concurrency."""
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    set_lane("api")
+
+    # Collect every item up front: either (data, mime, mrz) or the error that stopped us reading it
+    items = []
+    files = request.files.getlist('images') + request.files.getlist('image')
+    if files:
+        for file in files:
+            items.append(read_upload(file) + (None,))
+    elif request.is_json:
+        entries = request.json
+        if isinstance(entries, dict):
+            entries = entries.get('items')
+        if not isinstance(entries, list):
+            return jsonify({"error": "JSON body must be an array (or {'items': [...]}) of {'image_base64', 'mime_type'}"}), 400
+        for entry in entries:
+            try:
+                items.append((entry['image_base64'], entry.get('mime_type', 'image/jpeg'), entry.get('mrz')))
+            except Exception as e:
+                items.append(ValueError(f"Invalid item: {str(e)}"))
+    else:
+        return jsonify({"error": "Must provide 'images' files or a JSON array of 'image_base64' items"}), 400
+
+    if not items:
+        return jsonify({"error": "No items provided"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items, the limit is {BATCH_MAX_ITEMS} per batch"}), 413
+
+    # Callers may ask for less concurrency than the server cap, never more
+    concurrency = min(request.args.get('concurrency', BATCH_CONCURRENCY, type=int) or 1, BATCH_CONCURRENCY)
+    cache_mode = get_cache_mode()
+    # Bulk mode (?bulk=1, or ?tiles=N): several documents per upstream call, see extract_tiled()
+    tiles = request.args.get('tiles', type=int) or (TILE_COUNT if request.args.get('bulk') == '1' else 0)
+    tiles = min(tiles, TILE_MAX_COUNT)
+
+    def run():
+        """Yields per-item results in input order while the rest are still in flight."""
+        executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))))
+        try:
+            futures = []
+            for index, item in enumerate(items):
+                if isinstance(item, Exception):
+                    futures.append({"index": index, "status": "error", "error": str(item)})
+                else:
+                    data, mime_type, mrz_text = item
+                    futures.append(executor.submit(metrics.bind_request(extract_item), index, data, mime_type,
+                                                   cache_mode, mrz_text))
+            for future in futures:
+                yield future if isinstance(future, dict) else future.result()
+        finally:
+            # If the client went away, don't start the items that haven't been sent upstream yet
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_tiled():
+        """Bulk mode: every result arrives once all the sheets (and single-call retries) are done."""
+        results = {index: {"index": index, "status": "error", "error": str(item)}
+                   for index, item in enumerate(items) if isinstance(item, Exception)}
+        documents = [(index,) + item for index, item in enumerate(items) if not isinstance(item, Exception)]
+        for result in extract_tiled(documents, cache_mode, tiles, concurrency):
+            results[result["index"]] = result
+        for index in range(len(items)):
+            yield results[index]
+
+    if tiles > 1:
+        run = run_tiled
+
+    if 'application/x-ndjson' in request.headers.get('Accept', '') or request.args.get('stream') == '1':
+        return Response((json.dumps(result) + "\n" for result in run()), mimetype='application/x-ndjson')
+
+    results = list(run())
+    return jsonify({
+        "status": "success",
+        "succeeded": sum(1 for result in results if result["status"] == "success"),
+        "failed": sum(1 for result in results if result["status"] == "error"),
+        "results": results
+    })
+
+@app.route('/api/v1/jobs', methods=['POST'])
+def submit_job():
+    """Queues an extraction and returns a job id straight away."""
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    if JOBS_DRAINER == "none":
+        return jsonify({"error": "Asynchronous jobs aren't available on this deployment, use /api/v1/extract"}), 501
+    start_job_drainer()
+
+    try:
+        if 'image' in request.files:
+            file_bytes, mime_type = read_upload(request.files['image'])
+            webhook_url = request.form.get('webhook_url')
+        elif request.is_json and 'image_base64' in request.json:
+            try:
+                file_bytes = base64.b64decode(request.json['image_base64'])
+            except (ValueError, TypeError):
+                return jsonify({"error": INVALID_BASE64}), 400
+            mime_type = request.json.get('mime_type', 'image/jpeg')
+            webhook_url = request.json.get('webhook_url')
+        else:
+            return jsonify({"error": "Must provide 'image' file or JSON with 'image_base64'"}), 400
+
+        if webhook_url:
+            try:
+                check_webhook_url(webhook_url)
+            except UnsafeWebhook as e:
+                return jsonify({"error": str(e)}), 400
+
+        job_id = job_queue.submit(file_bytes, mime_type, webhook_url)
+        return jsonify({
+            "id": job_id,
+            "status": "queued",
+            "status_url": f"/api/v1/jobs/{job_id}",
+            "queue_depth": job_queue.depth()["queued"]
+        }), 202
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/v1/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Returns a job's status, and its result once finished."""
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+
+    # Polling also restarts draining in a worker that restarted with jobs still queued
+    start_job_drainer()
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/api/v1/jobs', methods=['GET'])
+def job_stats():
+    """Queue depth across all workers."""
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    return jsonify(job_queue.depth())
+
+@app.route('/api/v1/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for this worker's result cache, plus coalescing, admission and model race counters."""
+    if not check_api_key():
+        return jsonify({"error": "Unauthorized. Invalid or missing API key."}), 401
+    stats = result_cache.stats()
+    stats["singleflight"] = in_flight.stats()
+    stats["admission"] = admission.stats()
+    stats["hedging"] = model_router.stats()
+    return jsonify(stats)
+
+@app.route('/api/v1/admin/runtime', methods=['GET'])
+def admin_runtime():
+    """This worker's in-flight requests, RSS, tracemalloc top allocators (when tracing) and profiling state."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    report = {"pid": os.getpid(), "in_flight": requests_in_flight(), "profile": profiler.status()}
+    report.update(memory_report(request.args.get('limit', 20, type=int)))
+    return jsonify(report)
+
+@app.route('/api/v1/admin/profile', methods=['POST', 'GET', 'DELETE'])
+def admin_profile():
+    """POST ?requests=N profiles this worker's next N requests; GET returns the result
+    (?format=pstats, or text with ?sort= and ?limit=); DELETE stops and discards it."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        count = request.args.get('requests', 10, type=int)
+        if not 1 <= count <= PROFILE_MAX_REQUESTS:
+            return jsonify({"error": f"requests must be between 1 and {PROFILE_MAX_REQUESTS}"}), 400
+        profiler.arm(count)
+        return jsonify({"pid": os.getpid(), **profiler.status()}), 202
+    if request.method == 'DELETE':
+        profiler.disarm()
+        return jsonify({"pid": os.getpid(), **profiler.status()})
+
+    headers = {"X-Worker-Pid": str(os.getpid()), "X-Profiled-Requests": str(profiler.status()["profiled"])}
+    if request.args.get('format', 'pstats') == 'text':
+        try:
+            body = profiler.text(request.args.get('sort', 'cumulative'), request.args.get('limit', 50, type=int))
+        except KeyError:
+            return jsonify({"error": "Unknown sort key"}), 400
+        mimetype = "text/plain"
+    else:
+        body = profiler.pstats_dump()
+        mimetype = "application/octet-stream"
+        headers["Content-Disposition"] = f'attachment; filename="worker-{os.getpid()}.pstats"'
+    if body is None:
+        return jsonify({"error": "No profiled requests yet", "pid": os.getpid(), **profiler.status()}), 404
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/api/v1/admin/stacks', methods=['GET'])
+def admin_stacks():
+    """Samples all of this worker's thread stacks for ?seconds=; returns collapsed stacks for a flamegraph."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    seconds = request.args.get('seconds', 10, type=float)
+    interval = request.args.get('interval', type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or (interval is not None and interval <= 0):
+        return jsonify({"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}], interval above 0"}), 400
+    body = sample_stacks(seconds, interval) if interval else sample_stacks(seconds)
+    return Response(body, mimetype="text/plain", headers={"X-Worker-Pid": str(os.getpid())})
+
+@app.route('/api/v1/admin/tracemalloc', methods=['POST', 'DELETE'])
+def admin_tracemalloc():
+    """POST ?frames=N starts tracing allocations on this worker (reported by /runtime); DELETE stops it."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        start_tracing(request.args.get('frames', 1, type=int))
+    else:
+        tracemalloc.stop()
+    return jsonify({"pid": os.getpid(), "tracing": tracemalloc.is_tracing()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latency histograms and counters in the Prometheus text format, merged across workers."""
+    if not metrics.scrape_allowed(request.headers.get("Authorization")):
+        return jsonify({"error": "Unauthorized. Invalid or missing metrics token."}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
+    # The development server drains the job queue itself; deployments run the worker process
+    job_queue.start(run_job, retry_on=TRANSIENT_JOB_ERRORS)
     app.run(debug=True, port=5000, host="0.0.0.0")
\ No newline at end of file
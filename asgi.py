@@ -0,0 +1,422 @@
+"""ASGI entry point: asyncio versions of the extraction endpoints, with the Flask app behind them.
+
+/web-extract and /api/v1/extract are served natively on the event loop, so a worker waiting
+on OpenRouter holds hundreds of calls in flight on one pooled httpx client instead of one per
+sync worker. CPU-bound steps (PDF text/rendering, image normalization, hashing, body
+serialization) run on a bounded thread pool. Every other route is the unchanged Flask app,
+mounted underneath and run in threads.
+
+Run with: gunicorn asgi:app -k uvicorn_worker.UvicornWorker
+"""
+import os
+import json
+import asyncio
+import binascii
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import metrics
+import deadlines
+from deadlines import DeadlineExceeded, DEADLINE_HEADER
+from jsonstream import ObjectStreamParser
+from upstream import get_async_upstream_client, aiter_stream_content, CONNECT_TIMEOUT, READ_TIMEOUT
+from singleflight import in_flight
+from admission import admission, set_lane, Overloaded
+from quality import UnusableImage
+from hedging import AttemptCancelled, race_async
+from profiling import request_started, request_finished
+from structured import field_name
+from app import (app as flask_app, OPENROUTER_URL, api_key_matches, BATCH_CONCURRENCY, upstream_headers,
+                 prepare_upstream_image, encode_upstream_body, answer_result, answer_locally, verify_with_mrz,
+                 cached_extraction, store_extraction, cache_recheck, extraction_cache_key, passport_pages,
+                 get_cache_mode, upload_buffer, record_client_upload, finished_event, sse_frames, set_trace_headers,
+                 raise_for_throttling, error_body, model_router, body_for_model, answer_is_valid, followup_body,
+                 fields_to_reextract, merge_followup, MrzNotValidated, INVALID_BASE64)
+
+# Threads for the CPU-bound steps. Bounded so a burst of PDFs queues instead of oversubscribing the box.
+CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Threads the mounted Flask app gets for the routes that are still synchronous
+WSGI_WORKERS = int(os.getenv("ASYNC_WSGI_WORKERS", "10"))
+
+_cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="asgi-cpu")
+
+
+async def run_cpu(fn, *args):
+    """Runs fn(*args) on the CPU pool; its timed stages still count towards the current request."""
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, metrics.bind_request(fn), *args)
+
+
+# --- ASYNC EXTRACTION CORE ---
+async def call_upstream_async(headers, body, on_field=None):
+    """asyncio call_upstream on the shared async client. Returns (answer_text, usage)."""
+    stream = on_field is not None
+    usage = {}
+    timeout = httpx.Timeout(deadlines.read_timeout(READ_TIMEOUT), connect=CONNECT_TIMEOUT)
+    metrics.UPSTREAM_BYTES.inc(len(body))
+    with metrics.stage("upstream"):
+        try:
+            response = await get_async_upstream_client().post(OPENROUTER_URL, headers=headers, data=body,
+                                                              timeout=timeout, stream=stream)
+        except httpx.TimeoutException:
+            deadlines.check("upstream")
+            raise
+    try:
+        raise_for_throttling(response)
+        response.raise_for_status()
+        if not stream:
+            with metrics.stage("parse"):
+                answer = response.json()
+            return answer["choices"][0]["message"]["content"], answer.get("usage") or {}
+
+        parser = ObjectStreamParser()
+        chunks = []
+        with metrics.stage("upstream_stream"):
+            async for text in aiter_stream_content(response, usage):
+                deadlines.check("upstream")
+                chunks.append(text)
+                for key, value in parser.feed(text):
+                    on_field(key, value)
+        return "".join(chunks), usage
+    except httpx.TimeoutException:
+        deadlines.check("upstream")
+        raise
+    finally:
+        # Also reached when the task is cancelled (client gone) or the deadline passes: closing
+        # stops the upstream generation
+        await response.aclose()
+
+
+async def process_passport_image_async(image_data, mime_type, on_field=None):
+    """asyncio process_passport_image: same admission control, request body and model racing, sent without blocking."""
+    headers = upstream_headers()
+    image_data, mime_type = await run_cpu(prepare_upstream_image, image_data, mime_type)
+    body = await run_cpu(encode_upstream_body, image_data, mime_type, on_field is not None)
+
+    async def attempt(model, state):
+        emit = on_field
+        if on_field is not None:
+            def emit(key, value):
+                if not state.claim(model):
+                    raise AttemptCancelled("Another model answered first")
+                on_field(field_name(key), value)
+        if state.is_hedge(model):
+            metrics.HEDGES.labels(model).inc()
+        try:
+            # The loser is cancelled as a task, so nothing forces a stream here
+            text, usage = await call_upstream_async(headers, body_for_model(body, model), emit)
+        finally:
+            if state.is_hedge(model):
+                admission.release()
+        admission.settle(usage.get("total_tokens"))
+        metrics.record_usage(usage)
+        return text, usage
+
+    async with admission.admit_async() as ticket:
+        metrics.observe_stage("admission", ticket.waited)
+        model, (llm_output, _) = await race_async(model_router, attempt, answer_is_valid, admission.try_admit)
+    metrics.MODEL_WINS.labels(model).inc()
+    result = answer_result(llm_output)
+
+    data, problems = fields_to_reextract(result)
+    if problems:
+        body = await run_cpu(followup_body, image_data, mime_type, list(problems))
+        text = None
+        try:
+            async with admission.admit_async() as ticket:
+                metrics.observe_stage("admission", ticket.waited)
+                text, usage = await call_upstream_async(headers, body_for_model(body, model))
+            admission.settle(usage.get("total_tokens"))
+            metrics.record_usage(usage)
+        except Exception as e:
+            metrics.record_error(e)
+        result = merge_followup(result, data, problems, text, on_field)
+    return result
+
+
+async def extract_document_async(data, mime_type, cache_mode="use", mrz_text=None, trace=None, on_field=None):
+    """asyncio extract_document: text layer and MRZ fast paths, result cache, then the LLM."""
+    trace = trace if trace is not None else {}
+    deadlines.check("upload")
+    if mime_type == 'application/pdf':
+        result, data, parsed_mrz = await run_cpu(answer_locally, data, mime_type, mrz_text, trace)
+    else:
+        result, data, parsed_mrz = answer_locally(data, mime_type, mrz_text, trace)
+    if result is not None:
+        return result
+
+    # Hashing a large upload and the SQLite lookup stay off the event loop
+    key, result = await run_cpu(cached_extraction, data, mime_type, cache_mode)
+    if result is not None:
+        trace["cache"], trace["path"] = "HIT", "cache"
+        return verify_with_mrz(result, parsed_mrz, trace)
+
+    async def call():
+        result = await process_passport_image_async(data, mime_type, on_field)
+        return result, await run_cpu(store_extraction, key, result, cache_mode)
+
+    recheck = cache_recheck(key)
+
+    async def recheck_async():
+        return await run_cpu(recheck)
+
+    # Identical uploads already in flight on this worker (or another) share that upstream call
+    flight_key = key or await run_cpu(extraction_cache_key, data, mime_type)
+    # A joiner outliving the first caller's deadline retries under its own
+    (result, trace["cache"]), shared = await in_flight.do_async(
+        flight_key, call, recheck_async if recheck else None, abandoned=(DeadlineExceeded,))
+    if shared:
+        metrics.COALESCED.labels(shared).inc()
+        trace["cache"] = "COALESCED"
+    trace["path"] = "llm"
+    return verify_with_mrz(result, parsed_mrz, trace)
+
+
+async def extract_item_async(index, data, mime_type, cache_mode="use", mrz_text=None):
+    """asyncio extract_item: one result or error dict, never raises."""
+    result_string = None
+    trace = {}
+    try:
+        result_string = await extract_document_async(data, mime_type, cache_mode, mrz_text, trace)
+        item = {"index": index, "status": "success", "path": trace["path"], "data": json.loads(result_string)}
+        if "mrz_check" in trace:
+            item["mrz_check"] = trace["mrz_check"]
+        return item
+    except json.JSONDecodeError:
+        metrics.ERRORS.labels("invalid_llm_json").inc()
+        return {"index": index, "status": "error", "error": "LLM returned invalid JSON format", "raw_output": result_string}
+    except Exception as e:
+        metrics.record_error(e)
+        return {"index": index, "status": "error", **error_body(e)}
+
+
+async def extract_all_pages_async(data, cache_mode="use"):
+    pages = await run_cpu(passport_pages, data)
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def extract_page(page):
+        page_number, png = page
+        async with limit:
+            item = await extract_item_async(page_number, png, 'image/png', cache_mode)
+        item["page"] = item.pop("index")
+        return item
+
+    return await asyncio.gather(*(extract_page(page) for page in pages))
+
+
+def stream_extraction_async(data, mime_type, cache_mode="use", mrz_text=None):
+    """asyncio stream_extraction: fields as Server-Sent Events; a client disconnect cancels the upstream call."""
+    events = asyncio.Queue()
+
+    def on_field(key, value):
+        events.put_nowait(("field", {"key": key, "value": value}))
+
+    async def work():
+        trace = {}
+        try:
+            result = await extract_document_async(data, mime_type, cache_mode, mrz_text, trace, on_field)
+            events.put_nowait(finished_event(result, trace))
+        except Exception as e:
+            metrics.record_error(e)
+            events.put_nowait(("error", error_body(e)))
+
+    async def generate():
+        task = asyncio.create_task(work())
+        sent = set()
+        event = None
+        try:
+            while event in (None, "field"):
+                event, payload = await events.get()
+                for frame in sse_frames(event, payload, sent):
+                    yield frame
+        finally:
+            # Client disconnected before the end: stop the abandoned upstream call
+            if event in (None, "field"):
+                metrics.ERRORS.labels("cancelled").inc()
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- REQUEST HELPERS ---
+def error(message, status, **extra):
+    return JSONResponse({"error": message, **extra}, status_code=status)
+
+
+def overloaded(e):
+    metrics.record_error(e)
+    return JSONResponse(error_body(e), status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+
+def wants_event_stream(request):
+    return request.query_params.get('stream') == '1' or 'text/event-stream' in request.headers.get('accept', '')
+
+
+def check_api_key(request):
+    return api_key_matches(request.headers.get("authorization"))
+
+
+def too_large(request):
+    """Same upload limit as the Flask app's MAX_CONTENT_LENGTH, checked before the body is read."""
+    length = request.headers.get("content-length")
+    return length is not None and length.isdigit() and int(length) > flask_app.config['MAX_CONTENT_LENGTH']
+
+
+async def read_form(request):
+    with metrics.stage("upload"):
+        return await request.form()
+
+
+def read_upload(upload):
+    """read_upload for a Starlette UploadFile: the spooled file is mapped, not copied."""
+    data = upload_buffer(upload.file)
+    metrics.UPLOAD_BYTES.inc(len(data))
+    mime_type = upload.content_type
+    if (upload.filename or "").lower().endswith('.pdf'):
+        mime_type = 'application/pdf'
+    return data, mime_type
+
+
+def instrumented(handler):
+    """Gives a native route the Server-Timing header, request histogram, deadline and profiling hooks the Flask routes get."""
+    async def endpoint(request):
+        metrics.begin_request()
+        deadlines.begin(request.headers.get(DEADLINE_HEADER))
+        profiled = request_started()
+        try:
+            response = await handler(request)
+        finally:
+            request_finished(profiled)
+        server_timing = metrics.finish_request(handler.__name__, response.status_code)
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+        return response
+    return endpoint
+
+
+# --- ROUTES ---
+@instrumented
+async def web_extract(request):
+    """Endpoint used by the HTML frontend."""
+    if too_large(request):
+        return error("Upload too large", 413)
+    form = await read_form(request)
+    upload = form.get('image')
+    if upload is None or isinstance(upload, str) or not upload.filename:
+        return error("No file uploaded", 400)
+
+    set_lane("web")
+    cache_mode = get_cache_mode(request.headers.get("cache-control", ""))
+    try:
+        data, mime_type = read_upload(upload)
+        record_client_upload(form, len(data))
+        if wants_event_stream(request):
+            return stream_extraction_async(data, mime_type, cache_mode, form.get('mrz'))
+
+        trace = {}
+        result = await extract_document_async(data, mime_type, cache_mode, form.get('mrz'), trace)
+        return set_trace_headers(JSONResponse({"extracted_data": result}), trace)
+    except UnusableImage as e:
+        return JSONResponse(error_body(e), status_code=422)
+    except DeadlineExceeded as e:
+        return JSONResponse(error_body(e), status_code=504)
+    except Overloaded as e:
+        return overloaded(e)
+    except Exception as e:
+        metrics.record_error(e)
+        return error(str(e), 500)
+
+
+@instrumented
+async def api_extract(request):
+    """Dedicated API Endpoint for external applications."""
+    if not check_api_key(request):
+        return error("Unauthorized. Invalid or missing API key.", 401)
+    set_lane("api")
+    if too_large(request):
+        return error("Upload too large", 413)
+
+    cache_mode = get_cache_mode(request.headers.get("cache-control", ""))
+    result_string = None
+    try:
+        mrz_text = None
+        content_type = request.headers.get("content-type", "")
+        body = None
+        if content_type.startswith("application/json"):
+            try:
+                body = await request.json()
+            except ValueError:
+                return error("Request body is not valid JSON", 400)
+        if content_type.startswith("multipart/form-data"):
+            form = await read_form(request)
+            upload = form.get('image')
+            if upload is None or isinstance(upload, str):
+                return error("Must provide 'image' file or JSON with 'image_base64' (or 'mrz')", 400)
+            data, mime_type = read_upload(upload)
+            mrz_text = form.get('mrz')
+        elif isinstance(body, dict) and ('image_base64' in body or 'mrz' in body):
+            # Kept as base64 text: decoded for the quality gate and normalization, and sent upstream
+            # as-is only when normalization leaves the image unchanged
+            data = body.get('image_base64')
+            mime_type = body.get('mime_type', 'image/jpeg')
+            mrz_text = body.get('mrz')
+        else:
+            return error("Must provide 'image' file or JSON with 'image_base64' (or 'mrz')", 400)
+
+        # Multi-applicant PDFs: one result per passport page
+        if request.query_params.get('all_pages') == '1' and mime_type == 'application/pdf' and data is not None:
+            results = await extract_all_pages_async(data, cache_mode)
+            return JSONResponse({"status": "success", "data": results}, headers={"X-Extraction-Path": "llm_pages"})
+
+        if wants_event_stream(request):
+            return stream_extraction_async(data, mime_type, cache_mode, mrz_text)
+
+        trace = {}
+        result_string = await extract_document_async(data, mime_type, cache_mode, mrz_text, trace)
+        body = {
+            "status": "success",
+            "data": json.loads(result_string)
+        }
+        if "mrz_check" in trace:
+            body["mrz_check"] = trace["mrz_check"]
+        return set_trace_headers(JSONResponse(body), trace)
+
+    except json.JSONDecodeError:
+        metrics.ERRORS.labels("invalid_llm_json").inc()
+        return error("LLM returned invalid JSON format", 502, raw_output=result_string)
+    except binascii.Error:
+        return error(INVALID_BASE64, 400)
+    except MrzNotValidated as e:
+        return JSONResponse(error_body(e), status_code=400)
+    except UnusableImage as e:
+        return JSONResponse(error_body(e), status_code=422)
+    except DeadlineExceeded as e:
+        return JSONResponse(error_body(e), status_code=504)
+    except Overloaded as e:
+        return overloaded(e)
+    except Exception as e:
+        metrics.record_error(e)
+        return error(str(e), 500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await get_async_upstream_client().aclose()
+    _cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route('/web-extract', web_extract, methods=['POST']),
+        Route('/api/v1/extract', api_extract, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+    ],
+    lifespan=lifespan,
+)
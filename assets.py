@@ -0,0 +1,47 @@
+import gzip
+import hashlib
+
+from flask import Response
+
+# Preferred order when a client accepts several encodings equally
+ENCODINGS = ("br", "gzip", "identity")
+
+
+class PrecompressedAsset:
+    """A response body built once, kept with gzip (and brotli, if installed) variants.
+
+    Each variant has its own strong ETag (the body's hash, suffixed per encoding) so caches
+    never hand a compressed body to a client that didn't ask for it.
+    """
+
+    def __init__(self, body, mimetype, max_age):
+        self.mimetype = mimetype
+        self.max_age = max_age
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {"identity": (body, digest)}
+
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.variants[encoding] = (data, f"{digest}-{encoding}")
+
+    def response(self, request):
+        """The variant request accepts, or a 304 when the client already holds it."""
+        encoding = request.accept_encodings.best_match(
+            [encoding for encoding in ENCODINGS if encoding in self.variants], default="identity")
+        body, etag = self.variants[encoding]
+
+        response = Response(body, mimetype=self.mimetype)
+        if encoding != "identity":
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.set_etag(etag)
+        return response.make_conditional(request)
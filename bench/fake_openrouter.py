@@ -0,0 +1,209 @@
+"""Local stand-in for the OpenRouter chat-completions endpoint.
+
+Usage: python bench/fake_openrouter.py [--port 8099] [--latency 2.0] [--sigma 0.4] [--error-rate 0.0]
+                                       [--rate-429 0.0] [--invalid-rate 0.0] [--tokens-per-sec 80]
+
+Point the app at it with OPENROUTER_URL=http://127.0.0.1:8099/api/v1/chat/completions.
+Latency is log-normal around --latency seconds. Streaming requests ("stream": true) get an SSE
+response whose first token arrives after ~30% of the latency, the rest paced by --tokens-per-sec.
+Usage blocks estimate tokens the way the real API roughly does (4 chars/token, flat cost per image).
+A bulk tiling prompt ("a grid of N passport images") gets an array of N answers. A JSON-schema
+response_format is honoured: the answer uses the schema's keys and is never invalid (as with
+constrained decoding), and max_tokens truncates the answer. GET returns
+request counters and the total prompt/completion tokens charged.
+"""
+import os
+import sys
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import random_identity
+from structured import FIELDS
+
+IMAGE_TOKENS = 1290
+# The bulk tiling prompt says how many passports the image holds
+TILE_COUNT_RE = re.compile(r"grid of (\d+) passport images")
+
+
+def fake_answer(rng):
+    person = random_identity(rng)
+    return {
+        "first_name": person["given"][0].title(),
+        "last_name": person["surname"].title(),
+        "Date of Birth": person["birth"].strftime("%d/%m/%Y"),
+        "Date of Issue": person["issue"].strftime("%d/%m/%Y"),
+        "Nationality": person["nationality"].replace("<", ""),
+        "place of passport issuance": "Utopia City",
+        "middle name": " ".join(person["given"][1:]).title(),
+        "gender": {"M": "male", "F": "female"}.get(person["sex"], ""),
+        "place of birth": "Utopia City",
+        "issuing authority": "Ministry of Foreign Affairs",
+        "Date of Expiry": person["expiry"].strftime("%d/%m/%Y"),
+        "passport_number": person["number"],
+        "personal_number": person["personal"],
+        "document_number": person["number"],
+    }
+
+
+def prompt_text(request):
+    return " ".join(part.get("text", "") for message in request.get("messages", [])
+                    for part in (message["content"] if isinstance(message.get("content"), list) else [])
+                    if part.get("type") == "text")
+
+
+def count_prompt_tokens(request):
+    tokens = 0
+    for message in request.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // 4
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+    if request.get("response_format"):
+        tokens += len(json.dumps(request["response_format"])) // 4
+    return tokens
+
+
+class FakeOpenRouter(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        config = self.server.config
+        rng = random.Random()
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.count("requests")
+
+        if rng.random() < config.rate_429:
+            self.server.count("429")
+            return self._send_json(429, {"error": {"code": 429, "message": "Rate limited"}}, {"Retry-After": "1"})
+        if rng.random() < config.error_rate:
+            self.server.count("500")
+            return self._send_json(500, {"error": {"code": 500, "message": "Upstream error"}})
+
+        latency = rng.lognormvariate(math.log(config.latency), config.sigma)
+        content = self.server.answer_for(request, rng)
+        if rng.random() < config.invalid_rate and not request.get("response_format"):
+            self.server.count("invalid")
+            content = "Here is the data you asked for:\n" + content[:len(content) // 2]
+
+        usage = {"prompt_tokens": count_prompt_tokens(request), "completion_tokens": max(1, len(content) // 4)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.server.count("prompt_tokens", usage["prompt_tokens"])
+        self.server.count("completion_tokens", usage["completion_tokens"])
+        if "max_tokens" in request and usage["completion_tokens"] > request["max_tokens"]:
+            content = content[:request["max_tokens"] * 4]
+            usage["completion_tokens"] = request["max_tokens"]
+
+        if not request.get("stream"):
+            time.sleep(latency)
+            return self._send_json(200, {
+                "id": "fake", "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk(": OPENROUTER PROCESSING\n\n")
+        time.sleep(latency * 0.3)
+        step = 12
+        pause = step / 4 / config.tokens_per_sec
+        for start in range(0, len(content), step):
+            delta = {"choices": [{"index": 0, "delta": {"content": content[start:start + step]}}]}
+            self._chunk(f"data: {json.dumps(delta)}\n\n")
+            time.sleep(pause)
+        self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        # Request counters, for load reports
+        self._send_json(200, self.server.stats())
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenRouter)
+        self.config = config
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def answer_for(self, request, rng):
+        """The JSON text the 'model' replies with: one passport, or an array for a tiled sheet."""
+        tiled = TILE_COUNT_RE.search(prompt_text(request))
+        if tiled:
+            return json.dumps([dict(tile=tile, **fake_answer(rng)) for tile in range(1, int(tiled.group(1)) + 1)],
+                              indent=2)
+        schema = (request.get("response_format") or {}).get("json_schema", {}).get("schema")
+        if schema:
+            answer = fake_answer(rng)
+            return json.dumps({key: answer.get(FIELDS.get(key, key), "") for key in schema["properties"]}, indent=2)
+        return json.dumps(fake_answer(rng), indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=2.0, help="median seconds per completion")
+    parser.add_argument("--sigma", type=float, default=0.4, help="log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of answers that aren't valid JSON")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    config = parse_args(argv)
+    server = FakeServer((config.host, config.port), config)
+    print(f"fake OpenRouter listening on http://{config.host}:{config.port}/api/v1/chat/completions", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
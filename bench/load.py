@@ -0,0 +1,237 @@
+"""Load driver: runs the app under gunicorn against the fake upstream and reports latency/throughput.
+
+Usage: python bench/load.py [--corpus bench/corpus] [--concurrency 1,4,16] [--requests 50]
+                            [--workers 2] [--threads 1] [--latency 2.0] [--out bench/results.json]
+                            [--endpoint web|api|both] [--files photo_1600.jpg,multi.pdf] [--wsgi]
+
+Starts bench/fake_openrouter.py and gunicorn (asgi:app on uvicorn workers, or app:app on sync
+workers with --wsgi) on local ports, with the result cache and job workers off so every request
+reaches the upstream. For each endpoint and concurrency level it sends --requests uploads from the corpus and records:
+  - throughput (requests/s) and p50/p95/p99 end-to-end latency
+  - per-stage time, averaged from the Server-Timing header where the app sends one
+  - status code counts and the fake upstream's own request counters
+  - peak RSS (VmHWM) of each gunicorn worker after the level finishes
+Results are written as JSON so runs can be diffed. Build the corpus first with bench/make_corpus.py.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+API_KEY = "bench-key"
+
+ENDPOINTS = {
+    "web": ("/web-extract", {}),
+    "api": ("/api/v1/extract", {"Authorization": f"Bearer {API_KEY}"}),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            # Refused, reset or timed out while the server is still starting
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def parse_server_timing(header):
+    """'upstream;dur=812.4, normalize;dur=31' -> {'upstream': 812.4, 'normalize': 31.0} (milliseconds)."""
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    stages[name] = float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # comm may contain spaces; ppid is the second field after the closing paren
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == master_pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_corpus(corpus_dir, names=None):
+    with open(os.path.join(corpus_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    files = []
+    for name, entry in manifest.items():
+        if names and name not in names:
+            continue
+        with open(os.path.join(corpus_dir, name), "rb") as f:
+            files.append((name, f.read(), entry["mime_type"]))
+    if not files:
+        raise SystemExit(f"No corpus files in {corpus_dir}; run bench/make_corpus.py first")
+    return files
+
+
+def run_level(base_url, endpoint, files, concurrency, total):
+    path, headers = ENDPOINTS[endpoint]
+    local = threading.local()
+    records = []
+    lock = threading.Lock()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        name, data, mime_type = files[i % len(files)]
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + path, headers=headers, files={"image": (name, data, mime_type)},
+                                    timeout=300)
+            status, timing = response.status_code, response.headers.get("Server-Timing")
+        except requests.RequestException as e:
+            status, timing = type(e).__name__, None
+        elapsed = time.perf_counter() - start
+        with lock:
+            records.append((status, elapsed, parse_server_timing(timing)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    ok = [elapsed for status, elapsed, _ in records if status == 200]
+    statuses, stages = {}, {}
+    for status, _, timing in records:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        for name, ms in timing.items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(ok, 50) * 1000, 1) if ok else None,
+            "p95": round(percentile(ok, 95) * 1000, 1) if ok else None,
+            "p99": round(percentile(ok, 99) * 1000, 1) if ok else None,
+            "max": round(max(ok) * 1000, 1) if ok else None,
+        },
+        "stages_ms": {name: round(sum(v) / len(v), 1) for name, v in sorted(stages.items())},
+        "status": statuses,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(BENCH, "corpus"))
+    parser.add_argument("--files", default="", help="comma-separated corpus file names (default: all)")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint and level")
+    parser.add_argument("--endpoint", choices=["web", "api", "both"], default="both")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker (--wsgi only)")
+    parser.add_argument("--wsgi", action="store_true", help="serve the Flask app on sync workers")
+    parser.add_argument("--latency", type=float, default=2.0, help="fake upstream median latency (s)")
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--out", default=os.path.join(BENCH, "results.json"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    files = load_corpus(args.corpus, set(filter(None, args.files.split(","))))
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    env = dict(os.environ,
+               OPENROUTER_URL=f"{upstream_url}/api/v1/chat/completions",
+               OPENROUTER_API_KEY="bench", MY_APP_API_KEY=API_KEY,
+               CACHE_ENABLED="0", JOBS_WORKERS="0", PYTHONUNBUFFERED="1")
+    fake = subprocess.Popen([sys.executable, os.path.join(BENCH, "fake_openrouter.py"), "--port", str(upstream_port),
+                             "--latency", str(args.latency), "--sigma", str(args.sigma),
+                             "--error-rate", str(args.error_rate), "--rate-429", str(args.rate_429)], env=env)
+    if args.wsgi:
+        serve = ["app:app", "--threads", str(args.threads)]
+    else:
+        serve = ["asgi:app", "-k", "uvicorn_worker.UvicornWorker"]
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", *serve, "--bind", f"127.0.0.1:{app_port}",
+                               "--workers", str(args.workers), "--timeout", "300"], cwd=ROOT, env=env)
+    try:
+        wait_for(upstream_url)
+        wait_for(base_url + "/")
+        endpoints = ["web", "api"] if args.endpoint == "both" else [args.endpoint]
+        levels = [int(c) for c in args.concurrency.split(",")]
+        results = []
+        for endpoint in endpoints:
+            for concurrency in levels:
+                result = run_level(base_url, endpoint, files, concurrency, args.requests)
+                result["peak_rss_mb"] = {str(pid): peak_rss_mb(pid) for pid in worker_pids(server.pid)}
+                print(json.dumps(result), flush=True)
+                results.append(result)
+        report = {
+            "config": {k: v for k, v in vars(args).items() if k != "out"},
+            "corpus": [name for name, _, _ in files],
+            "results": results,
+            "upstream": requests.get(upstream_url, timeout=5).json(),
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        fake.terminate()
+        server.wait(timeout=30)
+        fake.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Synthetic passport corpus for load tests: images and PDFs at varied sizes.
+
+Usage: python bench/make_corpus.py [out_dir] [seed]
+
+Writes into out_dir (default bench/corpus):
+  photo_<edge>.jpg      data pages at several long edges, some rotated via EXIF
+  scan_<edge>.png       the same page as a lossless scan
+  single.pdf            one rendered data page (image only, no text layer)
+  multi.pdf             cover, visa page, data page, blank page
+  digital.pdf           a data page with a real text layer and MRZ
+  manifest.json         file -> mime type, size, and the identity printed on it
+
+Every identity comes from bench/synthetic.py; nothing here is a real document.
+"""
+import os
+import io
+import sys
+import json
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import random_identity, td3_lines
+
+IMAGE_EDGES = (800, 1600, 3200, 4800)
+PAGE_SIZE = (1250, 880)  # ID-3 data page at ~10 px/mm
+
+
+def _font(size):
+    for name in ("DejaVuSansMono.ttf", "DejaVuSans.ttf", "Arial.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def identity_fields(person):
+    return {
+        "last_name": person["surname"],
+        "first_name": person["given"][0],
+        "Date of Birth": person["birth"].isoformat(),
+        "Date of Expiry": person["expiry"].isoformat(),
+        "passport_number": person["number"],
+        "Nationality": person["nationality"].replace("<", ""),
+    }
+
+
+def data_page(person, rng):
+    """A passport-style data page: portrait box, labelled fields and a TD3 MRZ band."""
+    img = Image.new("RGB", PAGE_SIZE, (236, 232, 222))
+    draw = ImageDraw.Draw(img)
+    # Background guilloche-ish noise so JPEG sizes are realistic
+    for _ in range(400):
+        x, y = rng.randrange(PAGE_SIZE[0]), rng.randrange(PAGE_SIZE[1])
+        draw.line((x, y, x + rng.randrange(-60, 60), y + rng.randrange(-60, 60)),
+                  fill=(rng.randrange(180, 230), rng.randrange(190, 230), rng.randrange(200, 240)))
+    draw.rectangle((60, 140, 360, 540), fill=(150, 140, 130), outline=(40, 40, 40), width=3)
+    draw.ellipse((140, 200, 280, 360), fill=(200, 170, 150))
+    draw.text((60, 40), f"PASSPORT  {person['issuer'].replace('<', '')}", font=_font(44), fill=(20, 30, 80))
+
+    label, value = _font(20), _font(30)
+    rows = [
+        ("Surname", person["surname"]),
+        ("Given names", " ".join(person["given"])),
+        ("Nationality", person["nationality"].replace("<", "")),
+        ("Date of birth", person["birth"].strftime("%d %b %Y").upper()),
+        ("Sex", person["sex"].replace("<", "X")),
+        ("Date of issue", person["issue"].strftime("%d %b %Y").upper()),
+        ("Date of expiry", person["expiry"].strftime("%d %b %Y").upper()),
+        ("Passport No.", person["number"]),
+    ]
+    y = 140
+    for name, text in rows:
+        draw.text((420, y), name, font=label, fill=(90, 90, 90))
+        draw.text((420, y + 22), text, font=value, fill=(10, 10, 10))
+        y += 62
+
+    mrz_font = _font(34)
+    draw.rectangle((0, 700, PAGE_SIZE[0], PAGE_SIZE[1]), fill=(245, 245, 240))
+    for i, line in enumerate(td3_lines(person)):
+        draw.text((40, 730 + i * 60), line, font=mrz_font, fill=(0, 0, 0))
+    return img
+
+
+def filler_page(title, rng):
+    img = Image.new("RGB", PAGE_SIZE, (120, 20, 30) if title == "cover" else (240, 238, 230))
+    draw = ImageDraw.Draw(img)
+    if title == "cover":
+        draw.text((PAGE_SIZE[0] // 2 - 200, 200), "PASSPORT", font=_font(80), fill=(220, 190, 90))
+        draw.ellipse((PAGE_SIZE[0] // 2 - 120, 380, PAGE_SIZE[0] // 2 + 120, 620), outline=(220, 190, 90), width=6)
+    elif title == "visa":
+        for _ in range(3):
+            x, y = rng.randrange(50, 900), rng.randrange(50, 600)
+            draw.rectangle((x, y, x + 300, y + 200), outline=(40, 60, 160), width=5)
+            draw.text((x + 20, y + 80), "ENTRY  " + str(rng.randrange(2016, 2026)), font=_font(32), fill=(40, 60, 160))
+    return img
+
+
+def _jpeg_with_orientation(img, orientation):
+    """Stores the page sideways with an EXIF orientation tag, as phone cameras do."""
+    if orientation == 6:
+        img = img.transpose(Image.ROTATE_90)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def _pdf_from_images(pages):
+    import fitz
+
+    doc = fitz.open()
+    for img in pages:
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=85)
+        page = doc.new_page(width=img.width * 72 / 150, height=img.height * 72 / 150)
+        page.insert_image(page.rect, stream=out.getvalue())
+    return doc.tobytes()
+
+
+def _digital_pdf(person):
+    import fitz
+
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_SIZE[0] * 72 / 150, height=PAGE_SIZE[1] * 72 / 150)
+    rows = [
+        ("Surname", person["surname"]),
+        ("Given names", " ".join(person["given"])),
+        ("Nationality", person["nationality"].replace("<", "")),
+        ("Date of birth", person["birth"].strftime("%d %b %Y").upper()),
+        ("Date of expiry", person["expiry"].strftime("%d %b %Y").upper()),
+        ("Passport No.", person["number"]),
+    ]
+    y = 60
+    for name, text in rows:
+        page.insert_text((200, y), name, fontsize=8)
+        page.insert_text((200, y + 12), text, fontsize=12)
+        y += 32
+    for i, line in enumerate(td3_lines(person)):
+        page.insert_text((20, 370 + i * 22), line, fontname="cour", fontsize=11)
+    return doc.tobytes()
+
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 9303)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+
+    def write(name, data, mime_type, person):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(data)
+        manifest[name] = {"mime_type": mime_type, "bytes": len(data), "expected": identity_fields(person)}
+
+    for edge in IMAGE_EDGES:
+        person = random_identity(rng)
+        page = data_page(person, rng)
+        scale = edge / max(page.size)
+        page = page.resize((int(page.width * scale), int(page.height * scale)), Image.LANCZOS)
+        write(f"photo_{edge}.jpg", _jpeg_with_orientation(page, rng.choice([1, 6])), "image/jpeg", person)
+        out = io.BytesIO()
+        page.save(out, format="PNG")
+        write(f"scan_{edge}.png", out.getvalue(), "image/png", person)
+
+    try:
+        person = random_identity(rng)
+        write("single.pdf", _pdf_from_images([data_page(person, rng)]), "application/pdf", person)
+        person = random_identity(rng)
+        pages = [filler_page("cover", rng), filler_page("visa", rng), data_page(person, rng), filler_page("blank", rng)]
+        write("multi.pdf", _pdf_from_images(pages), "application/pdf", person)
+        person = random_identity(rng)
+        write("digital.pdf", _digital_pdf(person), "application/pdf", person)
+    except ImportError:
+        print("PyMuPDF not installed; skipping PDFs", file=sys.stderr)
+
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(json.dumps({name: entry["bytes"] for name, entry in manifest.items()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
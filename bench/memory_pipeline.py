@@ -0,0 +1,76 @@
+"""Peak Python heap per request for the upload -> upstream body path, old vs new.
+
+Usage: python bench/memory_pipeline.py [size_mb ...]
+
+"old" replays the original route code: file.read(), base64 str, data URL f-string,
+then requests' json= serialization. "new" is read_upload()'s mmap of the spooled
+file plus build_chat_body(). Only the image path is measured; PDFs add one bytes
+copy of the upload in both versions before rendering.
+"""
+import os
+import sys
+import json
+import mmap
+import base64
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream import build_chat_body, IMAGE_PLACEHOLDER
+
+
+def make_payload(url):
+    return {
+        "model": "bench",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "prompt"},
+            {"type": "image_url", "image_url": {"url": url}},
+        ]}],
+    }
+
+
+def old_path(spooled):
+    spooled.seek(0)
+    file_bytes = spooled.read()
+    base64_file = base64.b64encode(file_bytes).decode('utf-8')
+    payload = make_payload(f"data:image/jpeg;base64,{base64_file}")
+    # What requests does with json=payload
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+
+def new_path(spooled):
+    spooled.flush()
+    data = mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ)
+    return build_chat_body(make_payload(IMAGE_PLACEHOLDER), data, "image/jpeg")
+
+
+def measure(fn, spooled):
+    tracemalloc.start()
+    body = fn(spooled)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, len(body)
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [1, 5, 10]
+    report = []
+    for size_mb in sizes:
+        with tempfile.TemporaryFile() as spooled:
+            spooled.write(os.urandom(int(size_mb * 1024 * 1024)))
+            old_peak, old_len = measure(old_path, spooled)
+            new_peak, new_len = measure(new_path, spooled)
+        assert old_len == new_len
+        report.append({
+            "upload_mb": size_mb,
+            "body_mb": round(new_len / 2 ** 20, 2),
+            "old_peak_mb": round(old_peak / 2 ** 20, 2),
+            "new_peak_mb": round(new_peak / 2 ** 20, 2),
+            "saved_pct": round(100 * (old_peak - new_peak) / old_peak, 1),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
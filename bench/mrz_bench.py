@@ -0,0 +1,82 @@
+"""Micro-benchmark and synthetic corpus check for the local MRZ parser.
+
+Usage: python bench/mrz_bench.py [count] [seed]
+
+Generates `count` random TD3/TD2/TD1 zones, checks that each one parses as valid and
+maps back to the identity it was generated from, checks that a single misread digit
+is always rejected, and reports parse throughput as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mrz import parse_mrz, mrz_to_schema, find_mrz
+from synthetic import random_identity, td3_lines, td2_lines, td1_lines, corrupt
+
+BUILDERS = {"TD3": td3_lines, "TD2": td2_lines, "TD1": td1_lines}
+
+
+def expected_fields(person, kind):
+    # The MRZ truncates names to the line width, so only compare what fits
+    return {
+        "last_name": person["surname"],
+        "Date of Birth": person["birth"].isoformat(),
+        "Date of Expiry": person["expiry"].isoformat(),
+        "document_number": person["number"],
+        "Nationality": person["nationality"].replace("<", ""),
+        "gender": {"M": "male", "F": "female"}.get(person["sex"], ""),
+        "personal_number": person["personal"] if kind == "TD3" else "",
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 9303)
+
+    corpus = []
+    for i in range(count):
+        kind = ("TD3", "TD2", "TD1")[i % 3]
+        person = random_identity(rng)
+        corpus.append((kind, person, BUILDERS[kind](person)))
+
+    failures = []
+    for kind, person, lines in corpus:
+        parsed = parse_mrz(lines)
+        data = mrz_to_schema(parsed)
+        wrong = {k: (data[k], v) for k, v in expected_fields(person, kind).items() if data[k] != v}
+        if not parsed["valid"] or parsed["format"] != kind or wrong:
+            failures.append({"lines": lines, "checks": parsed["checks"], "wrong": wrong})
+
+    undetected = sum(1 for kind, person, lines in corpus if parse_mrz(corrupt(lines, rng))["valid"])
+
+    # Timing: parse + schema mapping, and locating the zone inside surrounding page text
+    start = time.perf_counter()
+    for _, _, lines in corpus:
+        mrz_to_schema(parse_mrz(lines))
+    parse_seconds = time.perf_counter() - start
+
+    pages = ["REPUBLIC OF UTOPIA\nPASSPORT\nSurname / Nom\n" + "\n".join(lines) for _, _, lines in corpus[:2000]]
+    start = time.perf_counter()
+    for page in pages:
+        find_mrz(page)
+    find_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "documents": count,
+        "parse_failures": len(failures),
+        "single_digit_errors_undetected": undetected,
+        "parse_us_per_doc": round(parse_seconds / count * 1e6, 2),
+        "parse_docs_per_sec": round(count / parse_seconds),
+        "find_us_per_page": round(find_seconds / len(pages) * 1e6, 2),
+        "sample_failures": failures[:3],
+    }, indent=2, default=str))
+    return 1 if failures or undetected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Synthetic check for the image quality gate: usable documents pass, unusable ones are turned away.
+
+Usage: python bench/quality_check.py [--corpus bench/corpus]
+
+Runs quality.measure()/verdict() over every corpus image and PDF page (all must pass) and
+over pages derived from a corpus scan: a mostly white page with sparse black print (must
+pass: paper white is not overexposure), the scan washed out, darkened, blurred, blanked
+and shrunk (each must be rejected for its reason). Prints one JSON line per case and
+exits non-zero if any verdict is not the expected one.
+Build the corpus first with bench/make_corpus.py.
+"""
+import os
+import sys
+import json
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+import quality
+from pdf_tools import render_upstream_image
+
+
+def corpus_cases(corpus):
+    for name in sorted(os.listdir(corpus)):
+        path = os.path.join(corpus, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        if name.endswith(".pdf"):
+            _, raster = render_upstream_image(data, quality.QUALITY_ANALYSIS_EDGE)
+            samples, width, height, size = raster
+            gray = np.frombuffer(samples, dtype=np.uint8).reshape(height, -1)[:, :width]
+        elif name.endswith((".png", ".jpg")):
+            gray, size = quality._analysis_image(data)
+        else:
+            continue
+        yield name, gray, size, None
+
+
+def derived_cases(gray, size):
+    image = Image.fromarray(gray)
+    # Sparse black print on paper white: ~1.5% of the pixels, the rest clipped at 255
+    page = np.full_like(gray, 255)
+    height, width = page.shape
+    for top in range(height // 8, height * 7 // 8, max(1, height // 12)):
+        page[top:top + 2, width // 10:width * 9 // 10:3] = 20
+    yield "white_page", page, size, None
+    yield "washed_out", np.clip(gray.astype(np.int16) + 150, 0, 255).astype(np.uint8), size, "overexposed"
+    yield "dark", (gray // 12).astype(np.uint8), size, "underexposed"
+    yield "blurred", np.asarray(image.filter(ImageFilter.GaussianBlur(6))), size, "blurry"
+    yield "blank", np.full_like(gray, 250), size, "blank"
+    yield "thumbnail", gray, (size[0] // 4, size[1] // 4), "too_small"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(BENCH, "corpus"))
+    args = parser.parse_args()
+
+    cases = list(corpus_cases(args.corpus))
+    scans = [case for case in cases if case[0].startswith("scan_")]
+    if scans:
+        cases += derived_cases(*scans[0][1:3])
+
+    failures = 0
+    for name, gray, size, expected in cases:
+        measurements = quality.measure(gray, size)
+        reason = quality.verdict(measurements)
+        failures += reason != expected
+        print(json.dumps({"case": name, "expected": expected, "verdict": reason, **measurements}), flush=True)
+    print(f"{len(cases) - failures}/{len(cases)} as expected")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Cold start benchmark: import time, warm-up time and first-request latency of a fresh worker.
+
+Usage: python bench/startup.py [--runs 5] [--hits 500] [--out bench/results_startup.json]
+
+Each run starts a new interpreter and times `import app`, then the first GET / and the first
+PDF text-layer read (which pulls in PyMuPDF), with and without app.warmup() in between.
+Also reports the steady-state cost of a GET / hit against rendering the template on every
+hit (what the index route used to do). Medians over the runs, in milliseconds.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import os, sys, json, time
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.update(JOBS_WORKERS="0", CACHE_ENABLED="0")
+sys.path.insert(0, sys.argv[1])
+timings = {}
+start = time.perf_counter()
+import app
+timings["import"] = time.perf_counter() - start
+
+if sys.argv[2] == "warm":
+    start = time.perf_counter()
+    app.warmup()
+    timings["warmup"] = time.perf_counter() - start
+
+client = app.app.test_client()
+start = time.perf_counter()
+client.get("/", headers={"Accept-Encoding": "gzip, br"})
+timings["first_index"] = time.perf_counter() - start
+
+pdf = bytes.fromhex(sys.argv[3])
+start = time.perf_counter()
+app.read_text_layer(pdf)
+timings["first_pdf_text"] = time.perf_counter() - start
+
+hits = int(sys.argv[4])
+start = time.perf_counter()
+for _ in range(hits):
+    client.get("/", headers={"Accept-Encoding": "gzip, br"})
+timings["index_hit"] = (time.perf_counter() - start) / hits
+
+with app.app.test_request_context("/"):
+    start = time.perf_counter()
+    for _ in range(hits):
+        app.render_template_string(app.HTML_TEMPLATE, limits=app.upload_limits())
+    timings["template_render"] = (time.perf_counter() - start) / hits
+print(json.dumps({name: round(seconds * 1000, 3) for name, seconds in timings.items()}))
+"""
+
+
+def sample_pdf():
+    import fitz
+
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "PASSPORT\nSurname: DOE\nGiven names: JANE")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def probe(mode, pdf, hits):
+    output = subprocess.run([sys.executable, "-c", PROBE, ROOT, mode, pdf.hex(), str(hits)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--hits", type=int, default=500)
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results_startup.json"))
+    args = parser.parse_args()
+
+    pdf = sample_pdf()
+    results = {}
+    for mode in ("lazy", "warm"):
+        runs = [probe(mode, pdf, args.hits) for _ in range(args.runs)]
+        results[mode] = {name: round(statistics.median(run[name] for run in runs), 3) for name in runs[0]}
+        print(mode, json.dumps(results[mode]), flush=True)
+
+    with open(args.out, "w") as f:
+        json.dump({"runs": args.runs, "hits": args.hits, "results": results}, f, indent=2)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
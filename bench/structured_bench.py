@@ -0,0 +1,124 @@
+"""Structured-output benchmark: the free-text prompt against EXTRACTION_MODE=structured.
+
+Usage: python bench/structured_bench.py [--corpus bench/corpus] [--documents 48] [--concurrency 4]
+                                  [--latency 2.0] [--invalid-rate 0.05] [--no-stream] [--live]
+                                  [--out bench/results_structured.json]
+
+Sends the same documents through process_passport_image once per mode, with the result cache,
+in-flight coalescing and field re-extraction off so every document costs exactly one call.
+Reports p50/p95 latency per document, prompt/completion tokens per call (from the usage
+blocks) and the share of answers that weren't valid JSON (a 502 from /api/v1/extract).
+
+By default the upstream is bench/fake_openrouter.py: its token counts follow the request and
+answer sizes, streamed answers are paced by their length, and --invalid-rate of free-text
+answers come back broken (structured ones can't, as with constrained decoding). It does not
+model prefill time or reasoning tokens; --live runs against OPENROUTER_URL with the real key
+(and bills it) to measure those.
+Build the corpus first with bench/make_corpus.py; PDFs are skipped (the text layer answers them).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+from fake_openrouter import FakeServer, parse_args as fake_args
+from tiling_bench import free_port, load_documents
+
+MODES = ("prompt", "structured")
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def tokens():
+    from prometheus_client import REGISTRY
+    return {kind: REGISTRY.get_sample_value("passport_tokens_total", {"kind": kind}) or 0.0
+            for kind in ("prompt", "completion")}
+
+
+def run_mode(app, mode, documents, concurrency, stream):
+    # The mode is read when a request body is built and when the answer is parsed
+    app.STRUCTURED_OUTPUT = mode == "structured"
+    on_field = (lambda key, value: None) if stream else None
+
+    def one(document):
+        start = time.perf_counter()
+        try:
+            json.loads(app.process_passport_image(*document, on_field=on_field))
+            outcome = "ok"
+        except ValueError:
+            outcome = "invalid_json"
+        except Exception:
+            outcome = "error"
+        return outcome, time.perf_counter() - start
+
+    before = tokens()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, documents))
+    wall = time.perf_counter() - start
+    after = tokens()
+
+    latencies = [seconds for _, seconds in outcomes]
+    count = len(documents)
+    return {
+        "documents": count,
+        "wall_s": round(wall, 3),
+        "latency_s": {"p50": round(statistics.median(latencies), 3), "p95": round(percentile(latencies, 0.95), 3)},
+        "tokens_per_call": {kind: round((after[kind] - before[kind]) / count, 1) for kind in after},
+        "invalid_json_rate": round(sum(1 for outcome, _ in outcomes if outcome == "invalid_json") / count, 4),
+        "errors": sum(1 for outcome, _ in outcomes if outcome == "error"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(BENCH, "corpus"))
+    parser.add_argument("--documents", type=int, default=48)
+    parser.add_argument("--concurrency", type=int, default=4, help="upstream calls in flight")
+    parser.add_argument("--latency", type=float, default=2.0, help="fake upstream median latency (s)")
+    parser.add_argument("--sigma", type=float, default=0.2)
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="broken free-text answers from the fake")
+    parser.add_argument("--no-stream", dest="stream", action="store_false",
+                        help="wait for whole answers instead of streaming them (the web UI streams)")
+    parser.add_argument("--live", action="store_true", help="call OPENROUTER_URL with OPENROUTER_API_KEY instead")
+    parser.add_argument("--out", default=os.path.join(BENCH, "results_structured.json"))
+    args = parser.parse_args()
+
+    server = None
+    if not args.live:
+        port = free_port()
+        server = FakeServer(("127.0.0.1", port), fake_args(["--latency", str(args.latency), "--sigma", str(args.sigma),
+                                                            "--invalid-rate", str(args.invalid_rate)]))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ.update(OPENROUTER_URL=f"http://127.0.0.1:{port}/api/v1/chat/completions",
+                          OPENROUTER_API_KEY="bench")
+    os.environ.update(CACHE_ENABLED="0", SINGLEFLIGHT_ENABLED="0", JOBS_WORKERS="0", REEXTRACT_ENABLED="0")
+    import app
+
+    documents = load_documents(args.corpus, args.documents)
+    results = {}
+    for mode in MODES:
+        results[mode] = run_mode(app, mode, documents, args.concurrency, args.stream)
+        print(json.dumps({"mode": mode, **results[mode]}), flush=True)
+
+    with open(args.out, "w") as f:
+        json.dump({"config": {k: v for k, v in vars(args).items() if k != "out"}, "results": results}, f, indent=2)
+    print(f"wrote {args.out}")
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Synthetic identities and MRZ lines for benchmarks. Nothing here is a real document."""
+import random
+import string
+from datetime import date, timedelta
+
+from mrz import check_digit
+
+SURNAMES = ["ERIKSSON", "OKAFOR", "NGUYEN", "GARCIA LOPEZ", "MUELLER", "SMITH", "DE LA CRUZ", "KOWALSKI",
+            "TANAKA", "OBRIEN", "ABDULLAH", "PETROV", "SILVA", "VAN DER BERG", "HAUGEN"]
+GIVEN_NAMES = ["ANNA", "MARIA", "JOHN", "WEI", "FATIMA", "CARLOS", "YUKI", "OLUWASEUN", "PIOTR", "SOFIA",
+               "JEAN PIERRE", "LIAM", "AISHA", "MATEO", "INGRID"]
+COUNTRIES = ["UTO", "GBR", "USA", "DEU", "FRA", "IND", "NGA", "JPN", "BRA", "D<<", "NLD", "POL"]
+
+
+def _pad(text, width):
+    return (text + "<" * width)[:width]
+
+
+def _mrz_name(surname, given):
+    return f"{surname.replace(' ', '<')}<<{'<'.join(g.replace(' ', '<') for g in given)}"
+
+
+def random_identity(rng=random):
+    birth = date(1940, 1, 1) + timedelta(days=rng.randrange(0, 365 * 65))
+    issue = date(2016, 1, 1) + timedelta(days=rng.randrange(0, 365 * 9))
+    return {
+        "surname": rng.choice(SURNAMES),
+        "given": rng.sample(GIVEN_NAMES, rng.choice([1, 1, 2])),
+        "number": "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(rng.choice([8, 9]))),
+        "nationality": rng.choice(COUNTRIES),
+        "issuer": rng.choice(COUNTRIES),
+        "birth": birth,
+        "issue": issue,
+        "expiry": issue + timedelta(days=365 * 10 - 1),
+        "sex": rng.choice("MF<"),
+        "personal": "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(rng.choice([0, 9, 14]))),
+    }
+
+
+def td3_lines(person):
+    """Two 44-character passport MRZ lines with correct check digits."""
+    line1 = _pad(f"P<{person['issuer']}{_mrz_name(person['surname'], person['given'])}", 44)
+    number = _pad(person["number"], 9)
+    birth = person["birth"].strftime("%y%m%d")
+    expiry = person["expiry"].strftime("%y%m%d")
+    personal = _pad(person["personal"], 14)
+    personal_check = check_digit(personal) if person["personal"] else "<"
+    body = (number + check_digit(number) + person["nationality"] + birth + check_digit(birth) + person["sex"]
+            + expiry + check_digit(expiry) + personal + personal_check)
+    composite = body[0:10] + body[13:20] + body[21:43]
+    return [line1, body + check_digit(composite)]
+
+
+def td2_lines(person):
+    """Two 36-character ID card MRZ lines."""
+    line1 = _pad(f"I<{person['issuer']}{_mrz_name(person['surname'], person['given'])}", 36)
+    number = _pad(person["number"], 9)
+    birth = person["birth"].strftime("%y%m%d")
+    expiry = person["expiry"].strftime("%y%m%d")
+    body = (number + check_digit(number) + person["nationality"] + birth + check_digit(birth) + person["sex"]
+            + expiry + check_digit(expiry) + "<" * 7)
+    composite = body[0:10] + body[13:20] + body[21:35]
+    return [line1, body + check_digit(composite)]
+
+
+def td1_lines(person):
+    """Three 30-character ID card MRZ lines."""
+    number = _pad(person["number"], 9)
+    line1 = _pad(f"I<{person['issuer']}{number}{check_digit(number)}", 30)
+    birth = person["birth"].strftime("%y%m%d")
+    expiry = person["expiry"].strftime("%y%m%d")
+    line2 = _pad(birth + check_digit(birth) + person["sex"] + expiry + check_digit(expiry) + person["nationality"], 29)
+    composite = line1[5:30] + line2[0:7] + line2[8:15] + line2[18:29]
+    line3 = _pad(_mrz_name(person["surname"], person["given"]), 30)
+    return [line1, line2 + check_digit(composite), line3]
+
+
+def corrupt(lines, rng=random):
+    """Misreads one digit, as a bad OCR pass would. Every digit sits in a check-digit-protected field."""
+    lines = list(lines)
+    positions = [(row, col) for row, line in enumerate(lines) for col, c in enumerate(line) if c.isdigit()]
+    row, col = rng.choice(positions)
+    replacement = rng.choice([c for c in string.digits if c != lines[row][col]])
+    lines[row] = lines[row][:col] + replacement + lines[row][col + 1:]
+    return lines
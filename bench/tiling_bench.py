@@ -0,0 +1,131 @@
+"""Bulk tiling benchmark: one upstream call per document vs. N documents tiled into one call.
+
+Usage: python bench/tiling_bench.py [--corpus bench/corpus] [--documents 48] [--tiles 2,4,6,9]
+                              [--concurrency 4] [--latency 2.0] [--out bench/results_tiling.json]
+
+Runs in-process against bench/fake_openrouter.py (started on a local port), with the result
+cache and in-flight coalescing off so every document is paid for. The baseline sends each
+document through process_passport_image; each tiled run sends the same documents through
+extract_tiled. Reports docs/sec, upstream calls and prompt/completion tokens per document
+(as charged by the fake, which bills a flat IMAGE_TOKENS per image like a fixed media
+resolution does), and how many tiles fell back to a call of their own.
+Build the corpus first with bench/make_corpus.py; PDFs are skipped (the text layer answers them).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+from fake_openrouter import FakeServer, parse_args as fake_args
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def load_documents(corpus_dir, count):
+    with open(os.path.join(corpus_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    files = []
+    for name, entry in sorted(manifest.items()):
+        if entry["mime_type"] == "application/pdf":
+            continue
+        with open(os.path.join(corpus_dir, name), "rb") as f:
+            files.append((f.read(), entry["mime_type"]))
+    if not files:
+        raise SystemExit(f"No images in {corpus_dir}; run bench/make_corpus.py first")
+    return [files[i % len(files)] for i in range(count)]
+
+
+def measure(server, run, documents):
+    before = server.stats()
+    start = time.perf_counter()
+    outcomes = run()
+    wall = time.perf_counter() - start
+    after = server.stats()
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    prompt, completion = delta("prompt_tokens"), delta("completion_tokens")
+    return {
+        "documents": len(documents),
+        "wall_s": round(wall, 3),
+        "docs_per_sec": round(len(documents) / wall, 3),
+        "upstream_calls": delta("requests"),
+        "tokens_per_doc": {
+            "prompt": round(prompt / len(documents), 1),
+            "completion": round(completion / len(documents), 1),
+            "total": round((prompt + completion) / len(documents), 1),
+        },
+        **outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(BENCH, "corpus"))
+    parser.add_argument("--documents", type=int, default=48)
+    parser.add_argument("--tiles", default="2,4,6,9", help="documents per tiled call, one run each")
+    parser.add_argument("--concurrency", type=int, default=4, help="upstream calls in flight")
+    parser.add_argument("--latency", type=float, default=2.0, help="fake upstream median latency (s)")
+    parser.add_argument("--sigma", type=float, default=0.2)
+    parser.add_argument("--out", default=os.path.join(BENCH, "results_tiling.json"))
+    args = parser.parse_args()
+
+    port = free_port()
+    server = FakeServer(("127.0.0.1", port), fake_args(["--latency", str(args.latency), "--sigma", str(args.sigma)]))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.update(OPENROUTER_URL=f"http://127.0.0.1:{port}/api/v1/chat/completions", OPENROUTER_API_KEY="bench",
+                      CACHE_ENABLED="0", SINGLEFLIGHT_ENABLED="0", JOBS_WORKERS="0")
+    import app
+
+    documents = load_documents(args.corpus, args.documents)
+
+    def single():
+        def one(document):
+            try:
+                json.loads(app.process_passport_image(*document))
+                return True
+            except Exception:
+                return False
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            ok = sum(pool.map(one, documents))
+        return {"succeeded": ok, "failed": len(documents) - ok}
+
+    def tiled(count):
+        def run():
+            items = app.extract_tiled([(index, data, mime_type, None) for index, (data, mime_type) in
+                                       enumerate(documents)], "off", count, args.concurrency)
+            return {
+                "succeeded": sum(1 for item in items if item["status"] == "success"),
+                "failed": sum(1 for item in items if item["status"] == "error"),
+                "fallbacks": sum(1 for item in items if item.get("path") == "llm"),
+            }
+        return run
+
+    results = {"single": measure(server, single, documents)}
+    print(json.dumps({"mode": "single", **results["single"]}), flush=True)
+    for count in [int(c) for c in args.tiles.split(",")]:
+        results[f"tiles_{count}"] = measure(server, tiled(count), documents)
+        print(json.dumps({"mode": f"tiles_{count}", **results[f"tiles_{count}"]}), flush=True)
+
+    with open(args.out, "w") as f:
+        json.dump({"config": {k: v for k, v in vars(args).items() if k != "out"}, "results": results}, f, indent=2)
+    print(f"wrote {args.out}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import os
+import re
+import stat
+import time
+import base64
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# --- RESULT CACHE SETTINGS ---
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") != "0"
+# Local SQLite files (this cache, the job queue) hold extraction results and uploads. By
+# default they live in a directory of the temp dir that only this user can enter; files
+# created anywhere are made readable by this user only (see private_db_file).
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(tempfile.gettempdir(), f"passport-{os.getuid()}"))
+# The SQLite tier lives on local disk so every gunicorn worker on the box shares it.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(DATA_DIR, "passport_cache.sqlite3"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "256"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Expired/oversized rows are swept every N writes rather than on every write.
+CACHE_SWEEP_EVERY = int(os.getenv("CACHE_SWEEP_EVERY", "50"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _hash_base64(digest, text, chunk=4 * 64 * 1024):
+    """Feeds the decoded bytes of a base64 str into digest, a slice at a time."""
+    # Line-wrapped base64 would shift the slice boundaries, so unwrap it first
+    if _WHITESPACE_RE.search(text):
+        text = _WHITESPACE_RE.sub("", text)
+    for start in range(0, len(text), chunk):
+        digest.update(base64.b64decode(text[start:start + chunk]))
+
+
+def private_db_file(path):
+    """Creates a SQLite file (mode 0600) and its directory (0700) if missing, before it is opened.
+
+    SQLite gives the -wal and -shm files it adds the database's mode. Raises RuntimeError when
+    DATA_DIR exists but isn't private to this user, e.g. created first by another user of the
+    shared temp dir.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory == os.path.abspath(DATA_DIR):
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise RuntimeError(f"{directory} is not private to this user, set DATA_DIR to a directory that is")
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+
+
+def cache_key(data, *parts):
+    """Content-addressed key: SHA-256 of the raw upload bytes plus anything that changes the output.
+
+    data may be raw bytes (any buffer) or a base64 str, which hashes the same as its decoded bytes.
+    """
+    digest = hashlib.sha256()
+    if isinstance(data, str):
+        _hash_base64(digest, data)
+    else:
+        digest.update(data)
+    for part in parts:
+        digest.update(b"\x00" + str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier extraction result cache: an in-process LRU in front of a shared SQLite file."""
+
+    def __init__(self, db_path=CACHE_DB_PATH, ttl=CACHE_TTL, memory_items=CACHE_MEMORY_ITEMS,
+                 max_bytes=CACHE_MAX_BYTES, enabled=CACHE_ENABLED):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    # SQLite connections can't be shared across threads, so each thread opens its own.
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            private_db_file(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+        try:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM results WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            # A locked or broken cache file must never fail an extraction
+            row = None
+
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._count("disk_hits")
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key, value):
+        """Stores value in both tiers."""
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        self._count("sets")
+
+        try:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), expires_at, now),
+            )
+            with self._lock:
+                self._writes += 1
+                sweep = self._writes % CACHE_SWEEP_EVERY == 0
+            if sweep:
+                self.sweep()
+        except sqlite3.Error:
+            pass
+
+    def sweep(self):
+        """Drops expired rows, then evicts least-recently-used rows until under the size cap."""
+        db = self._db()
+        evicted = db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),)).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            rows = db.execute("SELECT key, size FROM results ORDER BY accessed_at").fetchall()
+            doomed = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            db.executemany("DELETE FROM results WHERE key = ?", doomed)
+            evicted += len(doomed)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def stats(self):
+        """Hit/miss counters for this worker plus the size of the shared disk tier."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        try:
+            count, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            stats["disk_items"], stats["disk_bytes"] = count, size
+        except sqlite3.Error:
+            pass
+        stats["pid"] = os.getpid()
+        return stats
+
+
+result_cache = ResultCache()
@@ -0,0 +1,92 @@
+import os
+import time
+import contextvars
+
+import metrics
+
+# --- REQUEST DEADLINE SETTINGS ---
+# A request may say how long its caller will wait with an X-Request-Deadline header: seconds
+# of budget ("15", "2.5"), or an absolute Unix timestamp. Without one, REQUEST_DEADLINE
+# applies (0: no deadline). The pipeline checks the budget between stages, caps the
+# upstream read timeout at what is left and answers 504 once it can't be met, instead of
+# finishing (and paying for) an answer nobody is waiting for.
+DEADLINE_HEADER = "X-Request-Deadline"
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "0"))
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "300"))
+# Don't start an upstream call with less than this left: it could not answer in time
+DEADLINE_MIN_UPSTREAM = float(os.getenv("DEADLINE_MIN_UPSTREAM", "1"))
+
+# Header values above this are absolute timestamps rather than a budget in seconds
+_ABSOLUTE_AFTER = 1e9
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed, or would pass, before stage could finish. Routes answer 504."""
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def parse_deadline(value):
+    """Seconds of budget in an X-Request-Deadline header value, or None if missing or malformed."""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    if seconds != seconds or seconds <= 0:
+        # NaN, or no budget at all: malformed rather than already expired
+        return None
+    if seconds > _ABSOLUTE_AFTER:
+        seconds -= time.time()
+    return min(seconds, REQUEST_DEADLINE_MAX)
+
+
+def begin(header_value=None):
+    """Sets the deadline of the request running in this context. Returns it (a time.monotonic() value) or None."""
+    seconds = parse_deadline(header_value)
+    if seconds is None:
+        seconds = REQUEST_DEADLINE or None
+    deadline = time.monotonic() + seconds if seconds is not None else None
+    _deadline.set(deadline)
+    return deadline
+
+
+def clear():
+    _deadline.set(None)
+
+
+def current():
+    """The current request's deadline as a time.monotonic() value, or None."""
+    return _deadline.get()
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def exceeded(stage):
+    """Counts a request abandoned at stage and returns the exception to raise."""
+    metrics.DEADLINE_ABANDONED.labels(stage).inc()
+    return DeadlineExceeded(stage)
+
+
+def check(stage, needed=0.0):
+    """Raises DeadlineExceeded unless more than needed seconds are left before stage starts."""
+    left = remaining()
+    if left is not None and left <= needed:
+        raise exceeded(stage)
+
+
+def read_timeout(default):
+    """The upstream read timeout: default, capped at the time left. Raises if too little is left to try."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= DEADLINE_MIN_UPSTREAM:
+        raise exceeded("upstream")
+    return min(default, left)
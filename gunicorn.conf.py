@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+
+# Prometheus multiprocess mode: set before any worker imports prometheus_client, so every
+# worker writes its metrics to files here and /metrics can merge them (see metrics.py).
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                                    os.path.join(tempfile.gettempdir(), "passport_metrics"))
+
+# Import PyMuPDF/NumPy and build the frontend before a worker takes requests, so its first
+# requests don't pay for them. Serverless deploys don't read this file and stay lazy.
+warmup_enabled = os.getenv("WARMUP", "1") != "0"
+
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be merged into this one
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    if warmup_enabled:
+        from app import warmup
+        warmup()
@@ -0,0 +1,340 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+
+# --- MODEL HEDGING SETTINGS ---
+# Candidate models, best first. With more than one, a call that is still unanswered after the
+# running model's p90 latency is hedged: the next model gets the same request, the first valid
+# answer wins and the other call is cancelled.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") != "0"
+HEDGE_MAX_ATTEMPTS = int(os.getenv("HEDGE_MAX_ATTEMPTS", "2"))
+# Never hedge sooner than this, and use the default until a model has HEDGE_MIN_SAMPLES timings
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# Latency samples kept per model for the percentiles
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+
+class AttemptCancelled(Exception):
+    """Raised inside a losing attempt once another model has won the race."""
+
+
+class _ModelStats:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.counters = {"requests": 0, "failures": 0, "hedges": 0, "wins": 0, "cancelled": 0}
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def error_rate(self):
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+
+class ModelRouter:
+    """Per-model latency/error statistics that order the candidates and time the hedges."""
+
+    def __init__(self, models, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.models = list(models)
+        self.min_samples = min_samples
+        # With a single model there is nothing to race: calls run inline as before
+        self.hedging = HEDGE_ENABLED and HEDGE_MAX_ATTEMPTS > 1 and len(self.models) > 1
+        self._stats = {model: _ModelStats(window) for model in self.models}
+        self._lock = threading.Lock()
+        self.races = 0
+        self.hedged_races = 0
+
+    def signature(self):
+        """The configured model list; part of the result cache key."""
+        return ",".join(self.models)
+
+    def _expected(self, model):
+        stats = self._stats[model]
+        if len(stats.latencies) < self.min_samples:
+            return HEDGE_DEFAULT_DELAY
+        # A model that often fails costs a retry on top of its latency
+        return stats.percentile(90) * (1 + 2 * stats.error_rate())
+
+    def candidates(self):
+        """Models fastest (by p90, penalized for errors) first; configured order breaks ties."""
+        with self._lock:
+            return sorted(self.models, key=self._expected)
+
+    def hedge_delay(self, model):
+        """Seconds to wait on model before hedging: its p90 once known, never below HEDGE_MIN_DELAY."""
+        with self._lock:
+            stats = self._stats[model]
+            if len(stats.latencies) < self.min_samples:
+                return HEDGE_DEFAULT_DELAY
+            return max(HEDGE_MIN_DELAY, stats.percentile(90))
+
+    def record(self, model, latency, ok):
+        with self._lock:
+            stats = self._stats[model]
+            stats.counters["requests"] += 1
+            stats.outcomes.append(ok)
+            if ok:
+                stats.latencies.append(latency)
+            else:
+                stats.counters["failures"] += 1
+
+    def record_cancelled(self, model):
+        with self._lock:
+            self._stats[model].counters["requests"] += 1
+            self._stats[model].counters["cancelled"] += 1
+
+    def record_race(self, winner, hedged, launched):
+        with self._lock:
+            self.races += 1
+            if hedged:
+                self.hedged_races += 1
+            for model in launched[1:]:
+                self._stats[model].counters["hedges"] += 1
+            if winner is not None:
+                self._stats[winner].counters["wins"] += 1
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for model, stats in self._stats.items():
+                p50, p90 = stats.percentile(50), stats.percentile(90)
+                models[model] = dict(stats.counters, samples=len(stats.latencies),
+                                     p50=round(p50, 3) if p50 is not None else None,
+                                     p90=round(p90, 3) if p90 is not None else None,
+                                     error_rate=round(stats.error_rate(), 4))
+            return {
+                "order": sorted(self.models, key=self._expected),
+                "races": self.races,
+                "hedged_races": self.hedged_races,
+                "hedge_rate": round(self.hedged_races / self.races, 4) if self.races else 0.0,
+                "models": models,
+            }
+
+
+class Race:
+    """One extraction raced across models: the primary (first) model, who has claimed the answer,
+    and how to cancel each attempt."""
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.winner = None
+        self.finished = set()
+        self._cancellers = {}
+        self._lock = threading.Lock()
+
+    def is_hedge(self, model):
+        return model != self.primary
+
+    def add(self, model, cancel):
+        with self._lock:
+            self._cancellers[model] = cancel
+
+    def cancel_others(self, model):
+        with self._lock:
+            cancellers = [cancel for other, cancel in self._cancellers.items()
+                          if other != model and other not in self.finished]
+        for cancel in cancellers:
+            cancel()
+
+    def claim(self, model):
+        """For streamed answers: the first attempt to produce a field wins and the others are cancelled.
+
+        Returns False for an attempt that lost, which should then raise AttemptCancelled.
+        """
+        with self._lock:
+            if self.winner is None:
+                self.winner = model
+            won = self.winner == model
+        if won:
+            self.cancel_others(model)
+        return won
+
+
+def _finish(router, state, launched, winner):
+    """Counts the race, and the attempts it is leaving behind as cancelled."""
+    for model in launched:
+        if model not in state.finished:
+            router.record_cancelled(model)
+    router.record_race(winner, len(launched) > 1, launched)
+
+
+def race(router, attempt, is_valid, can_hedge=lambda: True):
+    """Runs attempt(model, race, cancelled) on the best model, hedging on the next ones when it is slow.
+
+    A new attempt starts when the newest one has outlived its model's hedge delay, or has
+    failed, up to HEDGE_MAX_ATTEMPTS, and only if can_hedge() allows the extra upstream call.
+    The first result passing is_valid wins; the other attempts have their cancelled Event set
+    and are expected to stop with AttemptCancelled (cancelled is None when nothing is raced).
+    race() returns without waiting for them: an attempt holding resources (an admission slot)
+    frees them itself when it stops. Returns (model, result). If no attempt succeeds, the last
+    invalid result is returned or else the first error raised.
+    """
+    candidates = router.candidates()
+    state = Race(candidates[0])
+    if not router.hedging:
+        return _single(router, state, attempt, is_valid)
+
+    candidates = candidates[:HEDGE_MAX_ATTEMPTS]
+    results = queue.Queue()
+    launched = []
+
+    def launch(model):
+        cancelled = threading.Event()
+        state.add(model, cancelled.set)
+        launched.append(model)
+        start = time.monotonic()
+
+        def run():
+            try:
+                result = attempt(model, state, cancelled)
+                results.put((model, time.monotonic() - start, result, None))
+            except BaseException as e:
+                results.put((model, time.monotonic() - start, None, e))
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return start
+
+    def next_model():
+        return candidates[len(launched)] if len(launched) < len(candidates) and state.winner is None else None
+
+    last_start = launch(candidates[0])
+    first_error, fallback = None, None
+    try:
+        while len(state.finished) < len(launched):
+            timeout = None
+            if next_model() is not None:
+                timeout = max(0.0, last_start + router.hedge_delay(launched[-1]) - time.monotonic())
+            try:
+                model, latency, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                if can_hedge():
+                    last_start = launch(next_model())
+                else:
+                    # No spare upstream capacity: ride this one out
+                    candidates = launched[:]
+                continue
+
+            state.finished.add(model)
+            if isinstance(error, AttemptCancelled):
+                router.record_cancelled(model)
+                continue
+            ok = error is None and is_valid(result)
+            router.record(model, latency, ok)
+            if ok:
+                state.cancel_others(model)
+                _finish(router, state, launched, model)
+                return model, result
+            if error is None:
+                fallback = (model, result)
+            else:
+                first_error = first_error or error
+            # Fail over straight away rather than waiting out the hedge delay
+            if next_model() is not None and can_hedge():
+                last_start = launch(next_model())
+    except BaseException:
+        state.cancel_others(None)
+        raise
+
+    _finish(router, state, launched, None)
+    if fallback is not None:
+        return fallback
+    raise first_error or RuntimeError("Every model attempt was cancelled")
+
+
+def _single(router, state, attempt, is_valid):
+    model = state.primary
+    start = time.monotonic()
+    try:
+        result = attempt(model, state, None)
+    except Exception:
+        router.record(model, time.monotonic() - start, False)
+        router.record_race(None, False, [model])
+        raise
+    ok = is_valid(result)
+    router.record(model, time.monotonic() - start, ok)
+    router.record_race(model if ok else None, False, [model])
+    return model, result
+
+
+async def race_async(router, attempt, is_valid, can_hedge=lambda: True):
+    """race() for the event loop: attempt(model, race) is a coroutine and losing attempts are cancelled tasks."""
+    candidates = router.candidates()
+    state = Race(candidates[0])
+    if not router.hedging:
+        model = state.primary
+        start = time.monotonic()
+        try:
+            result = await attempt(model, state)
+        except Exception:
+            router.record(model, time.monotonic() - start, False)
+            router.record_race(None, False, [model])
+            raise
+        ok = is_valid(result)
+        router.record(model, time.monotonic() - start, ok)
+        router.record_race(model if ok else None, False, [model])
+        return model, result
+
+    candidates = candidates[:HEDGE_MAX_ATTEMPTS]
+    tasks = {}
+    launched = []
+
+    def launch(model):
+        task = asyncio.ensure_future(attempt(model, state))
+        state.add(model, task.cancel)
+        launched.append(model)
+        tasks[task] = (model, time.monotonic())
+        return time.monotonic()
+
+    def next_model():
+        return candidates[len(launched)] if len(launched) < len(candidates) and state.winner is None else None
+
+    last_start = launch(candidates[0])
+    first_error, fallback = None, None
+    try:
+        while tasks:
+            timeout = None
+            if next_model() is not None:
+                timeout = max(0.0, last_start + router.hedge_delay(launched[-1]) - time.monotonic())
+            done, _ = await asyncio.wait(list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if can_hedge():
+                    last_start = launch(next_model())
+                else:
+                    candidates = launched[:]
+                continue
+
+            for task in done:
+                model, start = tasks.pop(task)
+                state.finished.add(model)
+                if task.cancelled() or isinstance(task.exception(), AttemptCancelled):
+                    router.record_cancelled(model)
+                    continue
+                error = task.exception()
+                result = task.result() if error is None else None
+                ok = error is None and is_valid(result)
+                router.record(model, time.monotonic() - start, ok)
+                if ok:
+                    state.cancel_others(model)
+                    _finish(router, state, launched, model)
+                    return model, result
+                if error is None:
+                    fallback = (model, result)
+                else:
+                    first_error = first_error or error
+                if next_model() is not None and can_hedge():
+                    last_start = launch(next_model())
+    except BaseException:
+        state.cancel_others(None)
+        raise
+
+    _finish(router, state, launched, None)
+    if fallback is not None:
+        return fallback
+    raise first_error or RuntimeError("Every model attempt was cancelled")
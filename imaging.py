@@ -0,0 +1,125 @@
+import io
+import os
+import base64
+import logging
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# --- IMAGE NORMALIZATION SETTINGS ---
+# Everything sent upstream is auto-rotated, shrunk and re-encoded to fit these limits.
+# Smaller/lower quality is faster and cheaper; larger keeps more detail for the model.
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1") != "0"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2000"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MIN_QUALITY = int(os.getenv("IMAGE_MIN_QUALITY", "55"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(1024 * 1024)))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "0") == "1"
+
+OUTPUT_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+def pipeline_signature():
+    """Short description of the active settings; part of the result cache key."""
+    if not IMAGE_NORMALIZE:
+        return "raw"
+    return f"{IMAGE_FORMAT}:{IMAGE_MAX_EDGE}:{IMAGE_QUALITY}-{IMAGE_MIN_QUALITY}:{IMAGE_MAX_BYTES}:{int(IMAGE_GRAYSCALE)}"
+
+
+def _raster_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+def _encode(img, pil_format, quality):
+    out = io.BytesIO()
+    options = {"quality": quality}
+    if pil_format == "JPEG":
+        options.update(optimize=True, progressive=True)
+    else:
+        options["method"] = 4
+    img.save(out, format=pil_format, **options)
+    return out.getvalue()
+
+
+def normalize_image(data, mime_type):
+    """Rotates, downscales and re-encodes an image for the upstream. Returns (data, mime_type).
+
+    data is raw bytes (any buffer) or a base64 str. If the image can't be processed, or the
+    result would not be smaller than an upload that needed no changes, the input is returned.
+    """
+    if not IMAGE_NORMALIZE:
+        return data, mime_type
+    try:
+        return _normalize(data, mime_type)
+    except Exception as e:
+        logger.warning("Image normalization skipped for %s: %s", mime_type, e)
+        return data, mime_type
+
+
+def _normalize(data, mime_type):
+    pil_format, out_mime = OUTPUT_FORMATS.get(IMAGE_FORMAT, OUTPUT_FORMATS["jpeg"])
+
+    raw = base64.b64decode(data) if isinstance(data, str) else data
+    original_size = len(raw)
+
+    img = Image.open(io.BytesIO(raw))
+    # JPEG can decode straight to a reduced size, far cheaper than a full decode + resize
+    img.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    img.load()
+
+    changed = img.format != pil_format
+    start_raster = _raster_bytes(img)
+
+    # 1. EXIF auto-rotation (phone photos are often stored sideways)
+    orientation = img.getexif().get(0x0112, 1)
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+        changed = True
+        logger.debug("normalize: exif orientation %d applied", orientation)
+
+    # 2. Flatten to a mode the encoder accepts (JPEG has no alpha)
+    if IMAGE_GRAYSCALE:
+        if img.mode != "L":
+            before = _raster_bytes(img)
+            img = img.convert("L")
+            changed = True
+            logger.debug("normalize: grayscale saved %d raster bytes", before - _raster_bytes(img))
+    elif img.mode not in ("RGB", "L"):
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    # 3. Downscale to the configured long edge
+    if max(img.size) > IMAGE_MAX_EDGE:
+        before = _raster_bytes(img)
+        img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+        changed = True
+        logger.debug("normalize: downscale to %dx%d saved %d raster bytes", img.width, img.height,
+                     before - _raster_bytes(img))
+
+    # 4. Re-encode, stepping quality (then size) down until it fits the byte budget
+    quality = IMAGE_QUALITY
+    encoded = _encode(img, pil_format, quality)
+    while len(encoded) > IMAGE_MAX_BYTES:
+        if quality - 10 >= IMAGE_MIN_QUALITY:
+            quality -= 10
+        elif min(img.size) > 400:
+            img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.LANCZOS)
+        else:
+            break
+        encoded = _encode(img, pil_format, quality)
+        logger.debug("normalize: re-encoded at q=%d %dx%d -> %d bytes", quality, img.width, img.height, len(encoded))
+
+    if not changed and len(encoded) >= original_size:
+        logger.info("normalize: kept original %s (%d bytes)", mime_type, original_size)
+        return data, mime_type
+
+    logger.info("normalize: %s %d -> %s %d bytes (saved %d, raster %d -> %d)", mime_type, original_size,
+                out_mime, len(encoded), original_size - len(encoded), start_raster, _raster_bytes(img))
+    return encoded, out_mime
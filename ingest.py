@@ -0,0 +1,202 @@
+"""Bulk ingest: extracts every image and PDF under directories or zip archives into a JSONL file.
+
+Usage: python ingest.py INPUT [INPUT ...] --out results.jsonl [--concurrency 8] [--refresh]
+
+Runs the same pipeline as /api/v1/extract in-process (local MRZ/PDF fast paths, result
+cache, coalescing, admission control, model hedging), without the web server. Each input
+gets one JSON line:
+    {"input": "scans/a.jpg", "status": "success", "path": "llm", "data": {...}, "seconds": 2.1}
+    {"input": "batch.zip:b.pdf", "status": "error", "error": "...", "seconds": 0.4}
+
+Finished inputs (successes, and images the quality gate rejects, which would fail again) are
+appended to a checkpoint file (--checkpoint, default OUT.checkpoint) once their line is
+written. A rerun with the same inputs skips them, so an interrupted or partly failed run
+only redoes what is left. Transient failures get an error line and are retried by the
+next run. An input may therefore appear more than once in the output: its last line wins.
+
+Upstream pacing comes from the admission settings (UPSTREAM_RPS, UPSTREAM_TOKENS_PER_MIN,
+UPSTREAM_MAX_CONCURRENT): give it enough --concurrency to keep them busy and it runs at
+the quota. Calls the admission queue turns away are retried after their Retry-After.
+"""
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import extract_item
+from admission import set_lane
+
+EXTENSIONS = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp",
+              ".pdf": "application/pdf"}
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+# Attempts per input when the admission queue sheds it (503 in the API)
+INGEST_OVERLOAD_RETRIES = int(os.getenv("INGEST_OVERLOAD_RETRIES", "5"))
+
+
+def mime_type_for(name):
+    return EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+
+def walk_inputs(paths):
+    """Yields (input_id, read) for every supported file under paths, in a stable order.
+
+    input_id is the file's path as reached from the argument, or "archive.zip:member" for a
+    zip member; read() returns its bytes.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from walk_inputs([os.path.join(root, name)])
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in sorted(archive.namelist()):
+                    if not member.endswith("/") and mime_type_for(member):
+                        yield f"{path}:{member}", lambda member=member, archive=archive: archive.read(member)
+        elif mime_type_for(path):
+            yield path, lambda path=path: _read_file(path)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_checkpoint(path):
+    """Input ids already finished by an earlier run."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+class Ingest:
+    """Runs inputs through extract_item on a bounded pool, writing results and the checkpoint as they finish."""
+
+    def __init__(self, out, checkpoint, total, concurrency, cache_mode):
+        self.total = total
+        self.concurrency = concurrency
+        self.cache_mode = cache_mode
+        self._out = open(out, "a", encoding="utf-8")
+        self._checkpoint = open(checkpoint, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        # Inputs read but not finished: bounds how many documents sit in memory
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self.counts = {"success": 0, "rejected": 0, "error": 0, "skipped": 0}
+        self.started = time.monotonic()
+
+    def run(self, inputs, done_ids):
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingest")
+        try:
+            for input_id, read in inputs:
+                if input_id in done_ids:
+                    self.counts["skipped"] += 1
+                    continue
+                self._slots.acquire()
+                try:
+                    data = read()
+                except (OSError, zipfile.BadZipFile) as e:
+                    self._slots.release()
+                    self._record(input_id, {"status": "error", "error": f"Unreadable input: {e}"}, 0.0, False)
+                    continue
+                executor.submit(self._extract, input_id, data, mime_type_for(input_id))
+            executor.shutdown(wait=True)
+        except BaseException:
+            # On Ctrl-C, queued inputs are dropped; the ones already running still get written
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            self._out.close()
+            self._checkpoint.close()
+
+    def _extract(self, input_id, data, mime_type):
+        set_lane("background")
+        start = time.monotonic()
+        try:
+            for attempt in range(INGEST_OVERLOAD_RETRIES):
+                item = extract_item(0, data, mime_type, self.cache_mode)
+                if "retry_after" not in item or attempt == INGEST_OVERLOAD_RETRIES - 1:
+                    break
+                time.sleep(item["retry_after"])
+            item.pop("index", None)
+            # Rejected uploads won't do better next time; other errors are worth a rerun
+            finished = item["status"] == "success" or "reason" in item
+            self._record(input_id, item, time.monotonic() - start, finished)
+        except Exception as e:
+            self._record(input_id, {"status": "error", "error": str(e)}, time.monotonic() - start, False)
+        finally:
+            self._slots.release()
+
+    def _record(self, input_id, item, seconds, finished):
+        line = json.dumps({"input": input_id, **item, "seconds": round(seconds, 3)}, ensure_ascii=False)
+        with self._lock:
+            self._out.write(line + "\n")
+            self._out.flush()
+            if finished:
+                # Only after its result line is out, so a crash never skips an unwritten input
+                self._checkpoint.write(input_id + "\n")
+                self._checkpoint.flush()
+            key = "success" if item["status"] == "success" else "rejected" if "reason" in item else "error"
+            self.counts[key] += 1
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started
+        processed = self.counts["success"] + self.counts["rejected"] + self.counts["error"]
+        remaining = self.total - processed - self.counts["skipped"]
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "?"
+        return (f"{processed + self.counts['skipped']}/{self.total} "
+                f"(ok {self.counts['success']}, rejected {self.counts['rejected']}, failed {self.counts['error']}, "
+                f"skipped {self.counts['skipped']}) {rate:.2f} docs/s, eta {eta}")
+
+
+def report_progress(ingest, interval, stop):
+    """Prints progress every interval seconds until stop is set (in place when stderr is a terminal)."""
+    tty = sys.stderr.isatty()
+    while not stop.wait(interval):
+        sys.stderr.write(("\r" if tty else "") + ingest.progress() + ("" if tty else "\n"))
+        sys.stderr.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="files, directories or zip archives")
+    parser.add_argument("--out", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="finished inputs (default: OUT.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    parser.add_argument("--refresh", action="store_true", help="ignore cached results (they are still updated)")
+    parser.add_argument("--progress-interval", type=float, default=2.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    checkpoint = args.checkpoint or args.out + ".checkpoint"
+    done_ids = load_checkpoint(checkpoint)
+    # Listing is cheap next to extraction, and gives the progress line a total
+    total = sum(1 for _ in walk_inputs(args.inputs))
+
+    ingest = Ingest(args.out, checkpoint, total, max(1, args.concurrency), "refresh" if args.refresh else "use")
+    stop = threading.Event()
+    reporter = threading.Thread(target=report_progress, args=(ingest, args.progress_interval, stop), daemon=True)
+    reporter.start()
+    try:
+        ingest.run(walk_inputs(args.inputs), done_ids)
+    except KeyboardInterrupt:
+        print("\ninterrupted: rerun the same command to resume", file=sys.stderr)
+        return 130
+    finally:
+        stop.set()
+        reporter.join()
+        print(("\n" if sys.stderr.isatty() else "") + ingest.progress(), file=sys.stderr)
+    return 1 if ingest.counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
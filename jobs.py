@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import ipaddress
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+from cache import DATA_DIR, private_db_file
+
+logger = logging.getLogger(__name__)
+
+# --- JOB QUEUE SETTINGS ---
+# Like the result cache, the queue is a local SQLite file shared by every process. Who drains it:
+#   worker  web workers only enqueue; the "worker" process (python jobs.py) drains it (Procfile)
+#   app     web workers drain it themselves, for single-box deployments without a worker process
+#   none    nothing can: /api/v1/jobs submissions are refused with a 501. Serverless platforms
+#           (vercel.json) freeze a function between requests and keep no local disk.
+# Either way each draining process runs JOBS_WORKERS threads.
+JOBS_DRAINER = os.getenv("JOBS_DRAINER", "worker")
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(DATA_DIR, "passport_jobs.sqlite3"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_TTL = int(os.getenv("JOBS_TTL", str(24 * 3600)))
+# Running jobs have their lease renewed every third of it; one whose lease runs out anyway
+# (worker crashed or restarted) goes back on the queue.
+JOBS_LEASE = int(os.getenv("JOBS_LEASE", "120"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# Wait before retrying a job that failed transiently, unless the error says how long (Retry-After)
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "30"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1.0"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+# Webhooks go only to hosts resolving to public addresses, so a client can't make the worker
+# call loopback, link-local (cloud metadata) or private-network services. Hosts listed here
+# (comma-separated) skip that check, e.g. a receiver on the internal network.
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+
+class UnsafeWebhook(ValueError):
+    """A webhook URL the worker won't call. Routes answer 400."""
+
+
+def check_webhook_url(url):
+    """Raises UnsafeWebhook unless url is http(s) and its host resolves only to public addresses."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise UnsafeWebhook("webhook_url is not a valid URL")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeWebhook("webhook_url must be an http(s) URL")
+    if parts.hostname in WEBHOOK_ALLOWED_HOSTS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except (OSError, UnicodeError):
+        raise UnsafeWebhook("webhook_url host does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise UnsafeWebhook("webhook_url must point to a public address")
+
+
+class JobQueue:
+    """Durable extraction queue in SQLite, drained by a pool of background threads."""
+
+    def __init__(self, db_path=JOBS_DB_PATH, ttl=JOBS_TTL, lease=JOBS_LEASE, max_attempts=JOBS_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self._local = threading.local()
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+    # One connection per thread; autocommit mode so transactions are explicit
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            private_db_file(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, mime_type TEXT NOT NULL, payload BLOB, "
+                "webhook_url TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_expires REAL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, payload, mime_type, webhook_url=None):
+        """Stores an upload as a queued job and returns its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db().execute(
+            "INSERT INTO jobs (id, status, mime_type, payload, webhook_url, created_at, updated_at, expires_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, mime_type, bytes(payload), webhook_url, now, now, now + self.ttl),
+        )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Returns the public view of a job, or None if it doesn't exist (or has expired)."""
+        row = self._db().execute(
+            "SELECT id, status, result, error, attempts, created_at, updated_at, expires_at "
+            "FROM jobs WHERE id = ? AND expires_at > ?", (job_id, time.time())
+        ).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def depth(self):
+        """Counts live jobs by status."""
+        rows = self._db().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE expires_at > ? GROUP BY status", (time.time(),)
+        ).fetchall()
+        counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def purge_expired(self):
+        """Deletes jobs past their TTL and fails jobs that used up their attempts."""
+        now = time.time()
+        db = self._db()
+        db.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+        db.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker died while processing the job', payload = NULL, "
+            "updated_at = ? WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts),
+        )
+
+    def _claim(self):
+        """Atomically takes the oldest queued (or orphaned) job. Safe across processes.
+
+        A queued job's lease_expires, when set, is the time a retry may start.
+        """
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, mime_type, payload, webhook_url, attempts FROM jobs "
+                "WHERE (status = 'queued' OR status = 'running') AND (lease_expires IS NULL OR lease_expires < ?) "
+                "AND attempts < ? AND expires_at > ? ORDER BY created_at LIMIT 1",
+                (now, self.max_attempts, now),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?, updated_at = ? "
+                    "WHERE id = ?", (now + self.lease, now, row["id"])
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, result=None, error=None):
+        # The upload isn't needed any more once the job has an outcome
+        self._db().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ?",
+            ("failed" if error is not None else "succeeded", result, error, time.time(), job_id),
+        )
+
+    def _retry_later(self, job_id, delay):
+        """Puts a job that failed transiently back on the queue, to be claimed again after delay seconds."""
+        now = time.time()
+        self._db().execute(
+            "UPDATE jobs SET status = 'queued', lease_expires = ?, updated_at = ? WHERE id = ?",
+            (now + delay, now, job_id),
+        )
+
+    def _renew_leases(self):
+        """Heartbeat thread: keeps the leases of this process's running jobs from running out mid-extraction."""
+        while True:
+            time.sleep(self.lease / 3)
+            with self._running_lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                self._db().execute(
+                    f"UPDATE jobs SET lease_expires = ? WHERE status = 'running' "
+                    f"AND id IN ({','.join('?' * len(running))})", (time.time() + self.lease, *running))
+            except sqlite3.Error as e:
+                logger.warning("Job lease renewal failed: %s", e)
+
+    def _fire_webhook(self, url, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return
+        try:
+            # Checked again at send time: the host may resolve elsewhere than at submission.
+            # Redirects aren't followed, as they could lead anywhere.
+            check_webhook_url(url)
+            requests.post(url, json=job, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+        except (UnsafeWebhook, requests.RequestException) as e:
+            logger.warning("Webhook for job %s failed: %s", job_id, e)
+
+    def _work(self, handler, retry_on):
+        """Worker thread body: claim, run, record, repeat."""
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.warning("Job queue unavailable: %s", e)
+                row = None
+
+            if row is None:
+                # Other processes may enqueue too, so poll even without a wakeup
+                self._wakeup.wait(JOBS_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            with self._running_lock:
+                self._running.add(row["id"])
+            try:
+                result = handler(row["payload"], row["mime_type"])
+                self._finish(row["id"], result=result)
+            except Exception as e:
+                # The claim counted this attempt
+                if isinstance(e, retry_on) and row["attempts"] + 1 < self.max_attempts:
+                    self._retry_later(row["id"], getattr(e, "retry_after", None) or JOBS_RETRY_DELAY)
+                    continue
+                self._finish(row["id"], error=str(e))
+            finally:
+                with self._running_lock:
+                    self._running.discard(row["id"])
+
+            if row["webhook_url"]:
+                self._fire_webhook(row["webhook_url"], row["id"])
+
+    def _janitor(self):
+        while True:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning("Job purge failed: %s", e)
+            time.sleep(60)
+
+    def start(self, handler, workers=JOBS_WORKERS, retry_on=()):
+        """Starts the worker threads once per process. handler(payload_bytes, mime_type) -> result string.
+
+        Jobs failing with one of the retry_on exception types are queued again while they have
+        attempts left; other errors fail them.
+        """
+        if workers <= 0 or self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            for i in range(workers):
+                threading.Thread(target=self._work, args=(handler, retry_on), name=f"job-worker-{i}",
+                                 daemon=True).start()
+            threading.Thread(target=self._renew_leases, name="job-leases", daemon=True).start()
+            threading.Thread(target=self._janitor, name="job-janitor", daemon=True).start()
+
+    @staticmethod
+    def _to_dict(row):
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "expires_at": row["expires_at"],
+        }
+        if row["result"] is not None:
+            try:
+                job["data"] = json.loads(row["result"])
+            except ValueError:
+                job["raw_output"] = row["result"]
+                job["error"] = "LLM returned invalid JSON format"
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+
+job_queue = JobQueue()
+
+
+if __name__ == '__main__':
+    # The queue drainer: a separate "worker" process next to the web dynos.
+    # Go through the imported module so app.py and this script share one queue instance.
+    from app import run_job, TRANSIENT_JOB_ERRORS
+    from jobs import job_queue as queue
+    logging.basicConfig(level=logging.INFO)
+    queue.start(run_job, retry_on=TRANSIENT_JOB_ERRORS)
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,66 @@
+import json
+
+
+class ObjectStreamParser:
+    """Scans a JSON object as it streams in and reports each top-level member once it is complete.
+
+    Anything before the opening '{' (such as a stray markdown fence) is skipped, as is
+    anything after the closing '}'.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.member = []
+
+    def feed(self, text):
+        """Consumes the next chunk of text. Returns the (key, value) members completed by it."""
+        members = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                self.member.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.finished = True
+                    self._finish_member(members)
+                    continue
+            elif char == "," and self.depth == 1:
+                self._finish_member(members)
+                continue
+            self.member.append(char)
+        return members
+
+    def _finish_member(self, members):
+        raw = "".join(self.member).strip()
+        self.member = []
+        if not raw:
+            return
+        try:
+            members.extend(json.loads("{" + raw + "}").items())
+        except ValueError:
+            # Malformed member: leave it to the final json.loads of the whole output to report
+            pass
@@ -0,0 +1,156 @@
+import os
+import hmac
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import (CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+
+# --- METRICS SETTINGS ---
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py does this), every worker writes its samples
+# to files in that directory and /metrics merges them, so scrapes see the whole server rather than
+# whichever worker happened to answer. Without it, metrics are per-process.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# With METRICS_TOKEN set, /metrics wants "Authorization: Bearer <METRICS_TOKEN>" (bearer_token in
+# a Prometheus scrape config). Unset, it is open, for scrapers on a private network. It is not
+# the API key, so the scraper's credential can't run paid extractions.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Stage timings span sub-millisecond (cache lookups) to minutes (slow upstream answers)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+STAGE_SECONDS = Histogram("passport_stage_seconds", "Time spent in each stage of the request path",
+                          ["stage"], buckets=STAGE_BUCKETS)
+REQUEST_SECONDS = Histogram("passport_request_seconds", "Time to produce a response, per endpoint",
+                            ["endpoint", "status"], buckets=STAGE_BUCKETS)
+UPLOAD_BYTES = Counter("passport_upload_bytes", "Bytes of documents uploaded by clients")
+CLIENT_UPLOADS = Counter("passport_client_uploads", "Web UI uploads, by whether the browser shrank them first",
+                         ["mode"])
+UPLOAD_BYTES_SAVED = Counter("passport_upload_bytes_saved", "Bytes browsers saved by shrinking images before upload")
+UPSTREAM_BYTES = Counter("passport_upstream_payload_bytes", "Bytes of request bodies sent to OpenRouter")
+TOKENS = Counter("passport_tokens", "Tokens reported in OpenRouter usage blocks", ["kind"])
+CACHE_RESULTS = Counter("passport_cache_results", "Result cache outcomes", ["status"])
+COALESCED = Counter("passport_coalesced_calls", "Upstream calls saved by joining an identical in-flight extraction",
+                    ["scope"])
+QUALITY_REJECTED = Counter("passport_quality_rejected", "Uploads turned away by the local image quality gate",
+                           ["reason"])
+TILED_DOCUMENTS = Counter("passport_tiled_documents", "Documents sent upstream in bulk tiling mode, by outcome",
+                          ["outcome"])
+REEXTRACTED_FIELDS = Counter("passport_reextracted_fields",
+                             "Fields asked for again after failing validation, by whether the follow-up fixed them",
+                             ["field", "outcome"])
+HEDGES = Counter("passport_hedged_calls", "Extra upstream calls made because the first model was slow or failed",
+                 ["model"])
+MODEL_WINS = Counter("passport_model_wins", "Extractions answered, by the model that answered first", ["model"])
+DEADLINE_ABANDONED = Counter("passport_deadline_abandoned",
+                             "Requests given up on because their deadline passed, by the stage that noticed",
+                             ["stage"])
+ERRORS = Counter("passport_errors", "Failed extractions by error class", ["error"])
+
+
+class StageTimings:
+    """Per-request stage durations, reported back to the client in a Server-Timing header."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        # Batch items run on a thread pool and add to the same request's timings
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def header(self, total):
+        with self._lock:
+            stages = list(self._stages.items())
+        stages.append(("total", total))
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages)
+
+
+_current = contextvars.ContextVar("stage_timings", default=None)
+
+
+def begin_request():
+    """Starts collecting stage timings for the request running in this context."""
+    timings = StageTimings()
+    _current.set(timings)
+    return timings
+
+
+def finish_request(endpoint, status):
+    """Records the current request's duration. Returns its Server-Timing header value, or None."""
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+    elapsed = time.perf_counter() - timings.start
+    REQUEST_SECONDS.labels(endpoint, str(status)).observe(elapsed)
+    return timings.header(elapsed)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block as one stage, for /metrics and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def bind_request(fn):
+    """Wraps fn to run in the calling request's context on another thread.
+
+    Stages it times count towards that request, and per-request settings such as the
+    admission lane carry over.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call gets a copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def record_usage(usage):
+    """Counts the tokens of an OpenRouter usage block."""
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if (usage or {}).get(kind):
+            TOKENS.labels(kind[:-len("_tokens")]).inc(usage[kind])
+
+
+def record_error(error):
+    """Counts an extraction failure. Upstream HTTP errors are labelled with their status code."""
+    # requests.HTTPError and httpx.HTTPStatusError both carry the upstream response
+    response = getattr(error, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        name = f"upstream_{response.status_code}"
+    else:
+        name = type(error).__name__
+    ERRORS.labels(name).inc()
+
+
+def scrape_allowed(auth_header):
+    """True if a /metrics request with this Authorization header may be answered."""
+    if not METRICS_TOKEN:
+        return True
+    return bool(auth_header) and hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+def render():
+    """Returns (body, content_type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
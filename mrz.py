@@ -0,0 +1,227 @@
+import re
+from datetime import date, datetime
+
+# --- MACHINE READABLE ZONE (ICAO 9303) ---
+# TD3 = passports (2 x 44), TD2 = older ID cards/visas (2 x 36), TD1 = ID cards (3 x 30)
+MRZ_FORMATS = {"TD3": (2, 44), "TD2": (2, 36), "TD1": (3, 30)}
+
+_MRZ_LINE_RE = re.compile(r"[A-Z0-9<]+")
+_WEIGHTS = (7, 3, 1)
+
+# Fields the MRZ protects with check digits; these win over the LLM when they disagree
+PROTECTED_FIELDS = ("passport_number", "document_number", "Date of Birth", "Date of Expiry", "personal_number")
+COMPARED_FIELDS = PROTECTED_FIELDS + ("first_name", "last_name", "Nationality", "gender")
+
+
+def _char_value(char):
+    if char.isdigit():
+        return ord(char) - 48
+    if "A" <= char <= "Z":
+        return ord(char) - 55
+    return 0
+
+
+def check_digit(field):
+    """ICAO 9303 check digit: weights 7,3,1 over digit/letter values, '<' counts as 0."""
+    return str(sum(_char_value(c) * _WEIGHTS[i % 3] for i, c in enumerate(field)) % 10)
+
+
+def _check(field, digit):
+    # An all-filler optional field may carry '<' instead of a check digit
+    if digit == "<":
+        return field.strip("<") == ""
+    return check_digit(field) == digit
+
+
+def clean_mrz_line(line):
+    """Uppercases and strips spaces; also maps the '«' some OCR/text layers produce back to '<'."""
+    return line.upper().replace("«", "<").replace(" ", "").strip()
+
+
+def find_mrz(text):
+    """Finds the first run of lines in text that looks like an MRZ. Returns the list of lines or None."""
+    lines = [clean_mrz_line(line) for line in text.splitlines()]
+    for start in range(len(lines)):
+        for count, length in MRZ_FORMATS.values():
+            block = lines[start:start + count]
+            if len(block) == count and all(len(line) == length and _MRZ_LINE_RE.fullmatch(line) for line in block):
+                return block
+    return None
+
+
+def _mrz_date(value, kind):
+    """YYMMDD -> date. Birth dates are never in the future; expiry dates are never far in the past."""
+    try:
+        yy, mm, dd = int(value[0:2]), int(value[2:4]), int(value[4:6])
+    except ValueError:
+        return None
+    today = date.today()
+    if kind == "birth":
+        year = 2000 + yy if 2000 + yy <= today.year else 1900 + yy
+    else:
+        year = 2000 + yy if 2000 + yy <= today.year + 50 else 1900 + yy
+    try:
+        return date(year, mm, dd)
+    except ValueError:
+        return None
+
+
+def _names(field):
+    surname, _, given = field.partition("<<")
+    return surname.replace("<", " ").strip(), given.replace("<", " ").split()
+
+
+def _text(field):
+    return field.replace("<", " ").strip()
+
+
+def parse_mrz(lines):
+    """Parses TD1/TD2/TD3 lines. Returns a dict of raw fields, per-field check results and 'valid'."""
+    lines = [clean_mrz_line(line) for line in lines]
+    shape = (len(lines), len(lines[0]) if lines else 0)
+    kind = next((name for name, fmt in MRZ_FORMATS.items() if fmt == shape), None)
+    if kind is None or any(len(line) != shape[1] or not _MRZ_LINE_RE.fullmatch(line) for line in lines):
+        raise ValueError("Text is not a TD1, TD2 or TD3 machine readable zone")
+
+    if kind == "TD1":
+        l1, l2, l3 = lines
+        number, number_check, optional = l1[5:14], l1[14], l1[15:30]
+        # Document numbers longer than 9 characters spill into the optional field
+        if number_check == "<" and optional.strip("<"):
+            spill = optional.split("<", 1)[0]
+            # Nothing before the first filler: no spilled digit, and the '<' check fails below
+            if spill:
+                number, number_check, optional = number + spill[:-1], spill[-1], optional[len(spill):]
+        fields = {
+            "document_type": l1[0:2], "issuing_state": l1[2:5],
+            "document_number": number, "birth_date": l2[0:6], "sex": l2[7], "expiry_date": l2[8:14],
+            "nationality": l2[15:18], "optional": optional + l2[18:29], "names": l3,
+        }
+        checks = {
+            "document_number": _check(number, number_check),
+            "birth_date": _check(l2[0:6], l2[6]),
+            "expiry_date": _check(l2[8:14], l2[14]),
+            "composite": _check(l1[5:30] + l2[0:7] + l2[8:15] + l2[18:29], l2[29]),
+        }
+    else:
+        l1, l2 = lines
+        width = shape[1]
+        fields = {
+            "document_type": l1[0:2], "issuing_state": l1[2:5], "names": l1[5:],
+            "document_number": l2[0:9], "nationality": l2[10:13], "birth_date": l2[13:19],
+            "sex": l2[20], "expiry_date": l2[21:27],
+            "optional": l2[28:42] if kind == "TD3" else l2[28:35],
+        }
+        checks = {
+            "document_number": _check(l2[0:9], l2[9]),
+            "birth_date": _check(l2[13:19], l2[19]),
+            "expiry_date": _check(l2[21:27], l2[27]),
+            "composite": _check(l2[0:10] + l2[13:20] + l2[21:width - 1], l2[width - 1]),
+        }
+        if kind == "TD3":
+            checks["personal_number"] = _check(l2[28:42], l2[42])
+
+    birth = _mrz_date(fields["birth_date"], "birth")
+    expiry = _mrz_date(fields["expiry_date"], "expiry")
+    checks["dates"] = birth is not None and expiry is not None
+
+    return {
+        "format": kind,
+        "fields": fields,
+        "birth_date": birth,
+        "expiry_date": expiry,
+        "checks": checks,
+        "valid": all(checks.values()),
+    }
+
+
+def mrz_to_schema(parsed):
+    """Maps a parse_mrz() result onto the JSON schema process_passport_image returns.
+
+    Fields the MRZ doesn't carry (issue date, places, authority) are left empty.
+    """
+    fields = parsed["fields"]
+    surname, given = _names(fields["names"])
+    number = _text(fields["document_number"])
+    is_passport = fields["document_type"].startswith("P")
+    return {
+        "first_name": given[0] if given else "",
+        "last_name": surname,
+        "Date of Birth": parsed["birth_date"].isoformat() if parsed["birth_date"] else "",
+        "Date of Issue": "",
+        "Nationality": _text(fields["nationality"]),
+        "place of passport issuance": "",
+        "middle name": " ".join(given[1:]),
+        "gender": {"M": "male", "F": "female"}.get(fields["sex"], ""),
+        "place of birth": "",
+        "issuing authority": "",
+        "Date of Expiry": parsed["expiry_date"].isoformat() if parsed["expiry_date"] else "",
+        "passport_number": number if is_passport else "",
+        "personal_number": _text(fields["optional"]) if parsed["format"] == "TD3" else "",
+        "document_number": number,
+    }
+
+
+# Date formats seen in LLM output, tried in order
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%d %b %Y", "%d %B %Y", "%b %d %Y",
+                 "%B %d %Y", "%Y/%m/%d", "%d%m%Y", "%y%m%d")
+
+
+def parse_date(value):
+    """Best-effort parse of a date string in the common passport/LLM formats. Returns a date or None."""
+    if not value or not isinstance(value, str):
+        return None
+    # Bilingual months such as '12 JAN/JAN 2030' keep their first spelling
+    text = re.sub(r"([A-Za-z]+)/[A-Za-z]+", r"\1", value.replace(",", " "))
+    text = " ".join(text.split())
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _alnum(value):
+    return re.sub(r"[^A-Z0-9]", "", str(value or "").upper())
+
+
+def _matches(field, extracted, expected):
+    if field in ("Date of Birth", "Date of Expiry"):
+        return parse_date(extracted) == parse_date(expected)
+    if field == "gender":
+        return _alnum(extracted)[:1] == _alnum(expected)[:1]
+    ours, theirs = _alnum(extracted), _alnum(expected)
+    if field in ("first_name", "last_name"):
+        # The MRZ truncates long names
+        return ours.startswith(theirs) or theirs.startswith(ours)
+    if field == "Nationality" and len(ours) > 3:
+        # Spelled-out nationalities can't be compared with the 3-letter code
+        return True
+    return ours == theirs
+
+
+def cross_check(data, parsed):
+    """Compares extracted fields with an MRZ. Returns {field: {"extracted": ..., "mrz": ...}} for mismatches."""
+    expected = mrz_to_schema(parsed)
+    mismatches = {}
+    for field in COMPARED_FIELDS:
+        if not expected.get(field):
+            continue
+        if not _matches(field, data.get(field, ""), expected[field]):
+            mismatches[field] = {"extracted": data.get(field, ""), "mrz": expected[field]}
+    return mismatches
+
+
+def apply_mrz(data, parsed):
+    """Cross-checks data against a valid MRZ and overwrites check-digit-protected fields that disagree.
+
+    Returns (corrected_data, mismatches).
+    """
+    mismatches = cross_check(data, parsed)
+    corrected = dict(data)
+    if parsed["valid"]:
+        for field in PROTECTED_FIELDS:
+            if field in mismatches:
+                corrected[field] = mismatches[field]["mrz"]
+    return corrected, mismatches
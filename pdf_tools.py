@@ -0,0 +1,368 @@
+import io
+import os
+import re
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# PyMuPDF (fitz) is imported inside the functions that use it: it is the slowest import in
+# the app and most requests never see a PDF. app.warmup() loads it ahead of time.
+from mrz import find_mrz, parse_mrz, mrz_to_schema, parse_date
+
+# --- MULTI-PAGE PDF SETTINGS ---
+# Only the first PDF_MAX_PAGES pages are considered, so huge PDFs can't eat the CPU.
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "12"))
+PDF_DPI = int(os.getenv("PDF_DPI", "150"))
+# Pages are ranked from cheap low-resolution renders before the winner is rendered at PDF_DPI
+PDF_SCORE_DPI = int(os.getenv("PDF_SCORE_DPI", "50"))
+# How many of the best pages go upstream (stacked into one image when more than one)
+PDF_UPSTREAM_PAGES = int(os.getenv("PDF_UPSTREAM_PAGES", "1"))
+# Minimum score for a page to count as a passport data page in all-pages mode
+PDF_PASSPORT_SCORE = float(os.getenv("PDF_PASSPORT_SCORE", "40"))
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# --- PDF TEXT LAYER ---
+# Digitally generated PDFs (e-passports exports, filled e-forms) carry real text. When it holds a
+# valid MRZ or clearly labelled fields we can answer without rendering or calling the LLM.
+
+# Label patterns, matched at the start of a text line (case-insensitive)
+FIELD_LABELS = [
+    ("last_name", r"(surname|last name|family name)"),
+    ("first_name", r"(given names?|first names?|forenames?)"),
+    ("middle name", r"(middle names?)"),
+    ("passport_number", r"(passport (no\.?|number|nr\.?|#))"),
+    ("document_number", r"(document (no\.?|number))"),
+    ("personal_number", r"(personal (no\.?|number)|national (id|identity) (no\.?|number))"),
+    ("Date of Birth", r"(date of birth|birth date|dob)"),
+    ("Date of Issue", r"(date of issue|issue date|issued on)"),
+    ("Date of Expiry", r"(date of expiry|expiry date|expiration date|date of expiration|valid until)"),
+    ("Nationality", r"(nationality|citizenship)"),
+    ("place of birth", r"(place of birth|birth ?place)"),
+    ("place of passport issuance", r"(place of issue)"),
+    ("issuing authority", r"(issuing authority|authority)"),
+    ("gender", r"(sex|gender)"),
+]
+_LABEL_RES = [(field, re.compile(rf"^{pattern}(?![a-z])\s*(?P<rest>.*)$", re.IGNORECASE)) for field, pattern in FIELD_LABELS]
+
+EMPTY_RESULT = {
+    "first_name": "", "last_name": "", "Date of Birth": "", "Date of Issue": "", "Nationality": "",
+    "place of passport issuance": "", "middle name": "", "gender": "", "place of birth": "",
+    "issuing authority": "", "Date of Expiry": "", "passport_number": "", "personal_number": "",
+    "document_number": "",
+}
+
+
+def _text_lines(page):
+    """The page's text lines with their bounding boxes, top to bottom."""
+    import fitz
+
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            text = " ".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append((text, fitz.Rect(line["bbox"])))
+    lines.sort(key=lambda item: (round(item[1].y0), item[1].x0))
+    return lines
+
+
+def _value_near(lines, label_box):
+    """Finds a field value laid out below its label (same column) or to its right (same row)."""
+    best, best_distance = None, None
+    for text, box in lines:
+        if box == label_box:
+            continue
+        same_row = abs(box.y0 - label_box.y0) < label_box.height * 0.6 and box.x0 >= label_box.x1
+        below = 0 < box.y0 - label_box.y1 < label_box.height * 2.5 and box.x0 < label_box.x1 and box.x1 > label_box.x0
+        if same_row or below:
+            distance = (box.x0 - label_box.x1) if same_row else (box.y0 - label_box.y1) * 2
+            if best_distance is None or distance < best_distance:
+                best, best_distance = text, distance
+    return best
+
+
+def _is_label(text):
+    return any(label_re.match(text) for _, label_re in _LABEL_RES)
+
+
+def labelled_fields(lines):
+    """Maps 'Label: value' / label-over-value layouts onto schema fields."""
+    found = {}
+    for text, box in lines:
+        for field, label_re in _LABEL_RES:
+            match = label_re.match(text)
+            if not match or field in found:
+                continue
+            rest = match.group("rest").strip()
+            if rest.startswith(":"):
+                value = rest[1:].strip()
+            elif rest and not rest.startswith("/"):
+                value = rest
+            else:
+                # Label on its own (possibly with a '/ translation'): the value sits nearby
+                value = _value_near(lines, box)
+                if value and _is_label(value):
+                    value = None
+            if value:
+                found[field] = value
+            break
+    return found
+
+
+def _confident(fields):
+    """Only trust a label-based read that has an ID number, a surname and two real dates."""
+    number = re.sub(r"[\s-]", "", fields.get("passport_number") or fields.get("document_number") or "")
+    return (
+        re.fullmatch(r"[A-Za-z0-9]{6,12}", number) is not None
+        and bool(fields.get("last_name"))
+        and parse_date(fields.get("Date of Birth")) is not None
+        and parse_date(fields.get("Date of Expiry")) is not None
+    )
+
+
+def read_text_layer(pdf_data, max_pages=2):
+    """Tries to answer from the PDF's text layer.
+
+    Returns (result_dict or None, source, mrz_lines): source is "pdf_mrz" or "pdf_text" on a hit;
+    mrz_lines is any MRZ found (valid or not) so the caller can still use it to verify the LLM.
+    """
+    import fitz
+
+    if not isinstance(pdf_data, (bytes, bytearray)):
+        pdf_data = bytes(pdf_data)
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        for page_number in range(min(max_pages, doc.page_count)):
+            lines = _text_lines(doc.load_page(page_number))
+            if not lines:
+                continue
+
+            mrz_lines = find_mrz("\n".join(text for text, _ in lines))
+            labels = labelled_fields(lines)
+
+            if mrz_lines:
+                parsed = parse_mrz(mrz_lines)
+                if parsed["valid"]:
+                    result = mrz_to_schema(parsed)
+                    # The MRZ has no issue date, places or authority; take those from the labels
+                    for field, value in labels.items():
+                        if not result.get(field):
+                            result[field] = value
+                    return result, "pdf_mrz", mrz_lines
+
+            if _confident(labels):
+                result = dict(EMPTY_RESULT)
+                result.update(labels)
+                sex = result["gender"].strip().upper()[:1]
+                result["gender"] = {"M": "male", "F": "female"}.get(sex, result["gender"])
+                given = result["first_name"].split()
+                if len(given) > 1 and not result["middle name"]:
+                    result["first_name"], result["middle name"] = given[0], " ".join(given[1:])
+                return result, "pdf_text", mrz_lines
+
+            if mrz_lines:
+                return None, None, mrz_lines
+        return None, None, None
+    finally:
+        doc.close()
+
+
+# --- MULTI-PAGE RANKING AND RENDERING ---
+# Words that show up on passport data pages (and rarely on covers or visa pages)
+PAGE_KEYWORDS = ("passport", "surname", "given name", "nationality", "date of birth", "date of expiry",
+                 "place of birth", "authority", "passeport", "pasaporte", "reisepass")
+
+# Translate table turning a grayscale row into 0/1 "ink" flags
+_INK = bytes(1 if value < 110 else 0 for value in range(256))
+
+
+def _mrz_band_score(pix):
+    """Looks for MRZ-like texture in the bottom quarter: rows with lots of ink/paper transitions."""
+    width, height, stride = pix.width, pix.height, pix.stride
+    samples = pix.samples
+    band_start = int(height * 0.75)
+    busy_rows = 0
+    ink_rows = 0
+    for row in range(band_start, height):
+        flags = samples[row * stride:row * stride + width].translate(_INK)
+        transitions = flags.count(b"\x00\x01") + flags.count(b"\x01\x00")
+        if transitions >= width * 0.12:
+            busy_rows += 1
+        if flags.count(1) > width * 0.02:
+            ink_rows += 1
+    band_rows = max(1, height - band_start)
+    # Two full-width lines of dense characters: busy rows, but far from an all-ink (photo) band
+    if ink_rows > band_rows * 0.9:
+        return 0.0
+    return min(1.0, busy_rows / (band_rows * 0.15)) * 40
+
+
+def _score_page(page, dpi):
+    """Cheap local estimate of how likely a page is the passport data page."""
+    import fitz
+
+    text = page.get_text()
+    lowered = text.lower()
+    score = 0.0
+
+    if find_mrz(text):
+        score += 100
+    score += min(text.count("<<"), 10) * 2
+    score += sum(8 for keyword in PAGE_KEYWORDS if keyword in lowered)
+
+    # A portrait photo: an embedded image covering a small part of the page, taller than wide
+    page_area = abs(page.rect) or 1
+    for info in page.get_image_info():
+        box = fitz.Rect(info["bbox"])
+        if 0.01 < abs(box) / page_area < 0.2 and box.height > box.width * 1.1:
+            score += 15
+            break
+
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    score += _mrz_band_score(pix)
+    return score
+
+
+def _score_pages(pdf_bytes, page_numbers, dpi):
+    import fitz
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [(page_number, _score_page(doc.load_page(page_number), dpi)) for page_number in page_numbers]
+    finally:
+        doc.close()
+
+
+def _analysis_raster(page, edge, size):
+    """Grayscale render of page at most edge pixels on its long side: (samples, width, height, size).
+
+    size is the (width, height) of the full render it stands in for.
+    """
+    import fitz
+
+    zoom = edge / max(page.rect.width, page.rect.height, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return pix.samples, pix.width, pix.height, size
+
+
+def _render_pages(pdf_bytes, page_numbers, dpi, analysis_edge=0):
+    """Returns [(page_number, png_bytes, raster)]; raster is an _analysis_raster() with analysis_edge, else None."""
+    import fitz
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        rendered = []
+        for page_number in page_numbers:
+            page = doc.load_page(page_number)
+            pix = page.get_pixmap(dpi=dpi)
+            raster = _analysis_raster(page, analysis_edge, (pix.width, pix.height)) if analysis_edge else None
+            rendered.append((page_number, pix.tobytes("png"), raster))
+        return rendered
+    finally:
+        doc.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Lazily started process pool for CPU-bound rendering. Uses spawn: forking a threaded worker is unsafe."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run_chunked(fn, pdf_bytes, page_numbers, dpi):
+    """Runs fn over the pages in parallel chunks (one PDF copy per chunk), or inline for small jobs."""
+    global _pool
+    workers = min(PDF_RENDER_WORKERS, len(page_numbers))
+    if workers <= 1:
+        return fn(pdf_bytes, page_numbers, dpi)
+    chunks = [page_numbers[i::workers] for i in range(workers)]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(fn, pdf_bytes, chunk, dpi) for chunk in chunks]
+        return [item for future in futures for item in future.result()]
+    except (OSError, RuntimeError):
+        # No process support (e.g. serverless sandbox) or a broken pool: do it here instead
+        _pool = None
+        return fn(pdf_bytes, page_numbers, dpi)
+
+
+def rank_pages(pdf_data):
+    """Scores the first PDF_MAX_PAGES pages. Returns [(page_number, score)], best first."""
+    import fitz
+
+    pdf_bytes = pdf_data if isinstance(pdf_data, (bytes, bytearray)) else bytes(pdf_data)
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = min(doc.page_count, PDF_MAX_PAGES)
+    doc.close()
+    if page_count == 0:
+        raise ValueError("PDF has no pages")
+    if page_count == 1:
+        return [(0, 0.0)]
+    scores = _run_chunked(_score_pages, pdf_bytes, list(range(page_count)), PDF_SCORE_DPI)
+    # Ties go to the earlier page
+    return sorted(scores, key=lambda item: (-item[1], item[0]))
+
+
+def render_pages(pdf_data, page_numbers, dpi=PDF_DPI):
+    """Renders the given pages to PNG in parallel. Returns [(page_number, png_bytes)] in the given order."""
+    rendered = _render(pdf_data, page_numbers, dpi)
+    return [(page_number, rendered[page_number][0]) for page_number in page_numbers]
+
+
+def _render(pdf_data, page_numbers, dpi, analysis_edge=0):
+    """{page_number: (png_bytes, raster)} for the given pages (see _render_pages)."""
+    pdf_bytes = pdf_data if isinstance(pdf_data, (bytes, bytearray)) else bytes(pdf_data)
+    render = functools.partial(_render_pages, analysis_edge=analysis_edge)
+    return {page_number: (png, raster)
+            for page_number, png, raster in _run_chunked(render, pdf_bytes, list(page_numbers), dpi)}
+
+
+def _stack_vertically(images):
+    from PIL import Image
+    pages = [Image.open(io.BytesIO(png)) for png in images]
+    sheet = Image.new("RGB", (max(p.width for p in pages), sum(p.height for p in pages)), "white")
+    top = 0
+    for page in pages:
+        sheet.paste(page, (0, top))
+        top += page.height
+    out = io.BytesIO()
+    sheet.save(out, format="PNG")
+    return out.getvalue()
+
+
+def render_best_pages(pdf_data, count=PDF_UPSTREAM_PAGES):
+    """PNG of the page most likely to be the data page (or the top `count`, stacked top to bottom)."""
+    return render_upstream_image(pdf_data, 0, count)[0]
+
+
+def render_upstream_image(pdf_data, analysis_edge, count=PDF_UPSTREAM_PAGES):
+    """render_best_pages(), plus a grayscale raster of the best page for the quality gate. Returns (png, raster).
+
+    The raster comes straight from PyMuPDF at most analysis_edge pixels on its long side (see
+    _analysis_raster), so the gate never decodes the PNG; it is None when analysis_edge is 0.
+    """
+    ranked = rank_pages(pdf_data)
+    chosen = sorted(page_number for page_number, _ in ranked[:max(1, count)])
+    rendered = _render(pdf_data, chosen, PDF_DPI, analysis_edge)
+    images = [rendered[page_number][0] for page_number in chosen]
+    png = images[0] if len(images) == 1 else _stack_vertically(images)
+    return png, rendered[ranked[0][0]][1]
+
+
+def render_passport_pages(pdf_data):
+    """Renders every page that scores as a passport data page (at least the best one).
+
+    Returns [(page_number, png_bytes)] in page order, for multi-applicant PDFs.
+    """
+    ranked = rank_pages(pdf_data)
+    chosen = sorted(page_number for page_number, score in ranked if score >= PDF_PASSPORT_SCORE)
+    return render_pages(pdf_data, chosen or [ranked[0][0]])
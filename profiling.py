@@ -0,0 +1,214 @@
+import io
+import os
+import sys
+import time
+import marshal
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+
+# --- ON-DEMAND PROFILING SETTINGS ---
+# The admin endpoints (/api/v1/admin/...) profile a live worker on request. Until armed, the
+# only cost per request is the in-flight counter and one integer check.
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "1000"))
+# Longest stack sampling run, and the default gap between samples
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# From Python 3.12 cProfile runs on sys.monitoring: a Profile sees every thread, and only one
+# may be active in the process. Before that, a Profile only sees the thread that enabled it.
+_PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+def _profile_slot():
+    """Which Profile a request on this thread belongs to: its thread's, or the one process-wide."""
+    return threading.get_ident() if _PROFILE_PER_THREAD else None
+
+
+class RequestProfiler:
+    """Profiles the next N requests with cProfile and adds them up into one pstats.Stats.
+
+    A Profile stays on as long as any profiled request it covers is running, and so also
+    counts whatever else runs meanwhile. Up to Python 3.11 it only sees the thread it is
+    enabled on, so each thread running profiled requests gets one (a Flask request has its
+    thread to itself; the event loop's is shared) and work handed to other threads is not
+    included. From 3.12 one Profile covers every thread and is shared by all requests. If
+    another profiler is already active, requests are not profiled.
+    """
+
+    def __init__(self):
+        # Read without the lock on every request: 0 means off
+        self.remaining = 0
+        self.requested = 0
+        self.profiled = 0
+        self._active = {}
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def arm(self, count):
+        """Profiles the next count requests, discarding earlier results."""
+        with self._lock:
+            self.remaining = self.requested = count
+            self.profiled = 0
+            self._stats = None
+
+    def disarm(self):
+        """Stops profiling new requests and discards the results; requests already profiled finish normally."""
+        with self._lock:
+            self.remaining = self.requested = self.profiled = 0
+            self._stats = None
+
+    def start(self):
+        """Starts profiling the request beginning on this thread. Returns False if it isn't profiled."""
+        slot = _profile_slot()
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            entry = self._active.get(slot)
+            if entry is None:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiler (a debugger, coverage, py-spy in-process) holds the hook
+                    return False
+                entry = self._active[slot] = [profile, 0]
+            self.remaining -= 1
+            entry[1] += 1
+        return True
+
+    def stop(self):
+        """Ends a request start() profiled, on the same thread."""
+        slot = _profile_slot()
+        with self._lock:
+            entry = self._active[slot]
+            entry[1] -= 1
+            self.profiled += 1
+            if entry[1]:
+                return
+            del self._active[slot]
+            entry[0].disable()
+            if self._stats is None:
+                self._stats = pstats.Stats(entry[0])
+            else:
+                self._stats.add(entry[0])
+
+    def status(self):
+        with self._lock:
+            return {"requested": self.requested, "remaining": self.remaining, "profiled": self.profiled,
+                    "running": sum(count for _, count in self._active.values()),
+                    "complete": self.requested > 0 and self.remaining == 0 and not self._active}
+
+    def pstats_dump(self):
+        """The collected profile in the binary format pstats.Stats() and snakeviz load, or None."""
+        with self._lock:
+            return marshal.dumps(self._stats.stats) if self._stats is not None else None
+
+    def text(self, sort="cumulative", limit=50):
+        """The collected profile as pstats' text table, or None."""
+        out = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return None
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+profiler = RequestProfiler()
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def request_started(profile=True):
+    """Called as every request starts. Returns whether it is being profiled; pass that to request_finished()."""
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    return profile and profiler.remaining > 0 and profiler.start()
+
+
+def request_finished(profiled):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+    if profiled:
+        profiler.stop()
+
+
+def requests_in_flight():
+    """Requests this worker is handling right now (streamed responses count until their headers are sent)."""
+    return _in_flight
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=PROFILE_SAMPLE_INTERVAL):
+    """Samples every thread's stack for seconds (wall clock, so waiting shows up too).
+
+    Returns collapsed stacks, one "thread;outermost;...;innermost count" line per distinct
+    stack, which flamegraph.pl, speedscope and similar tools read directly.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def rss_bytes():
+    """This process's resident set size."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: the peak is the best we have (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def start_tracing(frames=1):
+    """Starts tracemalloc (it slows allocations down while on). Stop it with tracemalloc.stop()."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def memory_report(limit=20):
+    """RSS, and the top allocation sites by size when tracemalloc is tracing."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = {
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024,
+        "tracemalloc": None,
+    }
+    if tracemalloc.is_tracing():
+        current, traced_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        report["tracemalloc"] = {
+            "current_bytes": current,
+            "peak_bytes": traced_peak,
+            "top": [{"where": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:limit]],
+        }
+    return report
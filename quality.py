@@ -0,0 +1,149 @@
+import io
+import os
+import base64
+
+from PIL import Image
+
+# --- IMAGE QUALITY GATE SETTINGS ---
+# Uploads that can't yield a passport (blank scans, heavy blur, thumbnails, pitch-black or
+# blown-out photos) are turned away with a 422 before the paid upstream call. Sharpness,
+# contrast and blankness are measured on a grayscale copy at most QUALITY_ANALYSIS_EDGE
+# pixels on its long side, so the thresholds don't depend on the upload's resolution.
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1") != "0"
+QUALITY_ANALYSIS_EDGE = int(os.getenv("QUALITY_ANALYSIS_EDGE", "512"))
+# Shortest side of the upload itself, in pixels
+QUALITY_MIN_EDGE = int(os.getenv("QUALITY_MIN_EDGE", "480"))
+# Variance of the Laplacian: low means no sharp edges anywhere (out of focus, motion blur)
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "15"))
+# Share of pixels that differ clearly from the background; below this the page is empty
+QUALITY_MIN_INK = float(os.getenv("QUALITY_MIN_INK", "0.004"))
+# Spread between the 1st and 99.5th percentile gray levels. Wide percentiles, so that the
+# sparse black text of a clean white page (1-2% of its pixels) still counts.
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "40"))
+# Share of pixels crushed to black / blown out to white. A page that is mostly paper white
+# is only overexposed if there is also next to no dark ink left on it.
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.6"))
+
+# Gray levels away from the median that count as ink rather than paper
+INK_DISTANCE = 40
+# An empty frame with a median gray below this is a dark photo rather than a blank page
+DARK_MEDIAN = 48
+# Gray levels below this are dark ink, the print a blown-out photo has washed away
+DARK_INK = 128
+
+REASONS = {
+    "too_small": "Image resolution is too low to read the passport",
+    "blank": "Image appears to be blank",
+    "underexposed": "Image is too dark",
+    "overexposed": "Image is overexposed",
+    "low_contrast": "Image contrast is too low to read the passport",
+    "blurry": "Image is too blurry to read the passport",
+}
+
+
+class UnusableImage(ValueError):
+    """The upload can't yield a passport. Routes answer 422 with the reason code and measurements."""
+
+    def __init__(self, reason, measurements):
+        super().__init__(REASONS[reason])
+        self.reason = reason
+        self.measurements = measurements
+
+
+def _analysis_image(data):
+    """Decodes an upload to grayscale, at most QUALITY_ANALYSIS_EDGE on its long side. Returns (pixels, size)."""
+    import numpy as np  # imported on first use: it adds a lot to cold start
+
+    raw = base64.b64decode(data) if isinstance(data, str) else data
+    img = Image.open(io.BytesIO(raw))
+    size = img.size
+    # JPEG decodes straight to grayscale at 1/2, 1/4 or 1/8 scale, skipping most of the work.
+    # Other formats are decoded in full first: ~0.6 s for a 12 MP PNG, against ~15 ms for a JPEG
+    img.draft("L", (QUALITY_ANALYSIS_EDGE, QUALITY_ANALYSIS_EDGE))
+    img = img.convert("L")
+    factor = -(-max(img.size) // QUALITY_ANALYSIS_EDGE)
+    if factor > 1:
+        img = img.reduce(factor)
+    return np.asarray(img), size
+
+
+def measure(gray, size):
+    """Quality measurements of a 2-D uint8 grayscale array (size is the original (width, height))."""
+    import numpy as np
+
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    cumulative = np.cumsum(histogram) / gray.size
+    p1, median, p99 = (int(np.searchsorted(cumulative, q)) for q in (0.01, 0.5, 0.995))
+    ink = histogram[:max(0, median - INK_DISTANCE)].sum() + histogram[median + INK_DISTANCE + 1:].sum()
+
+    # 4-neighbour Laplacian on int16, all slices of the same array: no padding copies
+    pixels = gray.astype(np.int16)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return {
+        "width": size[0],
+        "height": size[1],
+        "sharpness": round(float(laplacian.var()), 1) if laplacian.size else 0.0,
+        "ink": round(float(ink / gray.size), 4),
+        "contrast": p99 - p1,
+        "brightness": median,
+        "dark": round(float(cumulative[8]), 4),
+        "bright": round(float(1 - cumulative[246]), 4),
+        "dark_ink": round(float(cumulative[DARK_INK - 1]), 4),
+    }
+
+
+def verdict(measurements):
+    """The reason code for rejecting an image with these measurements, or None if it's usable."""
+    if min(measurements["width"], measurements["height"]) < QUALITY_MIN_EDGE:
+        return "too_small"
+    if measurements["ink"] < QUALITY_MIN_INK:
+        # Nothing on it: an empty page, or a frame too dark to show anything
+        return "underexposed" if measurements["brightness"] < DARK_MEDIAN else "blank"
+    if measurements["dark"] > QUALITY_MAX_CLIPPED:
+        return "underexposed"
+    if measurements["bright"] > QUALITY_MAX_CLIPPED and measurements["dark_ink"] < QUALITY_MIN_INK:
+        # Clipped highlights alone are just white paper; washed-out print is what makes it unreadable
+        return "overexposed"
+    if measurements["contrast"] < QUALITY_MIN_CONTRAST:
+        return "low_contrast"
+    if measurements["sharpness"] < QUALITY_MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+
+def check_image(data):
+    """Raises UnusableImage for an upload that isn't worth an LLM call. Returns the measurements otherwise.
+
+    data is raw bytes (any buffer) or a base64 str. Images Pillow can't decode pass unchecked
+    (None is returned): the upstream may still read formats we can't.
+    """
+    if not QUALITY_GATE:
+        return None
+    try:
+        gray, size = _analysis_image(data)
+    except Exception:
+        return None
+    return _judge(gray, size)
+
+
+def check_raster(samples, width, height, size):
+    """check_image() for a grayscale raster already at analysis size, such as a PyMuPDF pixmap's samples.
+
+    samples holds height rows of (at least) width bytes; size is the (width, height) of the
+    full-resolution image it stands in for.
+    """
+    import numpy as np
+
+    if not QUALITY_GATE:
+        return None
+    gray = np.frombuffer(samples, dtype=np.uint8).reshape(height, -1)[:, :width]
+    return _judge(gray, size)
+
+
+def _judge(gray, size):
+    measurements = measure(gray, size)
+    reason = verdict(measurements)
+    if reason is not None:
+        raise UnusableImage(reason, measurements)
+    return measurements
@@ -0,0 +1,226 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+import deadlines
+from cache import CACHE_DB_PATH, private_db_file
+
+# --- IN-FLIGHT COALESCING SETTINGS ---
+# Identical uploads arriving while one is already being extracted wait for that call
+# instead of paying the upstream again (double clicks, client retries on timeout).
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") != "0"
+# Also coalesce across gunicorn workers: the first worker claims the key in a SQLite table,
+# the others poll until it is released and then read the answer from the result cache.
+SINGLEFLIGHT_ACROSS_WORKERS = os.getenv("SINGLEFLIGHT_ACROSS_WORKERS", "0") == "1"
+SINGLEFLIGHT_DB_PATH = os.getenv("SINGLEFLIGHT_DB_PATH", CACHE_DB_PATH)
+SINGLEFLIGHT_POLL = float(os.getenv("SINGLEFLIGHT_POLL", "0.1"))
+# A claim older than this belongs to a worker that died mid-call and is ignored
+SINGLEFLIGHT_STALE = float(os.getenv("SINGLEFLIGHT_STALE", "180"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its result or error.
+
+    do() coalesces threads, do_async() coalesces tasks on the event loop. With across_workers,
+    callers in other processes wait for the claim to clear and then try recheck() (a cache
+    lookup) before making a call of their own.
+    """
+
+    def __init__(self, enabled=SINGLEFLIGHT_ENABLED, across_workers=SINGLEFLIGHT_ACROSS_WORKERS,
+                 db_path=SINGLEFLIGHT_DB_PATH, poll=SINGLEFLIGHT_POLL, stale=SINGLEFLIGHT_STALE):
+        self.enabled = enabled
+        self.across_workers = across_workers
+        self.db_path = db_path
+        self.poll = poll
+        self.stale = stale
+
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {"leaders": 0, "joined": 0, "joined_across_workers": 0, "waited_across_workers": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # --- cross-worker claims ---
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            private_db_file(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, pid INTEGER, started_at REAL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _claim(self, key):
+        """True if this worker now owns key (or coordination is unavailable), False if another does."""
+        try:
+            db = self._db()
+            db.execute("DELETE FROM inflight WHERE key = ? AND started_at < ?", (key, time.time() - self.stale))
+            return db.execute("INSERT OR IGNORE INTO inflight (key, pid, started_at) VALUES (?, ?, ?)",
+                              (key, os.getpid(), time.time())).rowcount == 1
+        except sqlite3.Error:
+            # Never fail an extraction over coordination: just make the call
+            return True
+
+    def _release(self, key):
+        try:
+            self._db().execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (key, os.getpid()))
+        except sqlite3.Error:
+            pass
+
+    def _remote_done(self, key):
+        try:
+            row = self._db().execute("SELECT started_at FROM inflight WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return True
+        return row is None or row[0] < time.time() - self.stale
+
+    def _lead(self, key, fn, recheck):
+        """Makes the call for this worker, first waiting out another worker's claim if there is one."""
+        if not self.across_workers or recheck is None:
+            return fn(), None
+        waited = False
+        while not self._claim(key):
+            if not waited:
+                self._count("waited_across_workers")
+                waited = True
+            while not self._remote_done(key):
+                # The other worker's call may outlast what this request has left
+                deadlines.check("queue")
+                time.sleep(self.poll)
+            cached = recheck()
+            if cached is not None:
+                self._count("joined_across_workers")
+                return cached, "remote"
+        try:
+            return fn(), None
+        finally:
+            self._release(key)
+
+    async def _lead_async(self, key, fn, recheck):
+        if not self.across_workers or recheck is None:
+            return await fn(), None
+        loop = asyncio.get_running_loop()
+        waited = False
+        while not await loop.run_in_executor(None, self._claim, key):
+            if not waited:
+                self._count("waited_across_workers")
+                waited = True
+            while not await loop.run_in_executor(None, self._remote_done, key):
+                deadlines.check("queue")
+                await asyncio.sleep(self.poll)
+            cached = await recheck()
+            if cached is not None:
+                self._count("joined_across_workers")
+                return cached, "remote"
+        try:
+            return await fn(), None
+        finally:
+            await loop.run_in_executor(None, self._release, key)
+
+    # --- public API ---
+    def do(self, key, fn, recheck=None, abandoned=()):
+        """Returns (fn(), None) for the first caller of key, (that result, "local"|"remote") for the rest.
+
+        Errors are shared too: callers that joined an in-flight call get its exception, except
+        the abandoned types (the first caller gave up for its own reasons), after which they retry.
+        """
+        if not self.enabled:
+            return fn(), None
+
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.counters["leaders"] += 1
+            if leader:
+                break
+            # Joiners keep their own deadline, whatever the first caller's is
+            if not call.done.wait(deadlines.remaining()):
+                raise deadlines.exceeded("queue")
+            if isinstance(call.error, abandoned):
+                continue
+            self._count("joined")
+            if call.error is not None:
+                raise call.error
+            return call.result[0], "local"
+
+        try:
+            call.result = self._lead(key, fn, recheck)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, recheck=None, abandoned=()):
+        """do() for coroutines: fn and recheck are async callables. A cancelled first caller counts as abandoned."""
+        if not self.enabled:
+            return await fn(), None
+
+        while key in self._tasks:
+            future = self._tasks[key]
+            try:
+                # shield: a caller whose client went away must not cancel the shared call
+                result, _ = await asyncio.wait_for(asyncio.shield(future), deadlines.remaining())
+            except asyncio.TimeoutError:
+                raise deadlines.exceeded("queue") from None
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            except Exception:
+                self._count("joined")
+                raise
+            self._count("joined")
+            return result, "local"
+
+        future = self._tasks[key] = asyncio.get_running_loop().create_future()
+        self._count("leaders")
+        try:
+            outcome = await self._lead_async(key, fn, recheck)
+            future.set_result(outcome)
+            return outcome
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except abandoned:
+            # Joiners retry on their own rather than inherit this caller's reason to give up
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't let asyncio log an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._tasks[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self._calls) + len(self._tasks)
+        stats["upstream_calls_saved"] = stats["joined"] + stats["joined_across_workers"]
+        return stats
+
+
+in_flight = SingleFlight()
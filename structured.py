@@ -0,0 +1,77 @@
+import os
+import json
+
+# --- STRUCTURED OUTPUT SETTINGS ---
+# EXTRACTION_MODE=structured asks for the answer through the upstream's JSON-schema
+# response_format, with a compact prompt and short keys, instead of the long free-text
+# prompt ("prompt"). Constrained decoding can't add fences or prose around the JSON, and
+# fewer tokens go each way. Only providers supporting the parameters are routed to.
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "prompt")
+STRUCTURED_OUTPUT = EXTRACTION_MODE == "structured"
+# Ceiling on answer tokens in structured mode: a full answer takes ~150
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "400"))
+
+# Key the model answers with -> the field name the API returns, in output order
+FIELDS = {
+    "fn": "first_name",
+    "ln": "last_name",
+    "dob": "Date of Birth",
+    "doi": "Date of Issue",
+    "nat": "Nationality",
+    "poi": "place of passport issuance",
+    "mn": "middle name",
+    "sex": "gender",
+    "pob": "place of birth",
+    "auth": "issuing authority",
+    "doe": "Date of Expiry",
+    "pn": "passport_number",
+    "pers": "personal_number",
+    "dn": "document_number",
+}
+
+STRUCTURED_PROMPT = (
+    "Extract the passport in the image. Keys: "
+    + ", ".join(f"{key}={name}" for key, name in FIELDS.items())
+    + ". Dates as printed. \"\" for a field that is absent."
+)
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "passport",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {key: {"type": "string", "enum": ["male", "female", ""]} if key == "sex"
+                           else {"type": "string"} for key in FIELDS},
+            "required": list(FIELDS),
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def structured_request(payload):
+    """Turns an extraction payload into a structured one: compact prompt, response schema, token budget."""
+    payload["messages"][0]["content"][0]["text"] = STRUCTURED_PROMPT
+    payload["response_format"] = RESPONSE_FORMAT
+    payload["max_tokens"] = MAX_OUTPUT_TOKENS
+    payload["reasoning"] = {"enabled": False}
+    payload["provider"]["require_parameters"] = True
+    return payload
+
+
+def field_name(key):
+    """The API's name for a key in a model's answer."""
+    return FIELDS.get(key, key)
+
+
+def expand_keys(text):
+    """A structured answer with the API's field names, as a JSON string. Anything but a JSON object is returned as is."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(data, dict):
+        return text
+    return json.dumps({field_name(key): value for key, value in data.items()})
@@ -0,0 +1,96 @@
+import io
+import os
+import math
+import json
+import base64
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# --- BULK TILING SETTINGS ---
+# Opt-in bulk mode for the batch endpoint: TILE_COUNT documents are pasted into one labelled
+# grid and extracted with a single upstream call, trading per-document latency (and some
+# resolution per document) for fewer calls and fewer image tokens per document.
+TILE_COUNT = int(os.getenv("TILE_COUNT", "4"))
+TILE_MAX_COUNT = int(os.getenv("TILE_MAX_COUNT", "9"))
+# Each document is fitted into a TILE_EDGE x TILE_EDGE cell
+TILE_EDGE = int(os.getenv("TILE_EDGE", "1000"))
+TILE_QUALITY = int(os.getenv("TILE_QUALITY", "85"))
+
+# Height of the black bar carrying each tile's number
+LABEL_HEIGHT = 64
+GAP = 16
+
+
+def tile_grid(count):
+    """(columns, rows) of the most square grid that holds count tiles."""
+    columns = math.ceil(math.sqrt(count))
+    return columns, math.ceil(count / columns)
+
+
+def _open(data):
+    raw = base64.b64decode(data) if isinstance(data, str) else data
+    img = Image.open(io.BytesIO(raw))
+    img.draft("RGB", (TILE_EDGE, TILE_EDGE))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((TILE_EDGE, TILE_EDGE), Image.LANCZOS)
+    return img
+
+
+def compose_tiles(images):
+    """Pastes images (raw bytes or base64 str) into one labelled grid. Returns (jpeg_bytes, mime_type).
+
+    Tile k (numbered from 1, left to right, top to bottom) sits under a black bar reading "k".
+    """
+    columns, rows = tile_grid(len(images))
+    cell_width, cell_height = TILE_EDGE + GAP, TILE_EDGE + LABEL_HEIGHT + GAP
+    sheet = Image.new("RGB", (columns * cell_width - GAP, rows * cell_height - GAP), "white")
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=LABEL_HEIGHT - 16)
+
+    for position, data in enumerate(images):
+        left, top = (position % columns) * cell_width, (position // columns) * cell_height
+        draw.rectangle([left, top, left + TILE_EDGE - 1, top + LABEL_HEIGHT - 1], fill="black")
+        draw.text((left + 16, top + 8), str(position + 1), fill="white", font=font)
+        img = _open(data)
+        sheet.paste(img, (left + (TILE_EDGE - img.width) // 2, top + LABEL_HEIGHT))
+
+    out = io.BytesIO()
+    sheet.save(out, format="JPEG", quality=TILE_QUALITY, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+
+def parse_tiles(text, count, fields):
+    """Maps a model's JSON array answer back to tiles. Returns {tile_number: fields_dict}.
+
+    Tiles are matched by their "tile" number (falling back to array position). A tile is left
+    out if its object is missing, malformed, lacks any of the expected fields or is entirely
+    empty, so the caller can retry it on its own.
+    """
+    try:
+        answer = json.loads(text)
+    except ValueError:
+        return {}
+    if isinstance(answer, dict):
+        # Some models wrap the array: {"passports": [...]}
+        answer = next((value for value in answer.values() if isinstance(value, list)), [])
+    if not isinstance(answer, list):
+        return {}
+
+    tiles = {}
+    for position, entry in enumerate(answer, 1):
+        if not isinstance(entry, dict):
+            continue
+        number = entry.get("tile", position)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            continue
+        values = {field: entry.get(field) for field in fields}
+        if not 1 <= number <= count or number in tiles:
+            continue
+        if any(not isinstance(value, str) for value in values.values()) or not any(values.values()):
+            continue
+        tiles[number] = values
+    return tiles
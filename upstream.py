@@ -0,0 +1,245 @@
+import os
+import re
+import asyncio
+import json
+import base64
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- UPSTREAM CLIENT SETTINGS ---
+# Connect and read timeouts are kept separate: a dead host should fail fast,
+# while the model itself is allowed a long (but finite) time to answer.
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "90"))
+
+# How many pooled keep-alive connections each worker keeps to the upstream.
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+
+# Retry policy for 429/5xx and connection failures. The budget caps the total
+# seconds a single call may spend sleeping between attempts.
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+RETRY_BUDGET = float(os.getenv("UPSTREAM_RETRY_BUDGET", "15"))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connections the async client may hold open; one per in-flight call in the ASGI app.
+ASYNC_POOL_SIZE = int(os.getenv("UPSTREAM_ASYNC_POOL_SIZE", "256"))
+
+
+# Stand-in for the image data URL while the rest of the request body is serialized
+IMAGE_PLACEHOLDER = "__IMAGE_DATA_URL__"
+_BASE64_RE = re.compile(rb"[A-Za-z0-9+/]*={0,2}")
+_MIME_RE = re.compile(r"[\w.+-]+/[\w.+-]+")
+
+
+def build_chat_body(payload, image_data, mime_type):
+    """Serializes a chat-completions payload to bytes, splicing the image in as a base64 data URL.
+
+    image_data is either raw bytes (any buffer: bytes, memoryview, mmap) or an already
+    base64-encoded str. Raw bytes are base64-encoded here, exactly once, straight into
+    the body instead of going through an intermediate str and json.dumps copy.
+    """
+    if not _MIME_RE.fullmatch(mime_type or ""):
+        raise ValueError(f"Invalid mime type: {mime_type!r}")
+
+    if isinstance(image_data, str):
+        try:
+            encoded = image_data.encode("ascii")
+        except UnicodeEncodeError:
+            raise ValueError("Image data is not valid base64")
+        # Client-supplied base64 goes into the JSON body verbatim, so it must be clean
+        if not _BASE64_RE.fullmatch(encoded):
+            encoded = base64.b64encode(base64.b64decode(encoded))
+    else:
+        encoded = base64.b64encode(image_data)
+
+    head, tail = json.dumps(payload).split(IMAGE_PLACEHOLDER)
+    return b"".join([head.encode("utf-8"), f"data:{mime_type};base64,".encode("ascii"), encoded, tail.encode("utf-8")])
+
+
+def retry_after_seconds(response):
+    """Reads a Retry-After header (seconds or HTTP date) and returns seconds, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt):
+    """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP client for the OpenRouter API, shared by all threads of a worker."""
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, url, headers=None, json=None, data=None, timeout=None, stream=False):
+        """POSTs to the upstream, retrying 429/5xx and connection errors within the retry budget.
+
+        With stream=True the body is left unread; retries only happen before the first byte.
+        """
+        timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        slept = 0.0
+        attempt = 0
+
+        while True:
+            try:
+                response = self.session.post(url, headers=headers, json=json, data=data, timeout=timeout, stream=stream)
+            except requests.ConnectionError:
+                # Covers connect timeouts too. A read timeout is deliberately not retried:
+                # the model may still be working (and billing us) on the first attempt.
+                delay = _backoff_seconds(attempt)
+                if attempt >= MAX_RETRIES or slept + delay > RETRY_BUDGET:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = _backoff_seconds(attempt)
+                if attempt >= MAX_RETRIES or slept + delay > RETRY_BUDGET:
+                    return response
+                # Release the connection back to the pool before sleeping
+                response.close()
+
+            time.sleep(delay)
+            slept += delay
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """asyncio counterpart of UpstreamClient on httpx, for the ASGI app (asgi.py).
+
+    One pooled client per worker holds many calls in flight at once, so the pool is sized
+    for concurrent requests (ASYNC_POOL_SIZE) rather than threads. Same timeouts and retry policy.
+    """
+
+    def __init__(self, pool_size=ASYNC_POOL_SIZE):
+        import httpx  # only the ASGI app needs it
+
+        self._retryable = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def post(self, url, headers=None, json=None, data=None, timeout=None, stream=False):
+        """POSTs to the upstream, retrying 429/5xx and connection errors within the retry budget.
+
+        With stream=True the body is left unread (aclose() the response when done).
+        """
+        request = self.client.build_request("POST", url, headers=headers, json=json, content=data,
+                                            timeout=timeout or self.client.timeout)
+        slept = 0.0
+        attempt = 0
+
+        while True:
+            try:
+                response = await self.client.send(request, stream=stream)
+            except self._retryable:
+                # As in UpstreamClient, read timeouts are not retried
+                delay = _backoff_seconds(attempt)
+                if attempt >= MAX_RETRIES or slept + delay > RETRY_BUDGET:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = _backoff_seconds(attempt)
+                if attempt >= MAX_RETRIES or slept + delay > RETRY_BUDGET:
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(delay)
+            slept += delay
+            attempt += 1
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _stream_deltas(line, usage, response):
+    """Parses one SSE line of a streamed chat completion. Returns its text deltas, or None at [DONE]."""
+    # Blank lines separate events; ':' lines are keep-alive comments
+    if not line or line.startswith(":") or not line.startswith("data:"):
+        return []
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    if "error" in chunk:
+        raise requests.HTTPError(f"Upstream stream error: {chunk['error']}", response=response)
+    if usage is not None and chunk.get("usage"):
+        usage.update(chunk["usage"])
+    return [content for choice in chunk.get("choices", [])
+            if (content := (choice.get("delta") or {}).get("content"))]
+
+
+def iter_stream_content(response, usage=None):
+    """Yields the text deltas of a streamed (SSE) chat completion. Fills usage from the final chunk."""
+    for line in response.iter_lines(decode_unicode=True):
+        deltas = _stream_deltas(line, usage, response)
+        if deltas is None:
+            break
+        yield from deltas
+
+
+async def aiter_stream_content(response, usage=None):
+    """Async iter_stream_content for an httpx streaming response."""
+    async for line in response.aiter_lines():
+        deltas = _stream_deltas(line, usage, response)
+        if deltas is None:
+            break
+        for content in deltas:
+            yield content
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_upstream_client():
+    """Returns this worker's shared UpstreamClient, creating it on first use (and again after a fork)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = UpstreamClient()
+                _client_pid = pid
+    return _client
+
+
+_async_client = None
+
+
+def get_async_upstream_client():
+    """Returns this worker's shared AsyncUpstreamClient. Call from the event loop that will use it."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncUpstreamClient()
+    return _async_client
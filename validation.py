@@ -0,0 +1,140 @@
+import io
+import os
+import re
+import json
+import base64
+from datetime import date
+
+from PIL import Image
+
+from mrz import parse_date
+
+# --- FIELD VALIDATION / RE-EXTRACTION SETTINGS ---
+# After an LLM answer, missing or implausible key fields are asked for again on their own:
+# a short prompt naming just those fields, over a crop of the document, merged into the answer.
+REEXTRACT_ENABLED = os.getenv("REEXTRACT_ENABLED", "1") != "0"
+# Fields that must be present; any validated field that is present but implausible is retried too
+REQUIRED_FIELDS = [field.strip() for field in
+                   os.getenv("REEXTRACT_REQUIRED", "passport_number,Date of Birth,Date of Expiry").split(",")
+                   if field.strip()]
+# Crop the follow-up image to the document (trimming background), and to its lower part
+# (text block and MRZ) when only fields printed there are asked for
+REEXTRACT_CROP = os.getenv("REEXTRACT_CROP", "1") != "0"
+REEXTRACT_QUALITY = int(os.getenv("REEXTRACT_QUALITY", "90"))
+
+DATE_FIELDS = ("Date of Birth", "Date of Issue", "Date of Expiry")
+# Fields repeated in the machine readable zone, at the bottom of a passport data page
+LOWER_FIELDS = {"passport_number", "document_number", "personal_number", "Date of Birth", "Date of Expiry",
+                "Date of Issue", "Nationality", "gender"}
+# Share of the document's height kept when cropping to its lower part
+LOWER_SHARE = 0.65
+
+_DOCUMENT_NUMBER_RE = re.compile(r"[A-Z0-9]{5,12}")
+
+
+def find_problems(data, today=None):
+    """Flags missing or implausible fields in an extraction. Returns {field: reason}.
+
+    Reasons: "missing" (required field empty), "bad_format" (a date we can't read, a document
+    number that isn't 5-12 letters/digits) and "implausible" (dates in an impossible order).
+    """
+    today = today or date.today()
+    problems = {}
+    for field in REQUIRED_FIELDS:
+        if not str(data.get(field) or "").strip():
+            problems[field] = "missing"
+
+    number = str(data.get("passport_number") or "").replace(" ", "").upper()
+    if number and not _DOCUMENT_NUMBER_RE.fullmatch(number):
+        problems["passport_number"] = "bad_format"
+
+    dates = {}
+    for field in DATE_FIELDS:
+        value = data.get(field)
+        if value and str(value).strip():
+            dates[field] = parse_date(str(value))
+            if dates[field] is None:
+                problems[field] = "bad_format"
+    birth, issue, expiry = (dates.get(field) for field in DATE_FIELDS)
+    if birth and (birth > today or (issue and birth > issue)):
+        problems["Date of Birth"] = "implausible"
+    if issue and expiry and expiry <= issue:
+        # Can't tell which of the two is wrong: ask for both
+        problems["Date of Issue"] = problems["Date of Expiry"] = "implausible"
+    return problems
+
+
+def followup_prompt(fields):
+    """The reduced prompt asking only for fields."""
+    schema = json.dumps({field: "" for field in fields}, indent=4)
+    return f"""
+    You are a strict data extraction API. Read ONLY these fields from the passport image: {", ".join(fields)}.
+    Check them against the machine readable zone (the two lines of '<' characters) where it is visible.
+    Write dates exactly as printed in the visual zone. Leave a field empty if it is not visible.
+
+    Do not describe the image, do not use markdown, and answer with a raw JSON object
+    using exactly this schema:
+    {schema}
+    """
+
+
+def _content_box(image):
+    """Bounding box (left, top, right, bottom) of what differs from the border color in a grayscale image, or None."""
+    import numpy as np  # imported on first use: it adds a lot to cold start
+
+    gray = np.asarray(image)
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    background = int(np.median(border))
+    content = np.abs(gray.astype(np.int16) - background) > 30
+    rows, columns = np.flatnonzero(content.any(axis=1)), np.flatnonzero(content.any(axis=0))
+    if rows.size == 0 or columns.size == 0:
+        return None
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+
+def crop_for_fields(data, mime_type, fields):
+    """The image to re-read fields from: the document trimmed of background, and only its lower
+    part when every field is printed there. Returns (image_bytes, mime_type); the input if no crop helps.
+    """
+    if not REEXTRACT_CROP:
+        return data, mime_type
+    try:
+        raw = base64.b64decode(data) if isinstance(data, str) else data
+        img = Image.open(io.BytesIO(raw))
+        img.load()
+        scale = max(1, max(img.size) // 512)
+        box = _content_box(img.convert("L").reduce(scale))
+    except Exception:
+        return data, mime_type
+    left, top, right, bottom = [int(edge) * scale for edge in box] if box else (0, 0, img.width, img.height)
+    # A little margin, so characters on the edge of the content aren't clipped
+    margin = 2 * scale
+    left, top = max(0, left - margin), max(0, top - margin)
+    right, bottom = min(img.width, right + margin), min(img.height, bottom + margin)
+    if set(fields) <= LOWER_FIELDS:
+        top = bottom - int((bottom - top) * LOWER_SHARE)
+    if (left, top, right, bottom) == (0, 0, img.width, img.height):
+        return data, mime_type
+
+    out = io.BytesIO()
+    img.crop((left, top, right, bottom)).convert("RGB").save(out, format="JPEG", quality=REEXTRACT_QUALITY)
+    return out.getvalue(), "image/jpeg"
+
+
+def merge_fields(data, answer, problems):
+    """Takes the re-read values that fix a problem. Returns (merged_data, fixed_fields)."""
+    if not isinstance(answer, dict):
+        return data, []
+    merged = dict(data)
+    candidates = {field: answer[field] for field in problems
+                  if isinstance(answer.get(field), str) and answer[field].strip()}
+    merged.update(candidates)
+    still_wrong = find_problems(merged)
+    fixed = []
+    for field, value in candidates.items():
+        if field in still_wrong:
+            # The new value is no better: keep what the first answer said
+            merged[field] = data.get(field, "")
+        else:
+            fixed.append(field)
+    return merged, fixed